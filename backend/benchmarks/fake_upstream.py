@@ -0,0 +1,380 @@
+"""
+Local stand-in for the Azure OpenAI Assistants API and OpenAI chat completions.
+
+Implements the subset of endpoints the routers use, with configurable latency:
+
+    threads create, messages create/list, runs create (optionally streamed),
+    runs retrieve/cancel, chat completions (optionally streamed, images accepted)
+
+Faults can be injected to exercise retries, hedging and circuit breaking:
+error responses, slow responses, failed runs and runs stuck in
+requires_action, each at a configurable rate. They are read from FAKE_*
+environment variables and can be changed while running through
+GET/POST /_faults.
+
+Routes are served under both /openai (Azure) and /v1 (OpenAI) prefixes. Point
+the backend at it with:
+
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:9100
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+
+Run standalone with `python -m benchmarks.fake_upstream --port 9100`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeUpstreamConfig:
+    """Latency, reply and fault settings, read from FAKE_* environment variables"""
+
+    def __init__(self):
+        self.run_latency = float(os.getenv("FAKE_RUN_LATENCY", "1.0"))
+        self.chat_latency = float(os.getenv("FAKE_CHAT_LATENCY", "0.5"))
+        self.request_latency = float(os.getenv("FAKE_REQUEST_LATENCY", "0.02"))
+        self.token_interval = float(os.getenv("FAKE_TOKEN_INTERVAL", "0.01"))
+        self.reply_words = int(os.getenv("FAKE_REPLY_WORDS", "120"))
+        # Fault injection (rates are probabilities per request or per run)
+        self.error_rate = float(os.getenv("FAKE_ERROR_RATE", "0"))
+        self.error_statuses = [int(code) for code in os.getenv("FAKE_ERROR_STATUSES", "500,503,429").split(",")]
+        self.slow_rate = float(os.getenv("FAKE_SLOW_RATE", "0"))
+        self.slow_latency = float(os.getenv("FAKE_SLOW_LATENCY", "5.0"))
+        self.run_failure_rate = float(os.getenv("FAKE_RUN_FAILURE_RATE", "0"))
+        self.requires_action_rate = float(os.getenv("FAKE_REQUIRES_ACTION_RATE", "0"))
+
+    def update(self, values: dict):
+        for name, value in values.items():
+            current = getattr(self, name, None)
+            if current is None or name.startswith("_"):
+                raise HTTPException(status_code=400, detail=f"Unknown setting {name}")
+            setattr(self, name, [int(code) for code in value] if isinstance(current, list) else type(current)(value))
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+config = FakeUpstreamConfig()
+
+# In-memory state
+threads = {}
+runs = {}
+
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+def reply_text() -> str:
+    words = ("The findings are consistent with a stable presentation and no acute abnormality. "
+             "Please consult a healthcare professional for specific advice.").split()
+    return " ".join(words[i % len(words)] for i in range(config.reply_words))
+
+
+def message_object(thread_id: str, role: str, text: str, run_id: str = None) -> dict:
+    return {
+        "id": new_id("msg"),
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "status": "completed",
+        "run_id": run_id,
+        "assistant_id": None,
+        "attachments": [],
+        "metadata": {},
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+    }
+
+
+def run_object(run: dict) -> dict:
+    return {
+        "id": run["id"],
+        "object": "thread.run",
+        "created_at": int(run["created_at"]),
+        "thread_id": run["thread_id"],
+        "assistant_id": run["assistant_id"],
+        "status": run["status"],
+        "instructions": "",
+        "model": "fake-model",
+        "tools": [],
+        "metadata": {},
+        "last_error": run.get("last_error"),
+        "required_action": run.get("required_action"),
+        "parallel_tool_calls": False,
+    }
+
+
+def pick_run_outcome() -> str:
+    roll = random.random()
+    if roll < config.run_failure_rate:
+        return "failed"
+    if roll < config.run_failure_rate + config.requires_action_rate:
+        return "requires_action"
+    return "completed"
+
+
+def finish_run(run: dict):
+    """Move a run into its injected outcome (completed unless a fault was picked)"""
+    run["status"] = run["outcome"]
+    if run["outcome"] == "failed":
+        run["last_error"] = {"code": "server_error", "message": "Injected run failure"}
+    elif run["outcome"] == "requires_action":
+        run["required_action"] = {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {"tool_calls": [{
+                "id": new_id("call"),
+                "type": "function",
+                "function": {"name": "lookup", "arguments": "{}"},
+            }]},
+        }
+
+
+def advance_run(run: dict):
+    """Finish a run once its latency has elapsed"""
+    if run["status"] in ("queued", "in_progress") and time.monotonic() >= run["completes_at"]:
+        finish_run(run)
+        if run["status"] == "completed":
+            threads[run["thread_id"]]["messages"].append(
+                message_object(run["thread_id"], "assistant", reply_text(), run["id"])
+            )
+    elif run["status"] == "queued":
+        run["status"] = "in_progress"
+
+
+def get_thread(thread_id: str) -> dict:
+    thread = threads.get(thread_id)
+    if thread is None:
+        raise HTTPException(status_code=404, detail="No thread found")
+    return thread
+
+
+def sse(event: str, data) -> str:
+    payload = data if isinstance(data, str) else json.dumps(data)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+router = APIRouter()
+
+# Runs that block new runs on their thread
+ACTIVE_RUN_STATUSES = ("queued", "in_progress", "requires_action")
+
+
+@router.post("/threads")
+async def create_thread():
+    await asyncio.sleep(config.request_latency)
+    thread_id = new_id("thread")
+    threads[thread_id] = {"messages": []}
+    return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+
+@router.post("/threads/{thread_id}/messages")
+async def create_message(thread_id: str, request: Request):
+    await asyncio.sleep(config.request_latency)
+    body = await request.json()
+    content = body.get("content")
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    message = message_object(thread_id, body.get("role", "user"), content)
+    get_thread(thread_id)["messages"].append(message)
+    return message
+
+
+@router.get("/threads/{thread_id}/messages")
+async def list_messages(thread_id: str, order: str = "desc", limit: int = 20):
+    await asyncio.sleep(config.request_latency)
+    messages = list(get_thread(thread_id)["messages"])
+    if order == "desc":
+        messages.reverse()
+    messages = messages[:limit]
+    return {
+        "object": "list",
+        "data": messages,
+        "first_id": messages[0]["id"] if messages else None,
+        "last_id": messages[-1]["id"] if messages else None,
+        "has_more": False,
+    }
+
+
+@router.post("/threads/{thread_id}/runs")
+async def create_run(thread_id: str, request: Request):
+    await asyncio.sleep(config.request_latency)
+    body = await request.json()
+    get_thread(thread_id)
+    if any(run["thread_id"] == thread_id and run["status"] in ACTIVE_RUN_STATUSES for run in runs.values()):
+        raise HTTPException(status_code=400, detail=f"Thread {thread_id} already has an active run")
+    run = {
+        "id": new_id("run"),
+        "thread_id": thread_id,
+        "assistant_id": body.get("assistant_id"),
+        "status": "queued",
+        "created_at": time.time(),
+        "completes_at": time.monotonic() + config.run_latency,
+        "outcome": pick_run_outcome(),
+    }
+    runs[run["id"]] = run
+    if body.get("stream"):
+        return StreamingResponse(stream_run(run), media_type="text/event-stream")
+    return run_object(run)
+
+
+async def stream_run(run: dict):
+    thread_id = run["thread_id"]
+    yield sse("thread.run.created", run_object(run))
+    run["status"] = "in_progress"
+    yield sse("thread.run.in_progress", run_object(run))
+    # Time to first token is a fraction of the full run latency
+    await asyncio.sleep(config.run_latency * 0.2)
+    if run["outcome"] != "completed":
+        finish_run(run)
+        yield sse(f"thread.run.{run['status']}", run_object(run))
+        yield sse("done", "[DONE]")
+        return
+    message = message_object(thread_id, "assistant", "", run["id"])
+    message["status"] = "in_progress"
+    yield sse("thread.message.created", message)
+    words = reply_text().split(" ")
+    for index, word in enumerate(words):
+        if run["status"] == "cancelled":
+            yield sse("thread.run.cancelled", run_object(run))
+            yield sse("done", "[DONE]")
+            return
+        value = word if index == 0 else " " + word
+        yield sse("thread.message.delta", {
+            "id": message["id"],
+            "object": "thread.message.delta",
+            "delta": {"content": [{"index": 0, "type": "text", "text": {"value": value, "annotations": []}}]},
+        })
+        await asyncio.sleep(config.token_interval)
+    text = " ".join(words)
+    message["content"][0]["text"]["value"] = text
+    message["status"] = "completed"
+    threads[thread_id]["messages"].append(message)
+    yield sse("thread.message.completed", message)
+    run["status"] = "completed"
+    yield sse("thread.run.completed", run_object(run))
+    yield sse("done", "[DONE]")
+
+
+@router.get("/threads/{thread_id}/runs/{run_id}")
+async def retrieve_run(thread_id: str, run_id: str):
+    await asyncio.sleep(config.request_latency)
+    run = runs.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="No run found")
+    advance_run(run)
+    return run_object(run)
+
+
+@router.post("/threads/{thread_id}/runs/{run_id}/cancel")
+async def cancel_run(thread_id: str, run_id: str):
+    await asyncio.sleep(config.request_latency)
+    run = runs.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="No run found")
+    if run["status"] in ACTIVE_RUN_STATUSES:
+        run["status"] = "cancelled"
+    return run_object(run)
+
+
+def completion_chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+async def stream_completion(completion_id: str, model: str):
+    await asyncio.sleep(config.chat_latency * 0.2)
+    yield f"data: {json.dumps(completion_chunk(completion_id, model, {'role': 'assistant', 'content': ''}))}\n\n"
+    for index, word in enumerate(reply_text().split(" ")):
+        value = word if index == 0 else " " + word
+        yield f"data: {json.dumps(completion_chunk(completion_id, model, {'content': value}))}\n\n"
+        await asyncio.sleep(config.token_interval)
+    yield f"data: {json.dumps(completion_chunk(completion_id, model, {}, 'stop'))}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def chat_completions(request: Request, model: str = None):
+    body = await request.json()
+    model = model or body.get("model", "fake-model")
+    completion_id = new_id("chatcmpl")
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(completion_id, model), media_type="text/event-stream")
+    await asyncio.sleep(config.chat_latency)
+    text = reply_text()
+    return JSONResponse(content={
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())},
+    })
+
+
+@router.post("/chat/completions")
+async def openai_chat_completions(request: Request):
+    return await chat_completions(request)
+
+
+@router.post("/deployments/{deployment}/chat/completions")
+async def azure_chat_completions(deployment: str, request: Request):
+    return await chat_completions(request, deployment)
+
+
+app = FastAPI(title="Fake upstream")
+app.include_router(router, prefix="/openai")
+app.include_router(router, prefix="/v1")
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    """Answer a share of API requests with an error or after an extra delay"""
+    if request.url.path.startswith("/_faults"):
+        return await call_next(request)
+    if random.random() < config.slow_rate:
+        await asyncio.sleep(config.slow_latency)
+    if random.random() < config.error_rate:
+        status_code = random.choice(config.error_statuses)
+        headers = {"retry-after": "1"} if status_code == 429 else None
+        return JSONResponse(
+            status_code=status_code,
+            content={"error": {"message": f"Injected {status_code} fault", "type": "fake_fault", "code": None}},
+            headers=headers,
+        )
+    return await call_next(request)
+
+
+@app.get("/_faults")
+async def get_faults():
+    return config.as_dict()
+
+
+@app.post("/_faults")
+async def set_faults(request: Request):
+    """Change settings while running, e.g. {"error_rate": 1.0} to trip the backend's circuit breaker"""
+    config.update(await request.json())
+    return config.as_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI / OpenAI upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
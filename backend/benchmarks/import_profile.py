@@ -0,0 +1,171 @@
+"""
+Report what sits on the backend's startup path.
+
+Imports main in a fresh interpreter under `python -X importtime` and lists
+the slowest modules, which of the heavy optional dependencies got loaded,
+and the interpreter's peak memory. With --serve it also starts the app
+under uvicorn (settings validated, startup hooks run) and reports the time
+until it answers and the worker's resident memory.
+
+    cd backend
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --top 30 --serve --output import-profile.json
+
+Run it before and after a change to compare cold starts; no credentials or
+upstream are needed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.run_benchmark import BACKEND_DIR, free_port, git_commit, wait_until_ready
+
+# Modules that should only load when a request needs them
+HEAVY_MODULES = ("openai", "PyPDF2", "docx", "PIL", "httpx", "uvloop")
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "import_seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "heavy_loaded": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def app_env(data_dir: str) -> Dict[str, str]:
+    """Placeholder credentials and throwaway storage, enough to import and start the app"""
+    env = dict(os.environ)
+    env.update({
+        "AZURE_OPENAI_ENDPOINT": env.get("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9"),
+        "AZURE_OPENAI_API_KEY": env.get("AZURE_OPENAI_API_KEY", "profile"),
+        "ASSISTANT_ID": env.get("ASSISTANT_ID", "asst_profile"),
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "profile"),
+        "CONVERSATION_DB_FILE": os.path.join(data_dir, "conversations.db"),
+        "PATIENT_DB_FILE": os.path.join(data_dir, "patients.db"),
+        "JOB_DB_FILE": os.path.join(data_dir, "jobs.db"),
+        "DOCUMENT_STORE_DIR": os.path.join(data_dir, "documents"),
+        "ANALYSIS_CACHE_DIR": os.path.join(data_dir, "cache", "analysis"),
+        "SPEECH_CACHE_DIR": os.path.join(data_dir, "cache", "speech"),
+    })
+    return env
+
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """Rows of `-X importtime` output: module, self and cumulative microseconds, nesting depth (0 = top level)"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return rows
+
+
+def profile_import(env: Dict[str, str], top: int) -> dict:
+    traced = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if traced.returncode != 0:
+        raise RuntimeError(f"Importing main failed:\n{traced.stderr[-2000:]}")
+    rows = parse_importtime(traced.stderr)
+
+    probe = subprocess.run(
+        [sys.executable, "-c", PROBE % (HEAVY_MODULES,)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    summary = json.loads(probe.stdout.strip().splitlines()[-1])
+
+    # Time spent in each top-level package's own modules, whoever imported them
+    packages: Dict[str, int] = {}
+    for row in rows:
+        package = row["module"].split(".")[0]
+        packages[package] = packages.get(package, 0) + row["self_us"]
+    summary["slowest_modules"] = sorted(rows, key=lambda row: row["self_us"], reverse=True)[:top]
+    summary["slowest_packages"] = [
+        {"package": name, "self_us": us}
+        for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    ]
+    return summary
+
+
+def resident_kb(pid: int) -> Optional[int]:
+    """VmRSS of a process (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def profile_startup(env: Dict[str, str]) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(wait_until_ready(f"http://127.0.0.1:{port}/metrics", process))
+        return {"ready_seconds": time.perf_counter() - started, "rss_kb": resident_kb(process.pid)}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def print_report(report: dict):
+    print(f"import main: {report['import_seconds'] * 1000:.0f} ms, {report['modules']} modules, "
+          f"peak RSS {report['max_rss_kb'] / 1024:.1f} MiB")
+    print(f"heavy modules loaded at import: {', '.join(report['heavy_loaded']) or 'none'}")
+    if "startup" in report:
+        startup = report["startup"]
+        rss = f"{startup['rss_kb'] / 1024:.1f} MiB" if startup["rss_kb"] else "n/a"
+        print(f"uvicorn ready after {startup['ready_seconds'] * 1000:.0f} ms, worker RSS {rss}")
+    print(f"\n{'package':<36}{'self ms':>10}")
+    for row in report["slowest_packages"]:
+        print(f"{row['package']:<36}{row['self_us'] / 1000:>10.1f}")
+    print(f"\n{'module':<52}{'self ms':>10}{'cumul. ms':>10}")
+    for row in report["slowest_modules"]:
+        print(f"{row['module']:<52}{row['self_us'] / 1000:>10.1f}{row['cumulative_us'] / 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the backend's import time and startup footprint")
+    parser.add_argument("--top", type=int, default=20, help="Modules and packages to list")
+    parser.add_argument("--serve", action="store_true", help="Also start the app and measure time to ready and RSS")
+    parser.add_argument("--output", default="", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="import-profile-") as data_dir:
+        env = app_env(data_dir)
+        report = profile_import(env, args.top)
+        if args.serve:
+            report["startup"] = profile_startup(env)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"git_commit": git_commit(), **report}, f, indent=2)
+        print(f"\nReport written to {args.output}")
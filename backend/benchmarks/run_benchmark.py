@@ -0,0 +1,429 @@
+"""
+Load-test every backend route against a local fake upstream.
+
+Starts benchmarks.fake_upstream and the backend (main:app) as uvicorn
+subprocesses, with storage in a temporary directory, seeds patients and
+conversations, then drives each scenario at the requested concurrency and
+reports throughput and p50/p95/p99 latency. Results are written as JSON so
+runs can be compared across commits.
+
+    cd backend
+    python -m benchmarks.run_benchmark --requests 200 --concurrency 20
+    python -m benchmarks.run_benchmark --scenarios chat-response,thinker --run-latency 2
+
+Pass --app-url to benchmark an already running backend instead (it must be
+configured against the fake upstream or a real one yourself).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_png(width: int = 64, height: int = 64, seed: int = 0) -> bytes:
+    """Small grayscale PNG; different seeds give different image content"""
+    rows = b"".join(
+        b"\x00" + bytes((x * 4 + y * 2 + seed) % 256 for x in range(width))
+        for y in range(height)
+    )
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+class BenchmarkState:
+    """Ids created during setup and shared by the scenarios"""
+
+    def __init__(self):
+        self.patient_ids: List[str] = []
+        self.patient_mrns: List[str] = []
+        self.deletable_patient_ids: List[str] = []
+        self.conversations: Dict[str, List[str]] = {"document": [], "medical": []}
+        self.deletable_conversations: List[str] = []
+        self.image = make_png()
+        self.document = ("Discharge summary. " + "Patient stable, vitals within normal limits. " * 200).encode("utf-8")
+
+    def pick(self, items: List[str], i: int) -> str:
+        return items[i % len(items)]
+
+
+Scenario = Callable[[httpx.AsyncClient, int, BenchmarkState], Awaitable[httpx.Response]]
+
+
+def patient_payload(i: int) -> dict:
+    return {
+        "name": f"Bench Patient {i}",
+        "dateOfBirth": "1980-01-01",
+        "medicalRecordNumber": f"BENCH-{uuid.uuid4().hex[:10]}",
+        "lastVisit": "2024-01-01",
+        "email": f"bench{i}@example.com",
+        "phone": f"555-{i:04d}",
+    }
+
+
+async def read_stream(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+    """Consume a streamed response; an SSE error event counts as a failure"""
+    async with client.stream(method, url, **kwargs) as response:
+        body = b""
+        async for chunk in response.aiter_bytes():
+            body += chunk
+    if b"event: error" in body:
+        response.status_code = 502
+    return response
+
+
+async def run_job(client: httpx.AsyncClient, i: int, state: BenchmarkState) -> httpx.Response:
+    """Queue a document analysis and follow its events until the job finishes"""
+    response = await client.post(
+        "/thinker/jobs",
+        data={"patient_information": "45 year old", "query": f"Summarize ({i})"},
+        files={"file": ("summary.txt", state.document, "text/plain")},
+    )
+    if response.status_code != 202:
+        return response
+    return await read_stream(client, "GET", f"{response.headers['location']}/events")
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    # Patients
+    "patients.list": lambda c, i, s: c.get("/patients/"),
+    "patients.get": lambda c, i, s: c.get(f"/patients/{s.pick(s.patient_ids, i)}"),
+    "patients.mrn": lambda c, i, s: c.get(f"/patients/mrn/{s.pick(s.patient_mrns, i)}"),
+    "patients.search": lambda c, i, s: c.post("/patients/search", json={"query": f"Patient {i % 50}", "limit": 20}),
+    "patients.search.fuzzy": lambda c, i, s: c.post("/patients/search", json={"query": "Pateint", "limit": 20, "fuzzy": True}),
+    "patients.create": lambda c, i, s: c.post("/patients/", json=patient_payload(i)),
+    "patients.update": lambda c, i, s: c.put(f"/patients/{s.pick(s.patient_ids, i)}", json={"lastVisit": "2024-06-01"}),
+    "patients.delete": lambda c, i, s: c.delete(f"/patients/{s.deletable_patient_ids[i]}"),
+    # Conversation management
+    "conversations.list": lambda c, i, s: c.get("/conversations", params={"conversation_type": "document"}),
+    "medical-conversations": lambda c, i, s: c.get("/medical-conversations"),
+    "document-conversations": lambda c, i, s: c.get("/document-conversations"),
+    "conversation.messages": lambda c, i, s: c.get(f"/conversation/{s.pick(s.conversations['document'], i)}/messages"),
+    "conversation.patient-data": lambda c, i, s: c.get(f"/conversation/{s.pick(s.conversations['document'], i)}/patient-data"),
+    "conversation.rename": lambda c, i, s: c.post(
+        f"/conversation/{s.pick(s.conversations['document'], i)}/rename", params={"title": f"Renamed {i}"}
+    ),
+    "conversation.save-patient": lambda c, i, s: c.post(
+        f"/conversation/{s.pick(s.conversations['document'], i)}/save-patient", json={"name": f"Bench Patient {i}"}
+    ),
+    "conversation.save-message": lambda c, i, s: c.post(
+        f"/conversation/{s.pick(s.conversations['document'], i)}/save-message",
+        json={"role": "user", "content": f"Benchmark message {i}"},
+    ),
+    "conversation.delete": lambda c, i, s: c.delete(f"/conversation/{s.deletable_conversations[i]}"),
+    "new-conversation": lambda c, i, s: c.post("/new-conversation"),
+    "new-medical-conversation": lambda c, i, s: c.post("/new-medical-conversation"),
+    "new-document-conversation": lambda c, i, s: c.post("/new-document-conversation"),
+    # Model-backed routes
+    "chat-response": lambda c, i, s: c.post("/chat-response", data={"request": f"What causes chest pain? ({i})"}),
+    "chat-response.stream": lambda c, i, s: read_stream(
+        c, "POST", "/chat-response/stream", data={"request": f"What causes chest pain? ({i})"}
+    ),
+    "chat-response.speech": lambda c, i, s: read_stream(
+        c, "POST", "/chat-response/speech", data={"request": f"What causes chest pain? ({i})"}
+    ),
+    "thinker": lambda c, i, s: c.post(
+        "/thinker",
+        data={"patient_information": "45 year old", "query": f"Summarize ({i})"},
+        files={"file": ("summary.txt", s.document, "text/plain")},
+    ),
+    "thinker.stream": lambda c, i, s: read_stream(
+        c, "POST", "/thinker/stream",
+        data={"patient_information": "45 year old", "query": f"Summarize ({i})"},
+        files={"file": ("summary.txt", s.document, "text/plain")},
+    ),
+    "thinker.jobs": run_job,
+    "analyze-image": lambda c, i, s: c.post(
+        "/analyze-image/", params={"no_cache": "true"}, files={"file": ("xray.png", s.image, "image/png")}
+    ),
+    "analyze-image.cached": lambda c, i, s: c.post(
+        "/analyze-image/", files={"file": ("xray.png", s.image, "image/png")}
+    ),
+    "analyze-images": lambda c, i, s: read_stream(
+        c, "POST", "/analyze-images/",
+        files=[("files", (f"xray-{n}.png", make_png(seed=i * 4 + n), "image/png")) for n in range(4)],
+    ),
+    "voice-over": lambda c, i, s: c.post(
+        "/voice-over", data={"voice_data": f"Rest the knee and keep it raised. Follow up in {i} days."}
+    ),
+    # Operations
+    "metrics": lambda c, i, s: c.get("/metrics"),
+}
+
+
+async def setup(client: httpx.AsyncClient, state: BenchmarkState, patients: int, conversations: int, requests: int):
+    """Seed patients and conversations used by the read and update scenarios"""
+    for i in range(patients):
+        response = await client.post("/patients/", json=patient_payload(i))
+        response.raise_for_status()
+        patient = response.json()
+        state.patient_ids.append(patient["id"])
+        state.patient_mrns.append(patient["medicalRecordNumber"])
+    for i in range(requests):
+        response = await client.post("/patients/", json=patient_payload(patients + i))
+        response.raise_for_status()
+        state.deletable_patient_ids.append(response.json()["id"])
+
+    for conversation_type in ("document", "medical"):
+        for i in range(conversations):
+            response = await client.post("/new-conversation", params={"conversation_type": conversation_type})
+            response.raise_for_status()
+            conversation_id = response.json()["conversation_id"]
+            state.conversations[conversation_type].append(conversation_id)
+            for n in range(10):
+                await client.post(
+                    f"/conversation/{conversation_id}/save-message",
+                    params={"conversation_type": conversation_type},
+                    json={"role": "user" if n % 2 == 0 else "assistant", "content": f"Seed message {n}"},
+                )
+    for i in range(requests):
+        response = await client.post("/new-conversation")
+        response.raise_for_status()
+        state.deletable_conversations.append(response.json()["conversation_id"])
+
+    # Warm the analysis cache for the cached scenario
+    await client.post("/analyze-image/", files={"file": ("xray.png", state.image, "image/png")})
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    name: str,
+    scenario: Scenario,
+    state: BenchmarkState,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await scenario(client, i, state)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if not isinstance(status, int) or status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+
+async def wait_until_ready(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Server for {url} exited with code {process.returncode}")
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start within {timeout}s")
+
+
+def start_servers(args, data_dir: str) -> Tuple[str, str, List[subprocess.Popen]]:
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+
+    fake_env = dict(os.environ)
+    fake_env.update({
+        "FAKE_RUN_LATENCY": str(args.run_latency),
+        "FAKE_CHAT_LATENCY": str(args.chat_latency),
+        "FAKE_REQUEST_LATENCY": str(args.request_latency),
+        "FAKE_TOKEN_INTERVAL": str(args.token_interval),
+        "FAKE_REPLY_WORDS": str(args.reply_words),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+        "FAKE_SLOW_RATE": str(args.slow_rate),
+        "FAKE_SLOW_LATENCY": str(args.slow_latency),
+        "FAKE_RUN_FAILURE_RATE": str(args.run_failure_rate),
+    })
+    app_env = dict(os.environ)
+    app_env.update({
+        "AZURE_OPENAI_ENDPOINT": fake_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "ASSISTANT_ID": "asst_benchmark",
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "RUN_POLL_INITIAL_INTERVAL": str(args.poll_interval),
+        "CHAT_BACKEND": args.chat_backend,
+        "CONVERSATION_DB_FILE": os.path.join(data_dir, "conversations.db"),
+        "PATIENT_DB_FILE": os.path.join(data_dir, "patients.db"),
+        "JOB_DB_FILE": os.path.join(data_dir, "jobs.db"),
+        "DOCUMENT_STORE_DIR": os.path.join(data_dir, "documents"),
+        "ANALYSIS_CACHE_DIR": os.path.join(data_dir, "cache"),
+        "SPEECH_PROVIDER": "local",
+        "SPEECH_CACHE_DIR": os.path.join(data_dir, "speech"),
+    })
+
+    output = None if args.verbose else subprocess.DEVNULL
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.fake_upstream:app",
+             "--port", str(fake_port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=fake_env, stdout=output, stderr=output,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app",
+             "--port", str(app_port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=app_env, stdout=output, stderr=output,
+        ),
+    ]
+    return fake_url, f"http://127.0.0.1:{app_port}", processes
+
+
+def stop_servers(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def print_table(results: List[dict]):
+    print(f"{'scenario':<28}{'req':>6}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        latency = result["latency_ms"]
+        print(
+            f"{result['scenario']:<28}{result['requests']:>6}{sum(result['errors'].values()):>6}"
+            f"{result['throughput_rps']:>10}{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}"
+        )
+
+
+async def main(args) -> List[dict]:
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}. Available: {', '.join(SCENARIOS)}")
+
+    processes: List[subprocess.Popen] = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as data_dir:
+        try:
+            if args.app_url:
+                app_url = args.app_url
+            else:
+                fake_url, app_url, processes = start_servers(args, data_dir)
+                await wait_until_ready(f"{fake_url}/docs", processes[0])
+            await wait_until_ready(f"{app_url}/patients/", processes[1] if processes else None)
+
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=args.timeout) as client:
+                state = BenchmarkState()
+                await setup(client, state, args.patients, args.conversations, args.requests)
+                results = []
+                for name in names:
+                    result = await run_scenario(client, name, SCENARIOS[name], state, args.requests, args.concurrency)
+                    results.append(result)
+                    if args.verbose:
+                        print_table([result])
+                return results
+        finally:
+            stop_servers(processes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark backend routes against a fake upstream")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients per scenario")
+    parser.add_argument("--scenarios", default="", help="Comma-separated scenario names (default: all)")
+    parser.add_argument("--patients", type=int, default=500, help="Patients seeded before the run")
+    parser.add_argument("--conversations", type=int, default=50, help="Conversations seeded per type")
+    parser.add_argument("--run-latency", type=float, default=1.0, help="Fake assistant run duration (s)")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="Fake chat completion duration (s)")
+    parser.add_argument("--request-latency", type=float, default=0.02, help="Fake latency of other upstream calls (s)")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="Delay between streamed tokens (s)")
+    parser.add_argument("--reply-words", type=int, default=120, help="Words per fake reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake upstream requests answered with 429/500/503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of fake upstream requests delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Extra delay of slow fake upstream requests (s)")
+    parser.add_argument("--run-failure-rate", type=float, default=0.0, help="Share of fake assistant runs that fail with server_error")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="RUN_POLL_INITIAL_INTERVAL for the backend")
+    parser.add_argument("--chat-backend", default="assistants", choices=("assistants", "completions"),
+                        help="CHAT_BACKEND for the backend")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request (s)")
+    parser.add_argument("--app-url", default="", help="Benchmark a running backend instead of starting one")
+    parser.add_argument("--output", default="", help="JSON results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show server output and per-scenario progress")
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc)
+    results = asyncio.run(main(args))
+    print_table(results)
+
+    output = args.output or os.path.join(
+        BACKEND_DIR, "benchmarks", "results", started_at.strftime("%Y%m%dT%H%M%SZ") + ".json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "started_at": started_at.isoformat(),
+            "git_commit": git_commit(),
+            "config": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
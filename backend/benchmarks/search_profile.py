@@ -0,0 +1,94 @@
+"""
+Time patient search against a large in-memory index.
+
+Builds a PatientSearchIndex of synthetic patients (100k by default) and
+reports p50/p95 latency per query for one page of results, so the cost of
+short queries that match most of the registry can be compared with full
+names, MRNs and fuzzy lookups.
+
+    cd backend
+    python -m benchmarks.search_profile
+    python -m benchmarks.search_profile --patients 200000 --limit 50 --output search-profile.json
+
+It needs no credentials, storage or upstream.
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import List
+
+from benchmarks.run_benchmark import git_commit
+from core.patient_search import PatientSearchIndex
+
+FIRST_NAMES = ["Anna", "Bob", "Lena", "Maria", "Olga", "José", "Zoë", "Omar", "Priya", "Ken", "Sara", "Tom"]
+LAST_NAMES = ["Lee", "Stone", "Ng", "Olsen", "Maris", "Álvarez", "Smith", "Khan", "Patel", "Ito", "O'Brien"]
+
+# (query, fuzzy): one- and two-character queries, then progressively selective ones
+QUERIES = [
+    ("a", False), ("e", False), ("5", False), ("an", False), ("ee", False),
+    ("ann", False), ("maria ol", False), ("MRN-0042", False), ("Pateil", True),
+]
+
+
+def build_index(patients: int, seed: int) -> PatientSearchIndex:
+    rng = random.Random(seed)
+    index = PatientSearchIndex()
+    for i in range(patients):
+        index.add({
+            "id": str(i),
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "medicalRecordNumber": f"MRN-{i:06d}",
+            "email": f"patient{i}@example.com",
+            "phone": f"555-{i:07d}",
+        })
+    return index
+
+
+def time_query(index: PatientSearchIndex, query: str, fuzzy: bool, limit: int, repeat: int) -> dict:
+    timings: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _, total = index.search(query, limit=limit, fuzzy=fuzzy)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "query": query,
+        "fuzzy": fuzzy,
+        "matches": total,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time patient search queries against a large index")
+    parser.add_argument("--patients", type=int, default=100000, help="Synthetic patients in the index")
+    parser.add_argument("--limit", type=int, default=20, help="Page size requested per query")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per query")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = build_index(args.patients, args.seed)
+    build_seconds = time.perf_counter() - started
+    results = [time_query(index, query, fuzzy, args.limit, args.repeat) for query, fuzzy in QUERIES]
+
+    print(f"indexed {args.patients} patients in {build_seconds:.1f} s; page size {args.limit}")
+    print(f"\n{'query':<16}{'matches':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in results:
+        label = f"{row['query']}{' (fuzzy)' if row['fuzzy'] else ''}"
+        print(f"{label:<16}{row['matches']:>10}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "git_commit": git_commit(),
+                "patients": args.patients,
+                "limit": args.limit,
+                "build_seconds": build_seconds,
+                "queries": results,
+            }, f, indent=2)
+        print(f"\nReport written to {args.output}")
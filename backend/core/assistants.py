@@ -0,0 +1,231 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from core.config import settings
+from core.metrics import RUN_POLLS, RUN_STREAM_FIRST_TOKEN, UPSTREAM_RETRIES, upstream_stage
+from core.resilience import backoff_delay, call_upstream
+
+# Run states after which polling stops
+TERMINAL_RUN_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+# The assistant wants tool outputs, which this service never provides; the run is cancelled
+ACTION_RUN_STATUS = "requires_action"
+# Run failures worth starting a new run for (the user's message is already on the thread)
+RETRYABLE_RUN_ERRORS = {"server_error", "rate_limit_exceeded"}
+
+
+class RunTimeoutError(Exception):
+    """The assistant run did not finish within the configured timeout"""
+
+
+class ClientDisconnectedError(Exception):
+    """The HTTP client went away while the assistant run was in progress"""
+
+
+class RunFailedError(Exception):
+    """The assistant run ended in a state other than completed"""
+
+    def __init__(self, run):
+        self.run = run
+        error = getattr(run, "last_error", None)
+        if error is not None:
+            detail = f": {error.message}"
+        elif run.status == ACTION_RUN_STATUS:
+            detail = ": the assistant requested tool calls, which are not supported"
+        else:
+            detail = ""
+        super().__init__(f"Assistant run {run.status}{detail}")
+
+
+async def cancel_run(client, thread_id: str, run_id: str):
+    """Best-effort cancellation of a run; errors are logged and swallowed"""
+    try:
+        with upstream_stage("run_cancel"):
+            await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"Error cancelling run {run_id}: {e}")
+
+
+async def wait_for_run(
+    client,
+    thread_id: str,
+    run,
+    timeout: Optional[float] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+):
+    """Poll a run until it reaches a terminal state.
+
+    The poll interval starts at RUN_POLL_INITIAL_INTERVAL and grows by
+    RUN_POLL_BACKOFF up to RUN_POLL_MAX_INTERVAL, so short runs are picked up
+    quickly without hammering the API on long ones. Failed polls are retried
+    within the deadline. The run is cancelled if the timeout expires, the
+    client disconnects or the run stops in requires_action.
+    """
+    timeout = settings.RUN_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    interval = settings.RUN_POLL_INITIAL_INTERVAL
+    polls = 0
+
+    try:
+        with upstream_stage("run_wait"):
+            while run.status not in TERMINAL_RUN_STATUSES:
+                if run.status == ACTION_RUN_STATUS:
+                    await cancel_run(client, thread_id, run.id)
+                    break
+                if is_disconnected is not None and await is_disconnected():
+                    await cancel_run(client, thread_id, run.id)
+                    raise ClientDisconnectedError()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    await cancel_run(client, thread_id, run.id)
+                    raise RunTimeoutError(f"Assistant run did not finish within {timeout:g}s")
+                await asyncio.sleep(min(interval, remaining))
+                interval = min(interval * settings.RUN_POLL_BACKOFF, settings.RUN_POLL_MAX_INTERVAL)
+                try:
+                    run = await call_upstream(
+                        "azure",
+                        "run_retrieve",
+                        lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id),
+                        deadline=deadline
+                    )
+                except asyncio.TimeoutError:
+                    continue
+                except Exception:
+                    await cancel_run(client, thread_id, run.id)
+                    raise
+                polls += 1
+    except asyncio.CancelledError:
+        # Nobody is waiting for the answer any more; stop the run as well
+        await asyncio.shield(cancel_run(client, thread_id, run.id))
+        raise
+    finally:
+        RUN_POLLS.observe(polls)
+
+    return run
+
+
+def retryable_run_failure(run) -> bool:
+    error = getattr(run, "last_error", None)
+    return run.status == "failed" and error is not None and error.code in RETRYABLE_RUN_ERRORS
+
+
+async def run_assistant(
+    client,
+    thread_id: str,
+    instructions: str,
+    timeout: Optional[float] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> str:
+    """Start a run on a thread, wait for it and return the assistant's reply text.
+
+    A run that fails with a server or rate-limit error is started again, up to
+    UPSTREAM_RETRY_ATTEMPTS runs, as long as the timeout leaves room for it.
+    """
+    timeout = settings.RUN_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            run = await call_upstream(
+                "azure",
+                "run_create",
+                lambda: client.beta.threads.runs.create(
+                    thread_id=thread_id,
+                    assistant_id=settings.ASSISTANT_ID,
+                    additional_instructions=instructions
+                ),
+                idempotent=False,
+                deadline=deadline
+            )
+        except asyncio.TimeoutError:
+            raise RunTimeoutError(f"Assistant run did not finish within {timeout:g}s")
+        run = await wait_for_run(
+            client, thread_id, run, timeout=deadline - time.monotonic(), is_disconnected=is_disconnected
+        )
+        if run.status == "completed":
+            break
+        delay = backoff_delay(attempt)
+        if not retryable_run_failure(run) or attempt >= settings.UPSTREAM_RETRY_ATTEMPTS \
+                or time.monotonic() + delay >= deadline:
+            raise RunFailedError(run)
+        print(f"Retrying assistant run in {delay:.2f}s after: {run.last_error.message}")
+        UPSTREAM_RETRIES.inc(upstream="azure", stage="run")
+        await asyncio.sleep(delay)
+
+    try:
+        messages = await call_upstream(
+            "azure",
+            "messages_list",
+            lambda: client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1),
+            deadline=deadline
+        )
+    except asyncio.TimeoutError:
+        raise RunTimeoutError(f"Assistant run did not finish within {timeout:g}s")
+    return messages.data[0].content[0].text.value
+
+
+async def stream_run_text(
+    client,
+    thread_id: str,
+    instructions: str,
+    timeout: Optional[float] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[str]:
+    """Start a streaming run on a thread and yield the assistant's text deltas as they arrive"""
+    timeout = settings.RUN_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    run_id = None
+    started = time.perf_counter()
+    first_token = True
+
+    try:
+        stream = await call_upstream(
+            "azure",
+            "run_create",
+            lambda: client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=settings.ASSISTANT_ID,
+                additional_instructions=instructions,
+                stream=True
+            ),
+            idempotent=False,
+            deadline=deadline
+        )
+    except asyncio.TimeoutError:
+        raise RunTimeoutError(f"Assistant run did not finish within {timeout:g}s")
+    try:
+        with upstream_stage("run_stream"):
+            async for event in stream:
+                if event.event == "thread.run.created":
+                    run_id = event.data.id
+                elif event.event == "thread.message.delta":
+                    for part in event.data.delta.content or []:
+                        if part.type == "text" and part.text and part.text.value:
+                            if first_token:
+                                RUN_STREAM_FIRST_TOKEN.observe(time.perf_counter() - started)
+                                first_token = False
+                            yield part.text.value
+                elif event.event == "thread.run.requires_action":
+                    await cancel_run(client, thread_id, event.data.id)
+                    raise RunFailedError(event.data)
+                elif event.event in ("thread.run.failed", "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete"):
+                    raise RunFailedError(event.data)
+                elif event.event == "error":
+                    raise RuntimeError(f"Assistant stream error: {event.data}")
+
+                if is_disconnected is not None and await is_disconnected():
+                    if run_id:
+                        await cancel_run(client, thread_id, run_id)
+                    raise ClientDisconnectedError()
+                if time.monotonic() > deadline:
+                    if run_id:
+                        await cancel_run(client, thread_id, run_id)
+                    raise RunTimeoutError(f"Assistant run did not finish within {timeout:g}s")
+    except asyncio.CancelledError:
+        # The response task was cancelled (usually a client disconnect); stop the run as well
+        if run_id:
+            await asyncio.shield(cancel_run(client, thread_id, run_id))
+        raise
+    finally:
+        await stream.close()
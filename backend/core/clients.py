@@ -0,0 +1,104 @@
+import importlib.util
+from typing import TYPE_CHECKING, Optional
+
+from core.config import settings
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncAzureOpenAI, AsyncOpenAI
+
+AZURE_API_VERSION = "2024-05-01-preview"
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def build_http_client(timeout: float) -> "httpx.AsyncClient":
+    """Pooled keep-alive HTTP client shared by every request to one upstream"""
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=settings.UPSTREAM_HTTP2 and http2_available(),
+        limits=httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+    )
+
+
+class UpstreamClients:
+    """Registry of long-lived upstream model clients.
+
+    Clients are created once (lazily on first use, or at application startup
+    with PRELOAD_UPSTREAM_CLIENTS) and reuse their connection pools for every
+    request until aclose(). The OpenAI SDK is only imported when the first
+    client is built, which keeps it off the startup path.
+    """
+
+    def __init__(self):
+        self._azure: Optional["AsyncAzureOpenAI"] = None
+        self._openai: Optional["AsyncOpenAI"] = None
+        self._elevenlabs: Optional["httpx.AsyncClient"] = None
+
+    def start(self):
+        self.azure()
+        self.openai()
+
+    def azure(self) -> "AsyncAzureOpenAI":
+        """Azure OpenAI client used for the Assistants API"""
+        if self._azure is None:
+            from openai import AsyncAzureOpenAI
+
+            self._azure = AsyncAzureOpenAI(
+                azure_endpoint=settings.CLIENT_CREDENTIAL_ENDPOINT,
+                api_key=settings.CLIENT_CREDENTIAL_KEY,
+                api_version=AZURE_API_VERSION,
+                http_client=build_http_client(settings.AZURE_TIMEOUT_SECONDS),
+                # Retries are made by core.resilience, which knows the deadline and the circuit state
+                max_retries=0,
+            )
+        return self._azure
+
+    def openai(self) -> "AsyncOpenAI":
+        """OpenAI client used for vision analysis"""
+        if self._openai is None:
+            from openai import AsyncOpenAI
+
+            self._openai = AsyncOpenAI(
+                api_key=settings.OPENAI_CREDENTIAL_KEY,
+                base_url=settings.OPENAI_BASE_URL or None,
+                http_client=build_http_client(settings.OPENAI_TIMEOUT_SECONDS),
+                max_retries=0,
+            )
+        return self._openai
+
+    def elevenlabs(self) -> "httpx.AsyncClient":
+        """Plain HTTP client for the ElevenLabs text-to-speech API"""
+        if self._elevenlabs is None:
+            self._elevenlabs = build_http_client(settings.SPEECH_TIMEOUT_SECONDS)
+        return self._elevenlabs
+
+    async def aclose(self):
+        for client in (self._azure, self._openai):
+            if client is not None:
+                await client.close()
+        if self._elevenlabs is not None:
+            await self._elevenlabs.aclose()
+        self._azure = None
+        self._openai = None
+        self._elevenlabs = None
+
+
+upstream_clients = UpstreamClients()
+
+
+def get_azure_client() -> "AsyncAzureOpenAI":
+    return upstream_clients.azure()
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    return upstream_clients.openai()
@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+DisconnectCheck = Callable[[], Awaitable[bool]]
+
+
+class _Flight:
+    __slots__ = ("task", "disconnect_checks", "waiters")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.disconnect_checks: List[Optional[DisconnectCheck]] = []
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    The first caller starts fn as a task; callers arriving with the same key
+    while it runs await the same result (or exception). fn receives an
+    is_disconnected callable that reports True only once every waiting
+    client has disconnected, so a shared upstream run is cancelled only when
+    nobody is left to receive it. The task is also cancelled if every waiter
+    is cancelled. A None key is not coalesced: fn runs for that caller alone.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[DisconnectCheck], Awaitable[Any]],
+        is_disconnected: Optional[DisconnectCheck] = None,
+    ) -> Any:
+        if key is None:
+            return await fn(is_disconnected)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+
+            async def all_disconnected() -> bool:
+                checks = list(flight.disconnect_checks)
+                for check in checks:
+                    if check is None or not await check():
+                        return False
+                return bool(checks)
+
+            async def run():
+                try:
+                    return await fn(all_disconnected)
+                finally:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+
+            flight.task = asyncio.create_task(run())
+
+        flight.disconnect_checks.append(is_disconnected)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                flight.waiters -= 1
+                if flight.waiters == 0:
+                    flight.task.cancel()
+            raise
+        finally:
+            if is_disconnected in flight.disconnect_checks:
+                flight.disconnect_checks.remove(is_disconnected)
+
+
+class KeyedLocks:
+    """One asyncio.Lock per key, dropped again once nobody holds or waits for it"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: Optional[Hashable]):
+        """Serialize the block per key; a None key is not serialized"""
+        if key is None:
+            yield
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                del self._users[key]
+                del self._locks[key]
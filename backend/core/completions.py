@@ -0,0 +1,123 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from core.assistants import ClientDisconnectedError, RunTimeoutError
+from core.config import settings
+from core.metrics import RUN_STREAM_FIRST_TOKEN, upstream_stage
+from core.resilience import call_upstream
+from core.retrieval import estimate_tokens
+
+# Conversation backends: Assistants threads and runs, or one chat completion per turn
+BACKEND_ASSISTANTS = "assistants"
+BACKEND_COMPLETIONS = "completions"
+
+# Stored message senders and the chat roles they are replayed as
+SENDER_ROLES = {"user": "user", "assistant": "assistant"}
+
+
+def chat_backend() -> str:
+    """The configured conversation backend for this deployment"""
+    backend = settings.CHAT_BACKEND.strip().lower()
+    if backend not in (BACKEND_ASSISTANTS, BACKEND_COMPLETIONS):
+        raise ValueError(f"Unknown CHAT_BACKEND {settings.CHAT_BACKEND!r}")
+    return backend
+
+
+def trim_history(messages: List[dict], token_budget: int) -> List[Dict[str, str]]:
+    """Convert stored messages to chat messages, keeping the newest that fit token_budget.
+
+    Whole question/answer pairs are dropped from the oldest end, so the kept
+    history never starts with an orphaned assistant reply.
+    """
+    history = [
+        {"role": SENDER_ROLES[message.get("sender")], "content": message.get("content") or ""}
+        for message in messages
+        if message.get("sender") in SENDER_ROLES and message.get("content")
+    ]
+    kept = []
+    used = 0
+    for message in reversed(history):
+        used += estimate_tokens(message["content"])
+        if used > token_budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    return kept
+
+
+def build_chat_messages(instructions: str, history: List[dict], content: str, token_budget: int) -> List[Dict[str, str]]:
+    """System instructions, the trimmed conversation history and the new user turn"""
+    return [
+        {"role": "system", "content": instructions},
+        *trim_history(history, token_budget),
+        {"role": "user", "content": content},
+    ]
+
+
+async def stream_chat_text(
+    client,
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    timeout: Optional[float] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> AsyncIterator[str]:
+    """Stream one chat completion and yield its text deltas as they arrive.
+
+    Uses the same timeout and disconnect rules as assistant runs; closing the
+    stream is enough to stop generation upstream.
+    """
+    timeout = settings.RUN_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    started = time.perf_counter()
+    first_token = True
+    request = {
+        "model": model or settings.CHAT_DEPLOYMENT,
+        "messages": messages,
+        "stream": True,
+    }
+    if settings.CHAT_MAX_TOKENS:
+        request["max_tokens"] = settings.CHAT_MAX_TOKENS
+
+    try:
+        stream = await call_upstream(
+            "azure",
+            "chat_completion_create",
+            lambda: client.chat.completions.create(**request),
+            deadline=deadline
+        )
+    except asyncio.TimeoutError:
+        raise RunTimeoutError(f"Chat completion did not start within {timeout:g}s")
+    try:
+        with upstream_stage("chat_completion_stream"):
+            async for chunk in stream:
+                for choice in chunk.choices:
+                    text = choice.delta.content if choice.delta else None
+                    if text:
+                        if first_token:
+                            RUN_STREAM_FIRST_TOKEN.observe(time.perf_counter() - started)
+                            first_token = False
+                        yield text
+
+                if is_disconnected is not None and await is_disconnected():
+                    raise ClientDisconnectedError()
+                if time.monotonic() > deadline:
+                    raise RunTimeoutError(f"Chat completion did not finish within {timeout:g}s")
+    finally:
+        await stream.close()
+
+
+async def complete_chat(
+    client,
+    messages: List[Dict[str, str]],
+    model: Optional[str] = None,
+    timeout: Optional[float] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+) -> str:
+    """Run one chat completion and return the full reply text"""
+    parts = []
+    async for delta in stream_chat_text(client, messages, model, timeout=timeout, is_disconnected=is_disconnected):
+        parts.append(delta)
+    return "".join(parts)
@@ -1,21 +1,187 @@
-from typing import List
+import threading
+from typing import List, Optional
 from decouple import config
-from pydantic import AnyHttpUrl
+from pydantic import AnyHttpUrl, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+
+def env(name: str, **options):
+    """A setting read with decouple when Settings is built, not when this module is imported"""
+    return Field(default_factory=lambda: config(name, **options))
+
+
 class Settings(BaseSettings):
     # Database
-    # MONGO_CONNECTION_STRING: str = config("MONGO_CONNECTION_STRING", cast=str)
+    # MONGO_CONNECTION_STRING: str = env("MONGO_CONNECTION_STRING", cast=str)
     
     # Azure credential details
-    CLIENT_CREDENTIAL_ENDPOINT: str = config("AZURE_OPENAI_ENDPOINT")
-    CLIENT_CREDENTIAL_KEY: str = config("AZURE_OPENAI_API_KEY")
-    ASSISTANT_ID: str = config("ASSISTANT_ID")
+    CLIENT_CREDENTIAL_ENDPOINT: str = env("AZURE_OPENAI_ENDPOINT")
+    CLIENT_CREDENTIAL_KEY: str = env("AZURE_OPENAI_API_KEY")
+    ASSISTANT_ID: str = env("ASSISTANT_ID")
 
     # Openai credential details
-    OPENAI_CREDENTIAL_KEY: str = config("OPENAI_API_KEY")
+    OPENAI_CREDENTIAL_KEY: str = env("OPENAI_API_KEY")
+    OPENAI_BASE_URL: str = env("OPENAI_BASE_URL", default="")
+
+    # Upstream HTTP connection pools
+    UPSTREAM_MAX_CONNECTIONS: int = env("UPSTREAM_MAX_CONNECTIONS", default=100, cast=int)
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = env("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", default=20, cast=int)
+    UPSTREAM_KEEPALIVE_EXPIRY: float = env("UPSTREAM_KEEPALIVE_EXPIRY", default=60.0, cast=float)
+    UPSTREAM_HTTP2: bool = env("UPSTREAM_HTTP2", default=True, cast=bool)
+    UPSTREAM_CONNECT_TIMEOUT: float = env("UPSTREAM_CONNECT_TIMEOUT", default=5.0, cast=float)
+    AZURE_TIMEOUT_SECONDS: float = env("AZURE_TIMEOUT_SECONDS", default=60.0, cast=float)
+    OPENAI_TIMEOUT_SECONDS: float = env("OPENAI_TIMEOUT_SECONDS", default=120.0, cast=float)
+    # Build the SDK clients (and import the SDK) at startup instead of on the first upstream call
+    PRELOAD_UPSTREAM_CLIENTS: bool = env("PRELOAD_UPSTREAM_CLIENTS", default=False, cast=bool)
+
+    # Upstream admission control, per process: concurrent requests and seconds a request may
+    # wait per lane, and tokens-per-minute quotas (0 = unlimited)
+    SCHEDULER_TOTAL_CONCURRENCY: int = env("SCHEDULER_TOTAL_CONCURRENCY", default=32, cast=int)
+    SCHEDULER_CHAT_RESERVE: int = env("SCHEDULER_CHAT_RESERVE", default=8, cast=int)
+    SCHEDULER_CHAT_CONCURRENCY: int = env("SCHEDULER_CHAT_CONCURRENCY", default=32, cast=int)
+    SCHEDULER_DOCUMENT_CONCURRENCY: int = env("SCHEDULER_DOCUMENT_CONCURRENCY", default=8, cast=int)
+    SCHEDULER_IMAGING_CONCURRENCY: int = env("SCHEDULER_IMAGING_CONCURRENCY", default=8, cast=int)
+    SCHEDULER_CHAT_MAX_WAIT: float = env("SCHEDULER_CHAT_MAX_WAIT", default=10.0, cast=float)
+    SCHEDULER_DOCUMENT_MAX_WAIT: float = env("SCHEDULER_DOCUMENT_MAX_WAIT", default=60.0, cast=float)
+    SCHEDULER_IMAGING_MAX_WAIT: float = env("SCHEDULER_IMAGING_MAX_WAIT", default=30.0, cast=float)
+    SCHEDULER_MAX_QUEUE: int = env("SCHEDULER_MAX_QUEUE", default=200, cast=int)
+    SCHEDULER_REPLY_TOKENS: int = env("SCHEDULER_REPLY_TOKENS", default=1000, cast=int)
+    AZURE_TOKENS_PER_MINUTE: int = env("AZURE_TOKENS_PER_MINUTE", default=0, cast=int)
+    OPENAI_TOKENS_PER_MINUTE: int = env("OPENAI_TOKENS_PER_MINUTE", default=0, cast=int)
+
+    # Upstream retries (jittered exponential backoff), circuit breaking and vision call hedging
+    UPSTREAM_RETRY_ATTEMPTS: int = env("UPSTREAM_RETRY_ATTEMPTS", default=3, cast=int)
+    UPSTREAM_RETRY_BASE_DELAY: float = env("UPSTREAM_RETRY_BASE_DELAY", default=0.5, cast=float)
+    UPSTREAM_RETRY_MAX_DELAY: float = env("UPSTREAM_RETRY_MAX_DELAY", default=8.0, cast=float)
+    CIRCUIT_FAILURE_THRESHOLD: int = env("CIRCUIT_FAILURE_THRESHOLD", default=5, cast=int)
+    CIRCUIT_RESET_SECONDS: float = env("CIRCUIT_RESET_SECONDS", default=30.0, cast=float)
+    VISION_HEDGING: bool = env("VISION_HEDGING", default=True, cast=bool)
+    HEDGE_PERCENTILE: float = env("HEDGE_PERCENTILE", default=0.95, cast=float)
+    HEDGE_MIN_DELAY: float = env("HEDGE_MIN_DELAY", default=2.0, cast=float)
+
+    # Assistant run polling
+    RUN_TIMEOUT_SECONDS: float = env("RUN_TIMEOUT_SECONDS", default=120.0, cast=float)
+    RUN_POLL_INITIAL_INTERVAL: float = env("RUN_POLL_INITIAL_INTERVAL", default=0.2, cast=float)
+    RUN_POLL_MAX_INTERVAL: float = env("RUN_POLL_MAX_INTERVAL", default=2.0, cast=float)
+    RUN_POLL_BACKOFF: float = env("RUN_POLL_BACKOFF", default=1.5, cast=float)
+
+    # Conversation backend: "assistants" (threads and runs) or "completions" (one chat
+    # completion per turn, history replayed from the conversation store)
+    CHAT_BACKEND: str = env("CHAT_BACKEND", default="assistants")
+    CHAT_DEPLOYMENT: str = env("CHAT_DEPLOYMENT", default="gpt-4o")
+    CHAT_HISTORY_TOKEN_BUDGET: int = env("CHAT_HISTORY_TOKEN_BUDGET", default=6000, cast=int)
+    CHAT_HISTORY_MAX_MESSAGES: int = env("CHAT_HISTORY_MAX_MESSAGES", default=100, cast=int)
+    CHAT_MAX_TOKENS: int = env("CHAT_MAX_TOKENS", default=0, cast=int)
+
+    # Conversation storage ("sqlite" or the legacy whole-file "json")
+    CONVERSATION_STORE_BACKEND: str = env("CONVERSATION_STORE_BACKEND", default="sqlite")
+    CONVERSATION_DB_FILE: str = env("CONVERSATION_DB_FILE", default="data/conversations.db")
+    # Whole-file JSON conversations: the "json" backend's storage, imported once into "sqlite"
+    MEDICAL_CONVERSATIONS_FILE: str = env("MEDICAL_CONVERSATIONS_FILE", default="data/medical_conversations.json")
+    DOCUMENT_CONVERSATIONS_FILE: str = env("DOCUMENT_CONVERSATIONS_FILE", default="data/document_conversations.json")
+
+    # Uploaded documents and extracted text, stored by content hash
+    DOCUMENT_STORE_DIR: str = env("DOCUMENT_STORE_DIR", default="data/documents")
+
+    # Document extraction limits and process pool (0 workers = one per CPU)
+    DOCUMENT_MAX_BYTES: int = env("DOCUMENT_MAX_BYTES", default=50 * 1024 * 1024, cast=int)
+    DOCUMENT_MAX_PAGES: int = env("DOCUMENT_MAX_PAGES", default=1000, cast=int)
+    DOCUMENT_PAGES_PER_TASK: int = env("DOCUMENT_PAGES_PER_TASK", default=25, cast=int)
+    DOCUMENT_PARSER_WORKERS: int = env("DOCUMENT_PARSER_WORKERS", default=0, cast=int)
+
+    # Document passage retrieval (token budgets are per turn)
+    RETRIEVAL_CHUNK_TOKENS: int = env("RETRIEVAL_CHUNK_TOKENS", default=300, cast=int)
+    RETRIEVAL_TOP_K: int = env("RETRIEVAL_TOP_K", default=12, cast=int)
+    RETRIEVAL_TOKEN_BUDGET: int = env("RETRIEVAL_TOKEN_BUDGET", default=3000, cast=int)
+    RETRIEVAL_UPLOAD_TOKEN_BUDGET: int = env("RETRIEVAL_UPLOAD_TOKEN_BUDGET", default=24000, cast=int)
+
+    # X-ray preprocessing before upload (0 workers = one per CPU)
+    IMAGE_MAX_EDGE: int = env("IMAGE_MAX_EDGE", default=1536, cast=int)
+    IMAGE_GRAYSCALE: bool = env("IMAGE_GRAYSCALE", default=True, cast=bool)
+    IMAGE_FORMAT: str = env("IMAGE_FORMAT", default="JPEG")
+    IMAGE_JPEG_QUALITY: int = env("IMAGE_JPEG_QUALITY", default=85, cast=int)
+    IMAGE_WORKERS: int = env("IMAGE_WORKERS", default=0, cast=int)
+
+    # Batch X-ray analysis
+    IMAGE_BATCH_MAX_FILES: int = env("IMAGE_BATCH_MAX_FILES", default=24, cast=int)
+    IMAGE_BATCH_CONCURRENCY: int = env("IMAGE_BATCH_CONCURRENCY", default=6, cast=int)
+
+    # X-ray analysis result cache
+    ANALYSIS_CACHE_MAX_BYTES: int = env("ANALYSIS_CACHE_MAX_BYTES", default=32 * 1024 * 1024, cast=int)
+    ANALYSIS_CACHE_TTL_SECONDS: float = env("ANALYSIS_CACHE_TTL_SECONDS", default=7 * 24 * 3600, cast=float)
+    ANALYSIS_CACHE_DIR: str = env("ANALYSIS_CACHE_DIR", default="data/cache/analysis")
+    ANALYSIS_CACHE_DISK_MAX_BYTES: int = env("ANALYSIS_CACHE_DISK_MAX_BYTES", default=256 * 1024 * 1024, cast=int)
+    ANALYSIS_CACHE_NEAR_DUPLICATES: bool = env("ANALYSIS_CACHE_NEAR_DUPLICATES", default=False, cast=bool)
+    ANALYSIS_CACHE_PHASH_DISTANCE: int = env("ANALYSIS_CACHE_PHASH_DISTANCE", default=2, cast=int)
+
+    # Text-to-speech: provider ("local" offline stand-in, or "elevenlabs"), voice and model,
+    # sentence clips synthesized ahead per reply, and the audio cache (memory and disk tiers)
+    SPEECH_PROVIDER: str = env("SPEECH_PROVIDER", default="local")
+    SPEECH_VOICE: str = env("SPEECH_VOICE", default="21m00Tcm4TlvDq8ikWAM")
+    SPEECH_MODEL: str = env("SPEECH_MODEL", default="eleven_flash_v2_5")
+    SPEECH_OUTPUT_FORMAT: str = env("SPEECH_OUTPUT_FORMAT", default="mp3_44100_128")
+    ELEVENLABS_API_KEY: str = env("ELEVENLABS_API_KEY", default="")
+    ELEVENLABS_BASE_URL: str = env("ELEVENLABS_BASE_URL", default="https://api.elevenlabs.io")
+    SPEECH_TIMEOUT_SECONDS: float = env("SPEECH_TIMEOUT_SECONDS", default=30.0, cast=float)
+    SPEECH_CONCURRENCY: int = env("SPEECH_CONCURRENCY", default=3, cast=int)
+    SPEECH_MIN_SENTENCE_CHARS: int = env("SPEECH_MIN_SENTENCE_CHARS", default=40, cast=int)
+    SPEECH_MAX_SENTENCE_CHARS: int = env("SPEECH_MAX_SENTENCE_CHARS", default=300, cast=int)
+    SPEECH_MAX_CHARS: int = env("SPEECH_MAX_CHARS", default=5000, cast=int)
+    SPEECH_CACHE_MAX_BYTES: int = env("SPEECH_CACHE_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+    SPEECH_CACHE_DIR: str = env("SPEECH_CACHE_DIR", default="data/cache/speech")
+    SPEECH_CACHE_DISK_MAX_BYTES: int = env("SPEECH_CACHE_DISK_MAX_BYTES", default=1024 * 1024 * 1024, cast=int)
+
+    # Background jobs (document analyses submitted to /thinker/jobs); 0 workers = API only
+    JOB_DB_FILE: str = env("JOB_DB_FILE", default="data/jobs.db")
+    JOB_WORKERS: int = env("JOB_WORKERS", default=2, cast=int)
+    JOB_QUEUE_MAX_DEPTH: int = env("JOB_QUEUE_MAX_DEPTH", default=100, cast=int)
+    JOB_LEASE_SECONDS: float = env("JOB_LEASE_SECONDS", default=30.0, cast=float)
+    JOB_MAX_ATTEMPTS: int = env("JOB_MAX_ATTEMPTS", default=3, cast=int)
+    JOB_POLL_INTERVAL: float = env("JOB_POLL_INTERVAL", default=1.0, cast=float)
+    JOB_RETENTION_SECONDS: float = env("JOB_RETENTION_SECONDS", default=24 * 3600, cast=float)
+
+    # Encoded read responses (GET /patients, conversation reads), revalidated with ETags;
+    # bodies this large or larger are compressed when the client accepts it (0 = never)
+    RESPONSE_CACHE_MAX_BYTES: int = env("RESPONSE_CACHE_MAX_BYTES", default=32 * 1024 * 1024, cast=int)
+    RESPONSE_COMPRESSION_MIN_BYTES: int = env("RESPONSE_COMPRESSION_MIN_BYTES", default=1024, cast=int)
+
+    # Patient registry storage
+    PATIENT_DB_FILE: str = env("PATIENT_DB_FILE", default="data/patients.db")
+    PATIENTS_FILE: str = env("PATIENTS_FILE", default="data/patients.json")
+
     class Config:
         case_sensitive = True
 
 
-settings = Settings()
\ No newline at end of file
+_settings: Optional[Settings] = None
+_settings_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    """Validate the environment into Settings on first use"""
+    global _settings
+    if _settings is not None:
+        return _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = Settings()
+        return _settings
+
+
+class LazySettings:
+    """Stands in for the Settings instance until an attribute is first read.
+
+    Modules keep importing settings at the top, but building and validating
+    it is left to the first request (or startup hook) that needs a value, so
+    importing the app, a parser worker or a benchmark helper stays cheap.
+    Each value is bound onto the proxy on its first read, so later reads are
+    plain attribute lookups.
+    """
+
+    def __getattr__(self, name: str):
+        value = getattr(get_settings(), name)
+        self.__dict__[name] = value
+        return value
+
+
+settings = LazySettings()
\ No newline at end of file
@@ -0,0 +1,734 @@
+import abc
+import base64
+import contextlib
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.metrics import storage_operation
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; writers are then only serialized within a process
+    fcntl = None
+
+def legacy_file_for(conversation_type: str) -> str:
+    """Return the legacy JSON file used for a conversation type (kept for migration and as a selectable backend)"""
+    if conversation_type == "medical":
+        return settings.MEDICAL_CONVERSATIONS_FILE
+    return settings.DOCUMENT_CONVERSATIONS_FILE
+
+
+class InvalidCursorError(ValueError):
+    """A pagination cursor could not be decoded"""
+
+
+def summarize_conversation(conversation_id: str, record: dict, conversation_type: str) -> dict:
+    """Listing entry for a full conversation record"""
+    messages = record.get("messages") or []
+    created_at = record.get("created_at") or 0
+    last_activity = messages[-1].get("timestamp") if messages else None
+    return {
+        "conversation_id": conversation_id,
+        "created_at": record.get("created_at"),
+        "updated_at": record.get("updated_at") or last_activity or created_at,
+        "title": record.get("title", "Untitled Conversation"),
+        "last_query": record.get("last_query", ""),
+        "message_count": len(messages),
+        "conversation_type": record.get("conversation_type", conversation_type),
+    }
+
+
+def page_messages(
+    messages: List[dict],
+    limit: Optional[int] = None,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    since: Optional[float] = None,
+) -> Tuple[List[dict], bool]:
+    """Apply message paging to a chronological list of messages carrying "message_id" """
+    if after is not None:
+        messages = [message for message in messages if message["message_id"] > after]
+    if before is not None:
+        messages = [message for message in messages if message["message_id"] < before]
+    if since is not None:
+        messages = [message for message in messages if (message.get("timestamp") or 0) > since]
+    if limit is None or len(messages) <= limit:
+        return messages, False
+    if after is not None or since is not None:
+        return messages[:limit], True
+    return messages[-limit:], True
+
+
+def encode_cursor(*position) -> str:
+    """Opaque pagination cursor for a sort position"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    if not isinstance(position, list):
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    return position
+
+
+def decode_summary_cursor(cursor: str) -> Tuple[float, str]:
+    """(updated_at, conversation_id) position of a conversation listing cursor"""
+    position = decode_cursor(cursor)
+    if len(position) != 2 or not isinstance(position[0], (int, float)) or not isinstance(position[1], str):
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    return position[0], position[1]
+
+
+class ConversationStore(abc.ABC):
+    """Storage engine interface for conversations of a single type.
+
+    Records are plain dicts shaped like the legacy JSON entries; messages are
+    kept under the "messages" key when a full record is returned.
+    """
+
+    def __init__(self, conversation_type: str):
+        self.conversation_type = conversation_type
+
+    @abc.abstractmethod
+    def get(self, conversation_id: str) -> Optional[dict]:
+        ...
+
+    def exists(self, conversation_id: str) -> bool:
+        return self.get(conversation_id) is not None
+
+    def get_record(self, conversation_id: str) -> Optional[dict]:
+        """Conversation record without its messages"""
+        record = self.get(conversation_id)
+        if record is not None:
+            record.pop("messages", None)
+        return record
+
+    def get_messages(
+        self,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        since: Optional[float] = None,
+    ) -> Optional[Tuple[List[dict], bool]]:
+        """A page of messages in chronological order, each carrying an increasing "message_id".
+
+        With after or since the page starts just past that message id or
+        timestamp (incremental fetch); otherwise it ends just before before,
+        or at the newest message. Returns (messages, whether more exist past
+        the page), or None if the conversation does not exist.
+        """
+        record = self.get(conversation_id)
+        if record is None:
+            return None
+        messages = [
+            {**message, "message_id": position}
+            for position, message in enumerate(record.get("messages") or [], start=1)
+        ]
+        return page_messages(messages, limit, before, after, since)
+
+    @abc.abstractmethod
+    def create(self, conversation_id: str, record: dict):
+        ...
+
+    @abc.abstractmethod
+    def update(self, conversation_id: str, updates: dict) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def append_message(self, conversation_id: str, message: dict) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, conversation_id: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def load_all(self) -> Dict[str, dict]:
+        ...
+
+    @abc.abstractmethod
+    def save_all(self, conversations: Dict[str, dict]):
+        ...
+
+    @abc.abstractmethod
+    def generation(self):
+        """A value that changes whenever stored conversations change, in any worker process"""
+
+    def list_summaries(self, limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Conversation summaries, most recently active first. Returns (page, cursor of the next page or None)."""
+        summaries = sorted(
+            (summarize_conversation(conversation_id, record, self.conversation_type)
+             for conversation_id, record in self.load_all().items()),
+            key=lambda summary: (summary["updated_at"], summary["conversation_id"]),
+            reverse=True,
+        )
+        if cursor:
+            updated_at, conversation_id = decode_summary_cursor(cursor)
+            summaries = [
+                summary for summary in summaries
+                if (summary["updated_at"], summary["conversation_id"]) < (updated_at, conversation_id)
+            ]
+        if limit is None or len(summaries) <= limit:
+            return summaries, None
+        last = summaries[limit - 1]
+        return summaries[:limit], encode_cursor(last["updated_at"], last["conversation_id"])
+
+    def close(self):
+        pass
+
+
+class JsonConversationStore(ConversationStore):
+    """Whole-file JSON storage (the original format). Every write rewrites the file.
+
+    Safe to share between worker processes: writers hold an exclusive lock on
+    a sidecar .lock file for the whole read-modify-write and replace the file
+    atomically, so readers never see a half-written file. Each process caches
+    the parsed file and re-reads it only when its (inode, size, mtime)
+    signature changes. load_all() shares records with the cache, so its
+    result must be treated as read-only; get() returns a private copy.
+    """
+
+    def __init__(self, conversation_type: str, file_path: Optional[str] = None):
+        super().__init__(conversation_type)
+        self.file_path = file_path or legacy_file_for(conversation_type)
+        self.lock_path = f"{self.file_path}.lock"
+        self._thread_lock = threading.RLock()
+        self._cache: Dict[str, dict] = {}
+        self._cache_signature = None
+
+    @contextlib.contextmanager
+    def _file_lock(self, exclusive: bool):
+        with self._thread_lock:
+            directory = os.path.dirname(self.file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _read(self) -> Dict[str, dict]:
+        """Current conversations, served from the cache while the file is unchanged. Caller holds the file lock."""
+        signature = self._signature()
+        if signature is None:
+            return {}
+        if signature != self._cache_signature:
+            with storage_operation("conversations", "load") as op, open(self.file_path, 'r') as f:
+                raw = f.read()
+                op.bytes = len(raw)
+            self._cache = json.loads(raw).get("conversations", {})
+            self._cache_signature = signature
+        return self._cache
+
+    def _write(self, conversations: Dict[str, dict]):
+        """Atomically replace the file. Caller holds the exclusive file lock."""
+        with storage_operation("conversations", "save") as op:
+            raw = json.dumps({"conversations": conversations}, indent=2)
+            op.bytes = len(raw)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.file_path) or ".", prefix=".tmp-")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(raw)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.file_path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+                raise
+        self._cache = conversations
+        self._cache_signature = self._signature()
+
+    def load_all(self) -> Dict[str, dict]:
+        try:
+            with self._file_lock(exclusive=False):
+                return dict(self._read())
+        except Exception as e:
+            print(f"Error loading {self.conversation_type} conversations: {e}")
+            return {}
+
+    def save_all(self, conversations: Dict[str, dict]):
+        with self._file_lock(exclusive=True):
+            self._write(dict(conversations))
+
+    def get(self, conversation_id: str) -> Optional[dict]:
+        with self._file_lock(exclusive=False):
+            record = self._read().get(conversation_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def exists(self, conversation_id: str) -> bool:
+        with self._file_lock(exclusive=False):
+            return conversation_id in self._read()
+
+    def generation(self):
+        # Writes replace the file, so its signature changes with every save
+        return self._signature()
+
+    # Writers copy the cached mapping and the record they change, so a failed write leaves the cache intact
+
+    def create(self, conversation_id: str, record: dict):
+        with self._file_lock(exclusive=True):
+            conversations = dict(self._read())
+            conversations[conversation_id] = record
+            self._write(conversations)
+
+    def update(self, conversation_id: str, updates: dict) -> bool:
+        with self._file_lock(exclusive=True):
+            conversations = dict(self._read())
+            if conversation_id not in conversations:
+                return False
+            conversations[conversation_id] = {**conversations[conversation_id], **updates}
+            self._write(conversations)
+            return True
+
+    def append_message(self, conversation_id: str, message: dict) -> bool:
+        with self._file_lock(exclusive=True):
+            conversations = dict(self._read())
+            if conversation_id not in conversations:
+                return False
+            record = conversations[conversation_id]
+            conversations[conversation_id] = {**record, "messages": [*record.get("messages", []), message]}
+            self._write(conversations)
+            return True
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._file_lock(exclusive=True):
+            conversations = dict(self._read())
+            if conversation_id not in conversations:
+                return False
+            del conversations[conversation_id]
+            self._write(conversations)
+            return True
+
+
+class SqliteConversationStore(ConversationStore):
+    """Per-conversation records in SQLite (WAL mode).
+
+    The conversation record and each message are stored as separate rows, so
+    appending a message or updating a field only touches that conversation.
+    A summary row per conversation (title, last query, message count, last
+    activity) is kept up to date on write, so listings never read records or
+    messages.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            conversation_type TEXT NOT NULL,
+            record TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS conversations_by_type ON conversations(conversation_type);
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+            body TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages(conversation_id, seq);
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            conversation_id TEXT PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+            conversation_type TEXT NOT NULL,
+            title TEXT NOT NULL,
+            last_query TEXT NOT NULL,
+            created_at REAL,
+            updated_at REAL NOT NULL,
+            message_count INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS summaries_by_recency
+            ON conversation_summaries(conversation_type, updated_at DESC, conversation_id DESC);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS store_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO store_generation (id, value) VALUES (1, 0);
+        CREATE TRIGGER IF NOT EXISTS conversations_inserted AFTER INSERT ON conversations
+        BEGIN
+            UPDATE store_generation SET value = value + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS conversations_updated AFTER UPDATE ON conversations
+        BEGIN
+            UPDATE store_generation SET value = value + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS conversations_deleted AFTER DELETE ON conversations
+        BEGIN
+            UPDATE store_generation SET value = value + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_inserted AFTER INSERT ON messages
+        BEGIN
+            UPDATE store_generation SET value = value + 1 WHERE id = 1;
+        END;
+    """
+
+    def __init__(self, conversation_type: str, db_path: str):
+        super().__init__(conversation_type)
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+        self._build_summaries()
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def _build_summaries(self):
+        """Create summary rows for conversations stored before the summary index existed (runs once per type)"""
+        marker = f"summaries:{self.conversation_type}"
+        with self._transaction():
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return
+            for conversation_id, record in self.load_all().items():
+                self._write_summary(summarize_conversation(conversation_id, record, self.conversation_type))
+            self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+
+    def _write_summary(self, summary: dict):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO conversation_summaries "
+            "(conversation_id, conversation_type, title, last_query, created_at, updated_at, message_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                summary["conversation_id"],
+                self.conversation_type,
+                summary["title"],
+                summary["last_query"],
+                summary["created_at"],
+                summary["updated_at"],
+                summary["message_count"],
+            ),
+        )
+
+    def _read_record(self, conversation_id: str, op=None) -> Optional[dict]:
+        row = self._conn.execute(
+            "SELECT record FROM conversations WHERE id = ? AND conversation_type = ?",
+            (conversation_id, self.conversation_type),
+        ).fetchone()
+        if row is None:
+            return None
+        if op is not None:
+            op.bytes += len(row[0])
+        return json.loads(row[0])
+
+    def _read_messages(self, conversation_id: str, op=None) -> list:
+        rows = self._conn.execute(
+            "SELECT body FROM messages WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,),
+        ).fetchall()
+        if op is not None:
+            op.bytes += sum(len(body) for (body,) in rows)
+        return [json.loads(body) for (body,) in rows]
+
+    def _insert(self, conversation_id: str, full_record: dict, op=None):
+        record = dict(full_record)
+        messages = [json.dumps(message) for message in record.pop("messages", None) or []]
+        body = json.dumps(record)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO conversations (id, conversation_type, record) VALUES (?, ?, ?)",
+            (conversation_id, self.conversation_type, body),
+        )
+        self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        self._conn.executemany(
+            "INSERT INTO messages (conversation_id, body) VALUES (?, ?)",
+            [(conversation_id, message) for message in messages],
+        )
+        self._write_summary(summarize_conversation(conversation_id, full_record, self.conversation_type))
+        if op is not None:
+            op.bytes += len(body) + sum(len(message) for message in messages)
+
+    def get(self, conversation_id: str) -> Optional[dict]:
+        with storage_operation("conversations", "load") as op, self._lock:
+            record = self._read_record(conversation_id, op)
+            if record is None:
+                return None
+            record["messages"] = self._read_messages(conversation_id, op)
+            return record
+
+    def exists(self, conversation_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM conversations WHERE id = ? AND conversation_type = ?",
+                (conversation_id, self.conversation_type),
+            ).fetchone()
+            return row is not None
+
+    def get_record(self, conversation_id: str) -> Optional[dict]:
+        with storage_operation("conversations", "load") as op, self._lock:
+            return self._read_record(conversation_id, op)
+
+    def get_messages(
+        self,
+        conversation_id: str,
+        limit: Optional[int] = None,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        since: Optional[float] = None,
+    ) -> Optional[Tuple[List[dict], bool]]:
+        conditions = ["conversation_id = ?"]
+        parameters: list = [conversation_id]
+        if after is not None:
+            conditions.append("seq > ?")
+            parameters.append(after)
+        if before is not None:
+            conditions.append("seq < ?")
+            parameters.append(before)
+        if since is not None:
+            conditions.append("json_extract(body, '$.timestamp') > ?")
+            parameters.append(since)
+        forward = after is not None or since is not None
+        query = f"SELECT seq, body FROM messages WHERE {' AND '.join(conditions)} ORDER BY seq {'ASC' if forward else 'DESC'}"
+        if limit is not None:
+            # One extra row tells whether more messages follow
+            query += " LIMIT ?"
+            parameters.append(limit + 1)
+
+        with storage_operation("conversations", "load") as op, self._lock:
+            if not self.exists(conversation_id):
+                return None
+            rows = self._conn.execute(query, parameters).fetchall()
+            op.bytes = sum(len(body) for _, body in rows)
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        if not forward:
+            rows.reverse()
+        return [{**json.loads(body), "message_id": seq} for seq, body in rows], has_more
+
+    def create(self, conversation_id: str, record: dict):
+        with storage_operation("conversations", "save") as op, self._transaction():
+            self._insert(conversation_id, record, op)
+
+    def update(self, conversation_id: str, updates: dict) -> bool:
+        updates = {key: value for key, value in updates.items() if key != "messages"}
+        with storage_operation("conversations", "save") as op, self._transaction():
+            record = self._read_record(conversation_id)
+            if record is None:
+                return False
+            record.update(updates)
+            body = json.dumps(record)
+            op.bytes = len(body)
+            self._conn.execute(
+                "UPDATE conversations SET record = ? WHERE id = ? AND conversation_type = ?",
+                (body, conversation_id, self.conversation_type),
+            )
+            # A new question counts as activity; renames and metadata changes keep the listing order
+            self._conn.execute(
+                "UPDATE conversation_summaries SET title = ?, last_query = ?, "
+                "updated_at = CASE WHEN ? THEN ? ELSE updated_at END WHERE conversation_id = ? AND conversation_type = ?",
+                (
+                    record.get("title", "Untitled Conversation"),
+                    record.get("last_query", ""),
+                    "last_query" in updates,
+                    time.time(),
+                    conversation_id,
+                    self.conversation_type,
+                ),
+            )
+            return True
+
+    def append_message(self, conversation_id: str, message: dict) -> bool:
+        with storage_operation("conversations", "save") as op, self._transaction():
+            if not self.exists(conversation_id):
+                return False
+            body = json.dumps(message)
+            op.bytes = len(body)
+            self._conn.execute(
+                "INSERT INTO messages (conversation_id, body) VALUES (?, ?)",
+                (conversation_id, body),
+            )
+            self._conn.execute(
+                "UPDATE conversation_summaries SET message_count = message_count + 1, updated_at = ? "
+                "WHERE conversation_id = ?",
+                (message.get("timestamp") or time.time(), conversation_id),
+            )
+            return True
+
+    def delete(self, conversation_id: str) -> bool:
+        with storage_operation("conversations", "delete"), self._transaction():
+            cursor = self._conn.execute(
+                "DELETE FROM conversations WHERE id = ? AND conversation_type = ?",
+                (conversation_id, self.conversation_type),
+            )
+            return cursor.rowcount > 0
+
+    def load_all(self) -> Dict[str, dict]:
+        with storage_operation("conversations", "load") as op, self._lock:
+            conversations = {}
+            for conversation_id, record in self._conn.execute(
+                "SELECT id, record FROM conversations WHERE conversation_type = ? ORDER BY rowid",
+                (self.conversation_type,),
+            ):
+                op.bytes += len(record)
+                conversations[conversation_id] = {**json.loads(record), "messages": []}
+            for conversation_id, body in self._conn.execute(
+                "SELECT m.conversation_id, m.body FROM messages m "
+                "JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE c.conversation_type = ? ORDER BY m.seq",
+                (self.conversation_type,),
+            ):
+                op.bytes += len(body)
+                conversations[conversation_id]["messages"].append(json.loads(body))
+            return conversations
+
+    def save_all(self, conversations: Dict[str, dict]):
+        with storage_operation("conversations", "save") as op, self._transaction():
+            self._conn.execute(
+                "DELETE FROM conversations WHERE conversation_type = ?",
+                (self.conversation_type,),
+            )
+            for conversation_id, record in conversations.items():
+                self._insert(conversation_id, record, op)
+
+    def generation(self) -> int:
+        """Bumped by triggers on every conversation or message write; shared by both conversation types"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM store_generation WHERE id = 1").fetchone()[0]
+
+    def list_summaries(self, limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        query = (
+            "SELECT conversation_id, created_at, updated_at, title, last_query, message_count "
+            "FROM conversation_summaries WHERE conversation_type = ?"
+        )
+        parameters: list = [self.conversation_type]
+        if cursor:
+            updated_at, conversation_id = decode_summary_cursor(cursor)
+            query += " AND (updated_at < ? OR (updated_at = ? AND conversation_id < ?))"
+            parameters += [updated_at, updated_at, conversation_id]
+        query += " ORDER BY updated_at DESC, conversation_id DESC"
+        if limit is not None:
+            # One extra row tells whether another page follows
+            query += " LIMIT ?"
+            parameters.append(limit + 1)
+        with storage_operation("conversations", "list"), self._lock:
+            rows = self._conn.execute(query, parameters).fetchall()
+        summaries = [
+            {
+                "conversation_id": conversation_id,
+                "created_at": created_at,
+                "updated_at": updated_at,
+                "title": title,
+                "last_query": last_query,
+                "message_count": message_count,
+                "conversation_type": self.conversation_type,
+            }
+            for conversation_id, created_at, updated_at, title, last_query, message_count in rows
+        ]
+        if limit is None or len(summaries) <= limit:
+            return summaries, None
+        last = summaries[limit - 1]
+        return summaries[:limit], encode_cursor(last["updated_at"], last["conversation_id"])
+
+    def import_json_file(self, file_path: str) -> int:
+        """Import a legacy JSON conversation file once. Returns the number of conversations imported."""
+        marker = f"imported:{self.conversation_type}:{os.path.abspath(file_path)}"
+        if not os.path.exists(file_path):
+            return 0
+        with self._transaction():
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return 0
+            # Read directly: nothing writes the legacy file once SQLite is in use, so no lock file is needed
+            with open(file_path, 'r') as f:
+                conversations = json.load(f).get("conversations", {})
+            for conversation_id, record in conversations.items():
+                if self._read_record(conversation_id) is None:
+                    self._insert(conversation_id, record)
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                (marker, str(time.time())),
+            )
+            return len(conversations)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Transaction:
+    """Serialize a write transaction on a shared connection."""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock):
+        self._conn = conn
+        self._lock = lock
+        self._nested = False
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._nested = self._conn.in_transaction
+        if not self._nested:
+            self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if not self._nested:
+                self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+        return False
+
+
+_stores: Dict[str, ConversationStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_conversation_store(conversation_type: str = "document") -> ConversationStore:
+    """Return the process-wide store for a conversation type, opening it on first use"""
+    with _stores_lock:
+        store = _stores.get(conversation_type)
+        if store is None:
+            store = open_conversation_store(conversation_type)
+            _stores[conversation_type] = store
+        return store
+
+
+def open_conversation_store(conversation_type: str) -> ConversationStore:
+    """Build the storage engine selected by CONVERSATION_STORE_BACKEND"""
+    backend = settings.CONVERSATION_STORE_BACKEND.lower()
+    if backend == "json":
+        return JsonConversationStore(conversation_type)
+    if backend == "sqlite":
+        store = SqliteConversationStore(conversation_type, settings.CONVERSATION_DB_FILE)
+        legacy_file = legacy_file_for(conversation_type)
+        if os.path.exists(legacy_file):
+            imported = store.import_json_file(legacy_file)
+            if imported:
+                print(f"Imported {imported} {conversation_type} conversations from {legacy_file}")
+        return store
+    raise ValueError(f"Unknown conversation store backend: {settings.CONVERSATION_STORE_BACKEND}")
+
+
+def close_conversation_stores():
+    """Close every open store (used at application shutdown)"""
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
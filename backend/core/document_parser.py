@@ -0,0 +1,174 @@
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional
+
+from core.config import settings
+from core.metrics import DOCUMENT_PARSE_DURATION
+
+
+class DocumentParseError(Exception):
+    """The document could not be read"""
+    status_code = 400
+
+
+class DocumentTooLargeError(DocumentParseError):
+    """The document exceeds the configured size or page limits"""
+    status_code = 413
+
+
+def iter_pdf_pages(source, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of PDF pages [start, stop) one at a time.
+
+    source is a file path or the raw bytes; pages are extracted lazily so only
+    one page of text is held at a time.
+    """
+    import PyPDF2  # parsers load on first use, off the app's startup path
+
+    reader = PyPDF2.PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+    pages = reader.pages
+    stop = len(pages) if stop is None else min(stop, len(pages))
+    for index in range(start, stop):
+        yield pages[index].extract_text() or ""
+
+
+def pdf_page_count(source) -> int:
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(source if isinstance(source, str) else io.BytesIO(source))
+    return len(reader.pages)
+
+
+def extract_pdf_page_range(source, start: int, stop: int) -> List[str]:
+    """Worker entry point: extract one range of pages"""
+    return list(iter_pdf_pages(source, start, stop))
+
+
+def extract_text_from_pdf(source) -> str:
+    """Extract text from PDF file"""
+    try:
+        return "".join(page + "\n" for page in iter_pdf_pages(source))
+    except Exception as e:
+        raise DocumentParseError(f"Error reading PDF: {str(e)}")
+
+
+def extract_text_from_docx(source) -> str:
+    """Extract text from DOCX file"""
+    import docx
+
+    try:
+        doc = docx.Document(source if isinstance(source, str) else io.BytesIO(source))
+        return "".join(paragraph.text + "\n" for paragraph in doc.paragraphs)
+    except Exception as e:
+        raise DocumentParseError(f"Error reading DOCX: {str(e)}")
+
+
+def extract_text_from_txt(source) -> str:
+    """Extract text from TXT file"""
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        return source.decode('utf-8')
+    except Exception as e:
+        raise DocumentParseError(f"Error reading TXT: {str(e)}")
+
+
+def check_document_size(size: int):
+    """Reject documents over DOCUMENT_MAX_BYTES before they are stored or parsed"""
+    if size > settings.DOCUMENT_MAX_BYTES:
+        raise DocumentTooLargeError(
+            f"Document is {size} bytes; the limit is {settings.DOCUMENT_MAX_BYTES} bytes"
+        )
+
+
+def file_extension(filename: str) -> str:
+    return filename.split('.')[-1].lower()
+
+
+def extract_text(source, filename: str) -> str:
+    """Extract text from a document (path or bytes) based on its file extension"""
+    extension = file_extension(filename)
+
+    if extension == 'pdf':
+        return extract_text_from_pdf(source)
+    elif extension in ['docx', 'doc']:
+        return extract_text_from_docx(source)
+    elif extension == 'txt':
+        return extract_text_from_txt(source)
+    else:
+        raise DocumentParseError(f"Unsupported file type: {extension}")
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_parser_executor() -> ProcessPoolExecutor:
+    """Process pool used for document extraction, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.DOCUMENT_PARSER_WORKERS or os.cpu_count())
+        return _executor
+
+
+def shutdown_parser_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def pool_failure(error: Exception, description: str) -> DocumentParseError:
+    """Wrap an extraction failure; a pool whose worker died is replaced for the next request"""
+    if isinstance(error, DocumentParseError):
+        return error
+    if isinstance(error, BrokenProcessPool):
+        shutdown_parser_executor()
+    return DocumentParseError(f"Error reading {description}: {str(error)}")
+
+
+async def extract_text_async(path: str, filename: str) -> str:
+    """Extract a stored document's text in the process pool without blocking the event loop.
+
+    PDFs are split into page ranges that are extracted in parallel. Workers
+    read the file from path, so the upload is never copied between processes.
+    """
+    check_document_size(os.path.getsize(path))
+
+    extension = file_extension(filename)
+    parse_format = extension if extension in ('pdf', 'docx', 'doc', 'txt') else 'other'
+    with DOCUMENT_PARSE_DURATION.time(format=parse_format):
+        loop = asyncio.get_running_loop()
+        executor = get_parser_executor()
+
+        if extension != 'pdf':
+            try:
+                return await loop.run_in_executor(executor, extract_text, path, filename)
+            except Exception as e:
+                raise pool_failure(e, "document")
+
+        try:
+            page_count = await loop.run_in_executor(executor, pdf_page_count, path)
+        except Exception as e:
+            raise pool_failure(e, "PDF")
+        if page_count > settings.DOCUMENT_MAX_PAGES:
+            raise DocumentTooLargeError(
+                f"Document has {page_count} pages; the limit is {settings.DOCUMENT_MAX_PAGES} pages"
+            )
+
+        pages_per_task = max(1, settings.DOCUMENT_PAGES_PER_TASK)
+        ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+        try:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(executor, extract_pdf_page_range, path, start, stop)
+                for start, stop in ranges
+            ))
+        except Exception as e:
+            raise pool_failure(e, "PDF")
+        return "".join(page + "\n" for pages in results for page in pages)
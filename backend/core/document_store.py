@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import List, Optional
+
+from core.config import settings
+
+
+def content_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class DocumentStore:
+    """Content-addressed storage for uploaded documents and their extracted text.
+
+    Each upload is stored once under its SHA-256 digest; the extracted text is
+    cached next to it, so re-uploading the same file is a hash lookup.
+
+        <root>/blobs/ab/abcdef...         original bytes
+        <root>/text/ab/abcdef....txt      extracted text
+        <root>/chunks/ab/abcdef....json   retrieval passages
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, kind: str, digest: str, suffix: str = "") -> str:
+        return os.path.join(self.root, kind, digest[:2], digest + suffix)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def blob_path(self, digest: str) -> str:
+        return self._path("blobs", digest)
+
+    def put_blob(self, content: bytes) -> str:
+        """Store an upload and return its digest; existing blobs are not rewritten"""
+        digest = content_digest(content)
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            self._write_atomic(path, content)
+        return digest
+
+    def has_blob(self, digest: str) -> bool:
+        return os.path.exists(self.blob_path(digest))
+
+    def delete_blob(self, digest: str):
+        """Remove an upload, e.g. one that turned out not to be parseable"""
+        try:
+            os.remove(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def get_blob(self, digest: str) -> Optional[bytes]:
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def get_text(self, digest: str) -> Optional[str]:
+        path = self._path("text", digest, ".txt")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put_text(self, digest: str, text: str):
+        self._write_atomic(self._path("text", digest, ".txt"), text.encode("utf-8"))
+
+    def get_chunks(self, digest: str) -> Optional[List[str]]:
+        path = self._path("chunks", digest, ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put_chunks(self, digest: str, chunks: List[str]):
+        self._write_atomic(self._path("chunks", digest, ".json"), json.dumps(chunks).encode("utf-8"))
+
+    def put_inline_text(self, text: str) -> str:
+        """Store text that has no original upload (legacy inline document context)"""
+        digest = content_digest(text.encode("utf-8"))
+        if self.get_text(digest) is None:
+            self.put_text(digest, text)
+        return digest
+
+
+_document_store: Optional[DocumentStore] = None
+_document_store_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    global _document_store
+    with _document_store_lock:
+        if _document_store is None:
+            _document_store = DocumentStore(settings.DOCUMENT_STORE_DIR)
+        return _document_store
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from core.config import settings
+
+
+def load_pillow():
+    """(Image, ImageOps), imported on first use; (None, None) without Pillow, which is optional"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:  # images are then sent unchanged
+        return None, None
+    return Image, ImageOps
+
+
+def to_8bit(image):
+    """Rescale a high-bit-depth grayscale image (16-bit "I;16*", 32-bit "I" or float "F") to 8-bit "L".
+
+    convert("L") clips every value above 255 to white, which blanks most
+    16-bit scans; the image's own darkest and brightest values are stretched
+    to 0-255 instead. Other modes are returned unchanged.
+    """
+    if image.mode not in ("I", "F") and not image.mode.startswith("I;16"):
+        return image
+    if image.mode != "F":
+        image = image.convert("I")
+    low, high = image.getextrema()
+    scale = 255 / (high - low) if high > low else 0
+    return image.point(lambda value: (value - low) * scale).convert("L")
+
+
+def preprocess_image(
+    image_data: bytes,
+    content_type: str,
+    max_edge: int,
+    grayscale: bool,
+    output_format: str,
+    quality: int,
+) -> Tuple[bytes, str]:
+    """Downsample, optionally convert to grayscale and re-encode an image.
+
+    Re-encoding writes only pixel data, so EXIF and other embedded metadata
+    are dropped. Returns (encoded bytes, content type). Without Pillow the
+    input is returned as-is.
+    """
+    Image, ImageOps = load_pillow()
+    if Image is None:
+        return image_data, content_type
+
+    with Image.open(io.BytesIO(image_data)) as image:
+        image = to_8bit(ImageOps.exif_transpose(image))
+        if max_edge and max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        if output_format.upper() == "PNG":
+            image.save(output, format="PNG", optimize=True)
+            return output.getvalue(), "image/png"
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue(), "image/jpeg"
+
+
+# Hashes with fewer bits of either value than this come from images with almost
+# no structure (blank, flat or smooth ramps), which would all match each other
+MIN_PHASH_BITS = 8
+
+
+def perceptual_hash(image_data: bytes) -> Optional[int]:
+    """64-bit difference hash (dHash) of an image.
+
+    Visually identical images (re-exports, re-compression, small resizes)
+    have hashes within a few bits of each other. Returns None without Pillow,
+    and for images too featureless for the hash to tell apart.
+    """
+    Image, _ = load_pillow()
+    if Image is None:
+        return None
+    with Image.open(io.BytesIO(image_data)) as image:
+        pixels = list(to_8bit(image).convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            right = pixels[row * 9 + column + 1]
+            value = (value << 1) | (left > right)
+    if not MIN_PHASH_BITS <= bin(value).count("1") <= 64 - MIN_PHASH_BITS:
+        return None
+    return value
+
+
+def encode_image_for_upload(
+    image_data: bytes,
+    content_type: str,
+    original: bool = False,
+    with_phash: bool = False,
+) -> Tuple[str, int, Optional[int]]:
+    """Worker entry point: preprocess (unless original) and return (data URL, encoded image bytes, perceptual hash)"""
+    phash = perceptual_hash(image_data) if with_phash else None
+    if not original:
+        image_data, content_type = preprocess_image(
+            image_data,
+            content_type,
+            max_edge=settings.IMAGE_MAX_EDGE,
+            grayscale=settings.IMAGE_GRAYSCALE,
+            output_format=settings.IMAGE_FORMAT,
+            quality=settings.IMAGE_JPEG_QUALITY,
+        )
+    b64_image = base64.b64encode(image_data).decode("utf-8")
+    return f"data:{content_type};base64,{b64_image}", len(image_data), phash
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_image_executor() -> ProcessPoolExecutor:
+    """Process pool used for image preprocessing, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS or os.cpu_count())
+        return _executor
+
+
+def shutdown_image_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def prepare_image(
+    image_data: bytes,
+    content_type: str,
+    original: bool = False,
+    with_phash: bool = False,
+) -> Tuple[str, int, Optional[int]]:
+    """Preprocess and base64-encode an image off the event loop. Returns (data URL, encoded image bytes, perceptual hash)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_image_executor(), encode_image_for_upload, image_data, content_type, original, with_phash
+    )
@@ -0,0 +1,404 @@
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from core.config import settings
+from core.metrics import JOB_DURATION, JOB_QUEUE_DEPTH, JOB_WAIT
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = {COMPLETED, FAILED, CANCELLED}
+
+JobHandler = Callable[[dict], Awaitable[dict]]
+
+# A worker whose store calls fail backs off from this delay, doubling up to the maximum
+ERROR_BACKOFF_SECONDS = 0.5
+ERROR_BACKOFF_MAX_SECONDS = 30.0
+
+# Handlers by job kind; routers register theirs at import time
+job_handlers: Dict[str, JobHandler] = {}
+
+
+def register_job_handler(kind: str, handler: JobHandler):
+    """Run handler(payload) -> result for jobs of this kind"""
+    job_handlers[kind] = handler
+
+
+class QueueFullError(Exception):
+    """The queue already holds JOB_QUEUE_MAX_DEPTH waiting jobs"""
+
+
+class JobStore:
+    """Job records in SQLite, shared by every worker process.
+
+    Workers claim a queued job by taking a lease on it and renew the lease
+    while the job runs. A job whose lease expires (its process died or was
+    killed) is claimed again, up to JOB_MAX_ATTEMPTS times, so submitted work
+    survives restarts.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            worker TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs(status, created_at);
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Write transaction; BEGIN IMMEDIATE serializes it against other processes"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["error"] = json.loads(job["error"]) if job["error"] else None
+        return job
+
+    def submit(self, kind: str, payload: dict, max_depth: int) -> dict:
+        """Queue a job; raises QueueFullError when max_depth jobs are already waiting"""
+        job_id = str(uuid.uuid4())
+        with self._transaction() as conn:
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if max_depth and depth >= max_depth:
+                raise QueueFullError(f"{depth} jobs are already queued; try again later")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), time.time())
+            )
+        JOB_QUEUE_DEPTH.set(depth + 1)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row is not None else None
+
+    def queue_position(self, job: dict) -> Optional[int]:
+        """1-based position of a queued job, oldest first"""
+        if job["status"] != QUEUED:
+            return None
+        with self._lock:
+            ahead = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, job["created_at"])
+            ).fetchone()[0]
+        return ahead + 1
+
+    def claim(self, worker: str, lease_seconds: float, max_attempts: int) -> Optional[dict]:
+        """Lease the oldest runnable job (queued, or running with an expired lease) to worker"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_until = NULL, finished_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, json.dumps({"detail": "Job was interrupted too many times", "status_code": 500}),
+                 now, RUNNING, now, max_attempts)
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                JOB_QUEUE_DEPTH.set(0)
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (RUNNING, worker, now + lease_seconds, now, row["id"])
+            )
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+        JOB_QUEUE_DEPTH.set(depth)
+        return self.get(row["id"])
+
+    def renew(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        """Extend a lease; False once the job was cancelled or taken over by another worker"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND worker = ?",
+                (time.time() + lease_seconds, job_id, RUNNING, worker)
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, worker: str, status: str, result: Optional[dict] = None, error: Optional[dict] = None) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, worker = NULL, lease_until = NULL, finished_at = ? "
+                "WHERE id = ? AND status = ? AND worker = ?",
+                (status, json.dumps(result) if result is not None else None,
+                 json.dumps(error) if error is not None else None,
+                 time.time(), job_id, RUNNING, worker)
+            )
+        return cursor.rowcount == 1
+
+    def requeue(self, job_id: str, worker: str):
+        """Hand a running job back to the queue (worker shutdown); the attempt is not counted"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE id = ? AND status = ? AND worker = ?",
+                (QUEUED, job_id, RUNNING, worker)
+            )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; a running job stops when its worker next renews the lease"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, finished_at = ? "
+                "WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def prune(self, finished_before: float) -> int:
+        """Delete finished jobs older than finished_before"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+                (*sorted(FINISHED_STATUSES), finished_before)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """Runs queued jobs on a pool of asyncio workers in this process.
+
+    Workers wake immediately for jobs submitted here and poll every
+    JOB_POLL_INTERVAL for jobs submitted by other processes. Jobs still
+    running at shutdown go back to the queue. A worker that hits a store
+    error (e.g. a locked database) logs it and backs off; one that exits
+    anyway is restarted.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._stopping = False
+        self._last_prune = 0.0
+        self._instance = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def start(self, workers: Optional[int] = None):
+        workers = settings.JOB_WORKERS if workers is None else workers
+        self._stopping = False
+        for index in range(workers):
+            self._spawn(f"{self._instance}-{index}")
+
+    def _spawn(self, worker: str):
+        task = asyncio.create_task(self._work(worker))
+        task.add_done_callback(lambda done: self._worker_exited(worker, done))
+        self._workers.append(task)
+
+    def _worker_exited(self, worker: str, task: asyncio.Task):
+        if task in self._workers:
+            self._workers.remove(task)
+        if self._stopping or task.cancelled():
+            return
+        print(f"Job worker {worker} exited unexpectedly ({task.exception()!r}); restarting it")
+        self._spawn(worker)
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def _notify(self):
+        """Wake status subscribers in this process"""
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float):
+        """Wait until a job in this process changes state, or timeout (for changes made elsewhere)"""
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def submit(self, kind: str, payload: dict) -> dict:
+        if kind not in job_handlers:
+            raise ValueError(f"No handler registered for {kind} jobs")
+        job = self.store.submit(kind, payload, settings.JOB_QUEUE_MAX_DEPTH)
+        self._wakeup.set()
+        self._notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        cancelled = self.store.cancel(job_id)
+        task = self._running.get(job_id)
+        if cancelled and task is not None:
+            task.cancel()
+        if cancelled:
+            self._notify()
+        return cancelled
+
+    async def _work(self, worker: str):
+        failures = 0
+        while True:
+            try:
+                await self._work_once(worker)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The job, if one was claimed, keeps its lease until it expires and is claimed again
+                delay = min(ERROR_BACKOFF_SECONDS * 2 ** failures, ERROR_BACKOFF_MAX_SECONDS)
+                failures += 1
+                print(f"Job worker {worker} error: {e!r}; retrying in {delay:g}s")
+                await asyncio.sleep(delay)
+
+    async def _work_once(self, worker: str):
+        """Claim and run one job, or wait for one to be submitted"""
+        self._wakeup.clear()
+        job = self.store.claim(worker, settings.JOB_LEASE_SECONDS, settings.JOB_MAX_ATTEMPTS)
+        if job is None:
+            self._prune()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            return
+        self._notify()
+        await self._execute(job, worker)
+
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        try:
+            self.store.prune(now - settings.JOB_RETENTION_SECONDS)
+        except sqlite3.Error as e:
+            print(f"Error pruning jobs: {e}")
+
+    async def _keep_lease(self, job_id: str, worker: str, task: asyncio.Task):
+        """Renew the job's lease while it runs; stop the job if it was cancelled or taken over"""
+        interval = settings.JOB_LEASE_SECONDS / 3
+        while not task.done():
+            await asyncio.sleep(interval)
+            if task.done():
+                return
+            try:
+                renewed = self.store.renew(job_id, worker, settings.JOB_LEASE_SECONDS)
+            except sqlite3.Error as e:
+                # Try again next interval; the lease outlasts a couple of missed renewals
+                print(f"Error renewing lease on job {job_id}: {e}")
+                continue
+            if not renewed:
+                task.cancel()
+                return
+
+    async def _execute(self, job: dict, worker: str):
+        job_id, kind = job["id"], job["kind"]
+        if job["attempts"] == 1:
+            JOB_WAIT.observe(job["started_at"] - job["created_at"], kind=kind)
+        handler = job_handlers.get(kind)
+        if handler is None:
+            self.store.finish(job_id, worker, FAILED, error={"detail": f"Unknown job kind {kind}", "status_code": 500})
+            self._notify()
+            return
+
+        task = asyncio.create_task(handler(job["payload"]))
+        self._running[job_id] = task
+        lease = asyncio.create_task(self._keep_lease(job_id, worker, task))
+        start = time.perf_counter()
+        status = FAILED
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if self._stopping:
+                self.store.requeue(job_id, worker)
+                status = QUEUED
+                raise
+            # Cancelled through cancel() or by losing the lease; the store already reflects that
+            status = CANCELLED
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            error = {
+                "detail": getattr(e, "detail", None) or str(e) or type(e).__name__,
+                "status_code": getattr(e, "status_code", 500)
+            }
+            self.store.finish(job_id, worker, FAILED, error=error)
+        else:
+            status = COMPLETED
+            self.store.finish(job_id, worker, COMPLETED, result=result)
+        finally:
+            lease.cancel()
+            self._running.pop(job_id, None)
+            JOB_DURATION.observe(time.perf_counter() - start, kind=kind, status=status)
+            self._notify()
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, opening its store on first use"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(JobStore(settings.JOB_DB_FILE))
+        return _job_queue
+
+
+async def close_job_queue():
+    """Stop the workers, returning running jobs to the queue, and close the store"""
+    global _job_queue
+    with _job_queue_lock:
+        queue, _job_queue = _job_queue, None
+    if queue is not None:
+        await queue.stop()
+        queue.store.close()
@@ -0,0 +1,359 @@
+import abc
+import contextlib
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Exposition lines for every label combination"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall time spent in the block, including awaits"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in values:
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += state[index]
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-2])}"
+            yield f"{self.name}_count{labels} {_format_value(state[-1])}"
+
+
+class MetricsRegistry:
+    """Process-local collection of metrics rendered in the Prometheus text format.
+
+    Each worker process keeps its own values; with several workers a scrape
+    sees whichever worker answered it.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+# HTTP
+HTTP_REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "Time from request start until the response body was fully sent",
+    ("method", "route", "status"),
+)
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled",
+    ("method", "route"),
+)
+
+# Upstream model calls
+UPSTREAM_STAGE_DURATION = registry.histogram(
+    "upstream_stage_duration_seconds",
+    "Time spent in each upstream stage attempt (thread_create, message_create, run_create, run_wait, "
+    "run_retrieve, run_stream, run_cancel, messages_list, chat_completion_create, chat_completion_stream, "
+    "vision_call, speech_synthesize)",
+    ("stage",),
+)
+UPSTREAM_STAGE_ERRORS = registry.counter(
+    "upstream_stage_errors_total",
+    "Upstream stages that raised an error",
+    ("stage",),
+)
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "upstream_stage_in_flight",
+    "Upstream stages currently in progress",
+    ("stage",),
+)
+SCHEDULER_QUEUE_DEPTH = registry.gauge(
+    "upstream_scheduler_queue_depth",
+    "Requests waiting for upstream admission",
+    ("lane",),
+)
+SCHEDULER_ACTIVE = registry.gauge(
+    "upstream_scheduler_active",
+    "Admitted requests currently holding an upstream slot",
+    ("lane",),
+)
+SCHEDULER_WAIT = registry.histogram(
+    "upstream_scheduler_wait_seconds",
+    "Time spent waiting for upstream admission",
+    ("lane",),
+)
+SCHEDULER_REJECTED = registry.counter(
+    "upstream_scheduler_rejected_total",
+    "Requests rejected by the upstream scheduler (queue_full, over_deadline, timeout)",
+    ("lane", "reason"),
+)
+UPSTREAM_RETRIES = registry.counter(
+    "upstream_retries_total",
+    "Upstream calls retried after a transient failure",
+    ("upstream", "stage"),
+)
+UPSTREAM_HEDGES = registry.counter(
+    "upstream_hedges_total",
+    "Hedged duplicate calls started, by which copy answered first (primary, hedge or none)",
+    ("stage", "winner"),
+)
+CIRCUIT_STATE = registry.gauge(
+    "upstream_circuit_state",
+    "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)",
+    ("upstream",),
+)
+CIRCUIT_REJECTED = registry.counter(
+    "upstream_circuit_rejected_total",
+    "Calls failed fast because the upstream's circuit was open",
+    ("upstream",),
+)
+RUN_POLLS = registry.histogram(
+    "assistant_run_polls",
+    "Status polls needed per assistant run",
+    buckets=COUNT_BUCKETS,
+)
+RUN_STREAM_FIRST_TOKEN = registry.histogram(
+    "assistant_stream_first_token_seconds",
+    "Time from starting a streamed run or chat completion to its first text delta",
+)
+
+# Storage
+STORAGE_DURATION = registry.histogram(
+    "storage_operation_duration_seconds",
+    "Time spent loading and saving records",
+    ("store", "operation"),
+)
+STORAGE_BYTES = registry.histogram(
+    "storage_operation_bytes",
+    "Serialized bytes read or written per storage operation",
+    ("store", "operation"),
+    buckets=BYTE_BUCKETS,
+)
+
+# Read response cache
+RESPONSE_CACHE_REQUESTS = registry.counter(
+    "response_cache_requests_total",
+    "Cached read responses, by cache and result (hit, miss or not_modified)",
+    ("cache", "result"),
+)
+
+# Documents
+DOCUMENT_PARSE_DURATION = registry.histogram(
+    "document_parse_duration_seconds",
+    "Time spent extracting text from uploaded documents",
+    ("format",),
+)
+
+# Speech
+SPEECH_CACHE_REQUESTS = registry.counter(
+    "speech_cache_requests_total",
+    "Sentence clips looked up in the audio cache, by result (hit or miss)",
+    ("result",),
+)
+SPEECH_FIRST_AUDIO = registry.histogram(
+    "speech_first_audio_seconds",
+    "Time from starting a spoken reply to its first audio clip being ready",
+)
+
+# Background jobs
+JOB_QUEUE_DEPTH = registry.gauge(
+    "job_queue_depth",
+    "Jobs waiting to be claimed, as last seen by this worker",
+)
+JOB_WAIT = registry.histogram(
+    "job_wait_seconds",
+    "Time from job submission until a worker first claimed it",
+    ("kind",),
+)
+JOB_DURATION = registry.histogram(
+    "job_duration_seconds",
+    "Time spent running jobs, by outcome",
+    ("kind", "status"),
+)
+
+
+@contextlib.contextmanager
+def upstream_stage(stage: str):
+    """Time one upstream stage, counting it as in flight and recording errors"""
+    UPSTREAM_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        UPSTREAM_STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+        UPSTREAM_IN_FLIGHT.dec(stage=stage)
+
+
+class StorageOperation:
+    """Handle yielded by storage_operation(); add the bytes read or written to it"""
+
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+
+@contextlib.contextmanager
+def storage_operation(store: str, operation: str):
+    """Time a storage load/save and record how many serialized bytes it moved"""
+    op = StorageOperation()
+    start = time.perf_counter()
+    try:
+        yield op
+    finally:
+        STORAGE_DURATION.observe(time.perf_counter() - start, store=store, operation=operation)
+        if op.bytes:
+            STORAGE_BYTES.observe(op.bytes, store=store, operation=operation)
@@ -0,0 +1,262 @@
+import heapq
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Searchable fields and their relative weight when ranking matches
+SEARCH_FIELDS = {
+    "name": 4.0,
+    "medicalRecordNumber": 3.0,
+    "email": 1.5,
+    "phone": 1.0,
+}
+
+# Every substring up to this length is indexed, for queries shorter than a trigram
+SHORT_GRAM_LENGTH = 2
+
+# Match quality, best first
+EXACT, FIELD_PREFIX, TOKEN_PREFIX, SUBSTRING, FUZZY = 1.0, 0.8, 0.6, 0.4, 0.2
+
+_TOKEN_SPLIT = re.compile(r"[\W_]+")
+
+
+def normalize(value: str) -> str:
+    """Casefold and strip accents, so "José" and "jose" match each other"""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold().strip()
+
+
+def tokenize(value: str) -> List[str]:
+    return [token for token in _TOKEN_SPLIT.split(value) if token]
+
+
+def trigrams(value: str) -> Set[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def short_grams(value: str) -> Set[str]:
+    return {value[i:i + length] for length in range(1, SHORT_GRAM_LENGTH + 1) for i in range(len(value) - length + 1)}
+
+
+def short_prefixes(words: Iterable[str]) -> Set[str]:
+    return {word[:length] for word in words for length in range(1, min(len(word), SHORT_GRAM_LENGTH) + 1)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, giving up early once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class PatientSearchIndex:
+    """In-memory trigram index over patient name, MRN, email and phone.
+
+    Queries of three or more characters intersect the trigram posting lists of
+    each field and verify the substring on the survivors; shorter queries look
+    up an index of every one- and two-character substring. Either way a query
+    matches anywhere in a field, as a plain substring search would. Values and
+    queries are casefolded and stripped of accents. The index is updated
+    incrementally with add/remove.
+
+    Short queries match much of the registry, so when a page is requested only
+    the matches that can make it are scored (see _short_query_shortlist).
+    """
+
+    def __init__(self):
+        self._trigrams: Dict[str, Dict[str, Set[str]]] = {field: defaultdict(set) for field in SEARCH_FIELDS}
+        # Short-query postings by match quality, then field: which values equal,
+        # start with, have a token starting with, or contain each short gram
+        self._short_postings: Dict[float, Dict[str, Dict[str, Set[str]]]] = {
+            quality: {field: defaultdict(set) for field in SEARCH_FIELDS}
+            for quality in (EXACT, FIELD_PREFIX, TOKEN_PREFIX, SUBSTRING)
+        }
+        self._name_tokens: Dict[str, Set[str]] = defaultdict(set)
+        self._tokens_by_initial: Dict[str, Set[str]] = defaultdict(set)
+        self._values: Dict[str, Dict[str, str]] = {}
+        self._order: Dict[str, int] = {}
+        self._next_order = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, record: dict):
+        """Index a record, replacing any previous version while keeping its listing position"""
+        patient_id = record["id"]
+        order = self._order.get(patient_id)
+        if order is not None:
+            self.remove(patient_id)
+        else:
+            order = self._next_order
+            self._next_order += 1
+        values = {}
+        for field in SEARCH_FIELDS:
+            if record.get(field):
+                value = normalize(record[field])
+                values[field] = value
+                for gram in trigrams(value):
+                    self._trigrams[field][gram].add(patient_id)
+                for quality, grams in self._short_grams_by_quality(value):
+                    for gram in grams:
+                        self._short_postings[quality][field][gram].add(patient_id)
+        for token in tokenize(values.get("name", "")):
+            self._name_tokens[token].add(patient_id)
+            self._tokens_by_initial[token[0]].add(token)
+        self._values[patient_id] = values
+        self._order[patient_id] = order
+
+    def remove(self, patient_id: str):
+        values = self._values.pop(patient_id, None)
+        self._order.pop(patient_id, None)
+        if values is None:
+            return
+        for field, value in values.items():
+            postings = self._trigrams[field]
+            for gram in trigrams(value):
+                self._discard(postings, gram, patient_id)
+            for quality, grams in self._short_grams_by_quality(value):
+                for gram in grams:
+                    self._discard(self._short_postings[quality][field], gram, patient_id)
+        for token in tokenize(values.get("name", "")):
+            self._discard(self._name_tokens, token, patient_id)
+            if token not in self._name_tokens:
+                self._discard(self._tokens_by_initial, token[0], token)
+
+    @staticmethod
+    def _short_grams_by_quality(value: str) -> List[Tuple[float, Set[str]]]:
+        return [
+            (EXACT, {value} if len(value) <= SHORT_GRAM_LENGTH else set()),
+            (FIELD_PREFIX, short_prefixes([value])),
+            (TOKEN_PREFIX, short_prefixes(tokenize(value))),
+            (SUBSTRING, short_grams(value)),
+        ]
+
+    @staticmethod
+    def _discard(postings: Dict[str, Set[str]], key: str, member: str):
+        members = postings.get(key)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del postings[key]
+
+    def clear(self):
+        self.__init__()
+
+    def search(self, query: str, limit: int = None, offset: int = 0, fuzzy: bool = False) -> Tuple[List[str], int]:
+        """Return (ranked patient ids for the requested page, total number of matches)"""
+        query = normalize(query)
+        if not query:
+            scores = self._order
+            total = len(scores)
+            rank_key = self._order.__getitem__
+        else:
+            if len(query) < 3 and limit is not None:
+                scores, total = self._short_query_shortlist(query, offset + limit)
+            else:
+                scores = self._score_candidates(query, self._candidates(query))
+                if fuzzy:
+                    for patient_id, score in self._fuzzy_name_matches(query).items():
+                        scores.setdefault(patient_id, score)
+                total = len(scores)
+            rank_key = lambda patient_id: (-scores[patient_id], self._order[patient_id])
+        if limit is None:
+            ranked = sorted(scores, key=rank_key)
+            return ranked[offset:], total
+        # Only the requested page needs ordering, not every match
+        ranked = heapq.nsmallest(offset + limit, scores, key=rank_key)
+        return ranked[offset:], total
+
+    def _candidates(self, query: str) -> Iterable[str]:
+        if len(query) < 3:
+            return set().union(*(postings.get(query, ()) for postings in self._short_postings[SUBSTRING].values()))
+        grams = trigrams(query)
+        candidates: Set[str] = set()
+        for postings in self._trigrams.values():
+            lists = [postings.get(gram) for gram in grams]
+            if not all(lists):
+                continue
+            lists.sort(key=len)
+            candidates |= lists[0].intersection(*lists[1:])
+        return candidates
+
+    def _short_query_shortlist(self, query: str, count: int) -> Tuple[Dict[str, float], int]:
+        """Score the matches of a one- or two-character query that can rank in its first count results.
+
+        Returns (scores, total number of matches). A match scores its best
+        quality times field weight, so the postings are visited from the highest
+        such score down; each match is placed at the first it appears in, and
+        within one only the count earliest-listed matches can make the page.
+        Nothing is scored string by string.
+        """
+        total = len(set().union(*(postings.get(query, ()) for postings in self._short_postings[SUBSTRING].values())))
+        tiers = sorted(
+            ((quality * weight, quality, field) for quality in self._short_postings for field, weight in SEARCH_FIELDS.items()),
+            reverse=True,
+        )
+        scores: Dict[str, float] = {}
+        placed: Set[str] = set()
+        for score, quality, field in tiers:
+            remaining = self._short_postings[quality][field].get(query, set()) - placed
+            if not remaining:
+                continue
+            placed |= remaining
+            for patient_id in heapq.nsmallest(count, remaining, key=self._order.__getitem__):
+                scores[patient_id] = score
+        return scores, total
+
+    def _score_candidates(self, query: str, candidates: Iterable[str]) -> Dict[str, float]:
+        scores = {}
+        values = self._values
+        for patient_id in candidates:
+            best = 0.0
+            for field, value in values[patient_id].items():
+                if query not in value:
+                    continue
+                if value == query:
+                    quality = EXACT
+                elif value.startswith(query):
+                    quality = FIELD_PREFIX
+                elif any(token.startswith(query) for token in tokenize(value)):
+                    quality = TOKEN_PREFIX
+                else:
+                    quality = SUBSTRING
+                best = max(best, quality * SEARCH_FIELDS[field])
+            if best:
+                scores[patient_id] = best
+        return scores
+
+    def _fuzzy_name_matches(self, query: str) -> Dict[str, float]:
+        """Typo-tolerant matches of the query against distinct name tokens.
+
+        Only tokens sharing the query's first letter are compared, which keeps
+        the candidate set small; typos in the first letter are not tolerated.
+        """
+        if len(query) < 4:
+            return {}
+        max_edits = 1 if len(query) <= 6 else 2
+        matches = {}
+        for token in self._tokens_by_initial.get(query[0], ()):
+            # Compare against a same-length prefix so partially typed names still match
+            distance = min(
+                edit_distance(query, token, max_edits),
+                edit_distance(query, token[:len(query)], max_edits),
+            )
+            if distance > max_edits:
+                continue
+            score = FUZZY * SEARCH_FIELDS["name"] * (1 - distance / (len(query) + 1))
+            for patient_id in self._name_tokens[token]:
+                matches[patient_id] = max(matches.get(patient_id, 0.0), score)
+        return matches
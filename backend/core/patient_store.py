@@ -0,0 +1,367 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.metrics import storage_operation
+from core.patient_search import PatientSearchIndex
+
+# Change-log rows kept for workers that have fallen behind; older gaps force a full reload
+CHANGE_LOG_RETENTION = 10000
+
+# Change-log marker written by replace_all(): every worker reloads all records
+RELOAD_MARKER = "*"
+
+
+class DuplicateMrnError(Exception):
+    """Another patient already has this Medical Record Number"""
+
+
+def mrn_key(mrn: str) -> str:
+    """Normalize a Medical Record Number for case-insensitive lookups"""
+    return mrn.casefold()
+
+
+class PatientRepository:
+    """Patient records in SQLite with in-memory primary-key, MRN and search indexes.
+
+    Reads are served from the indexes; every write touches a single row and
+    updates the indexes in place. Ids come from a persistent counter so they
+    are never reused, even after the highest id has been deleted. Records
+    returned by the repository are shared with the index and must be treated
+    as read-only.
+
+    Several worker processes can share one database. Triggers append every
+    changed patient id to patient_changes; each worker checks PRAGMA
+    data_version before serving from its indexes and re-reads only the rows
+    other workers changed. Writes run in BEGIN IMMEDIATE transactions after
+    catching up, so a read-modify-write never works from a stale record.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS patients (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            mrn_key TEXT NOT NULL UNIQUE,
+            record TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS patient_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id TEXT NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS patients_inserted AFTER INSERT ON patients
+        BEGIN
+            INSERT INTO patient_changes (patient_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS patients_updated AFTER UPDATE ON patients
+        BEGIN
+            INSERT INTO patient_changes (patient_id) VALUES (NEW.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS patients_deleted AFTER DELETE ON patients
+        BEGIN
+            INSERT INTO patient_changes (patient_id) VALUES (OLD.id);
+        END;
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._by_id: Dict[str, dict] = {}
+        self._by_mrn: Dict[str, str] = {}
+        self.search_index = PatientSearchIndex()
+        self._last_change = 0
+        self._data_version = None
+        self._load_indexes()
+
+    @contextlib.contextmanager
+    def _read(self):
+        """Read snapshot; joins the current transaction when there is one"""
+        if self._conn.in_transaction:
+            yield
+            return
+        self._conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self._conn.execute("COMMIT")
+
+    def _load_indexes(self):
+        with storage_operation("patients", "load") as op, self._lock, self._read():
+            self._by_id.clear()
+            self._by_mrn.clear()
+            self.search_index.clear()
+            self._last_change = self._latest_change()
+            for (record,) in self._conn.execute("SELECT record FROM patients ORDER BY seq"):
+                op.bytes += len(record)
+                self._index(json.loads(record))
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _latest_change(self) -> int:
+        row = self._conn.execute("SELECT MAX(seq) FROM patient_changes").fetchone()
+        return row[0] or 0
+
+    def _refresh(self):
+        """Catch up with writes committed by other processes since the last check"""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._apply_changes()
+
+    def _apply_changes(self):
+        with self._read():
+            changes = self._conn.execute(
+                "SELECT seq, patient_id FROM patient_changes WHERE seq > ? ORDER BY seq",
+                (self._last_change,),
+            ).fetchall()
+            if not changes:
+                return
+            # The log was pruned past our position, or the registry was replaced wholesale
+            if changes[0][0] > self._last_change + 1 or any(patient_id == RELOAD_MARKER for _, patient_id in changes):
+                self._load_indexes()
+                return
+            with storage_operation("patients", "load") as op:
+                for patient_id in dict.fromkeys(patient_id for _, patient_id in changes):
+                    row = self._conn.execute("SELECT record FROM patients WHERE id = ?", (patient_id,)).fetchone()
+                    current = self._by_id.get(patient_id)
+                    if current is not None:
+                        self._unindex_mrn(current)
+                    if row is None:
+                        if current is not None:
+                            self._unindex(current)
+                        continue
+                    op.bytes += len(row[0])
+                    self._index(json.loads(row[0]))
+            self._last_change = changes[-1][0]
+
+    @contextlib.contextmanager
+    def _write(self):
+        """Write transaction that first applies other workers' changes, so checks and updates see the latest rows"""
+        with self._lock:
+            self._begin()
+            try:
+                self._apply_changes()
+                yield
+                self._last_change = self._latest_change()
+                self._conn.execute(
+                    "DELETE FROM patient_changes WHERE seq <= ?",
+                    (self._last_change - CHANGE_LOG_RETENTION,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _unindex_mrn(self, record: dict):
+        key = mrn_key(record["medicalRecordNumber"])
+        if self._by_mrn.get(key) == record["id"]:
+            del self._by_mrn[key]
+
+    def _index(self, record: dict):
+        self._by_id[record["id"]] = record
+        self._by_mrn[mrn_key(record["medicalRecordNumber"])] = record["id"]
+        self.search_index.add(record)
+
+    def _unindex(self, record: dict):
+        self._by_id.pop(record["id"], None)
+        self._unindex_mrn(record)
+        self.search_index.remove(record["id"])
+
+    def _begin(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def _next_id_from_existing(self) -> int:
+        numeric_ids = [int(patient_id) for patient_id in self._by_id if patient_id.isdigit()]
+        return max(numeric_ids, default=0) + 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._by_id)
+
+    def generation(self) -> int:
+        """Position in the change log; it moves whenever any worker writes a patient"""
+        with self._lock:
+            self._refresh()
+            return self._last_change
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._by_id.values())
+
+    def get(self, patient_id: str) -> Optional[dict]:
+        with self._lock:
+            self._refresh()
+            return self._by_id.get(patient_id)
+
+    def get_by_mrn(self, mrn: str) -> Optional[dict]:
+        with self._lock:
+            self._refresh()
+            patient_id = self._by_mrn.get(mrn_key(mrn))
+            return self._by_id.get(patient_id) if patient_id is not None else None
+
+    def mrn_in_use(self, mrn: str, exclude_id: Optional[str] = None) -> bool:
+        """Check whether an MRN belongs to a patient other than exclude_id"""
+        with self._lock:
+            self._refresh()
+            patient_id = self._by_mrn.get(mrn_key(mrn))
+            return patient_id is not None and patient_id != exclude_id
+
+    def search(self, query: str, limit: Optional[int] = None, offset: int = 0, fuzzy: bool = False) -> Tuple[List[dict], int]:
+        """Ranked search over name, MRN, email and phone. Returns (page of records, total matches)."""
+        with self._lock:
+            self._refresh()
+            patient_ids, total = self.search_index.search(query, limit=limit, offset=offset, fuzzy=fuzzy)
+            return [self._by_id[patient_id] for patient_id in patient_ids], total
+
+    def allocate_id(self) -> str:
+        """Reserve the next patient id from the persistent counter"""
+        with self._write():
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+            next_id = int(row[0]) if row else self._next_id_from_existing()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)",
+                (str(next_id + 1),),
+            )
+            return str(next_id)
+
+    def _execute_write(self, sql: str, parameters: tuple):
+        try:
+            self._conn.execute(sql, parameters)
+        except sqlite3.IntegrityError as e:
+            if "mrn_key" in str(e):
+                raise DuplicateMrnError("Medical Record Number already exists") from e
+            raise
+
+    def insert(self, record: dict) -> dict:
+        with storage_operation("patients", "save") as op, self._write():
+            body = json.dumps(record)
+            op.bytes = len(body)
+            self._execute_write(
+                "INSERT INTO patients (id, mrn_key, record) VALUES (?, ?, ?)",
+                (record["id"], mrn_key(record["medicalRecordNumber"]), body),
+            )
+            self._index(record)
+            return record
+
+    def update(self, patient_id: str, changes: dict) -> Optional[dict]:
+        with storage_operation("patients", "save") as op, self._write():
+            current = self._by_id.get(patient_id)
+            if current is None:
+                return None
+            updated = {**current, **changes}
+            body = json.dumps(updated)
+            op.bytes = len(body)
+            self._execute_write(
+                "UPDATE patients SET mrn_key = ?, record = ? WHERE id = ?",
+                (mrn_key(updated["medicalRecordNumber"]), body, patient_id),
+            )
+            # Reassign in place so the patient keeps its position in listings
+            self._unindex_mrn(current)
+            self._index(updated)
+            return updated
+
+    def delete(self, patient_id: str) -> Optional[dict]:
+        with storage_operation("patients", "delete"), self._write():
+            current = self._by_id.get(patient_id)
+            if current is None:
+                return None
+            self._conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+            self._unindex(current)
+            return current
+
+    def replace_all(self, records: List[dict]):
+        """Replace the whole registry (bulk import / legacy save)"""
+        with storage_operation("patients", "save") as op, self._write():
+            rows = [
+                (record["id"], mrn_key(record["medicalRecordNumber"]), json.dumps(record))
+                for record in records
+            ]
+            op.bytes = sum(len(row[2]) for row in rows)
+            self._conn.execute("DELETE FROM patients")
+            self._conn.executemany(
+                "INSERT INTO patients (id, mrn_key, record) VALUES (?, ?, ?)",
+                rows,
+            )
+            # One reload marker replaces the per-row change entries for other workers
+            cursor = self._conn.execute("INSERT INTO patient_changes (patient_id) VALUES (?)", (RELOAD_MARKER,))
+            self._conn.execute("DELETE FROM patient_changes WHERE seq < ?", (cursor.lastrowid,))
+            self._load_indexes()
+
+    def import_json_file(self, file_path: str) -> int:
+        """Import a legacy patients.json once. Returns the number of patients imported."""
+        marker = f"imported:{os.path.abspath(file_path)}"
+        try:
+            # The marker is checked inside the write transaction so concurrently starting workers import once
+            with self._write():
+                if self._conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                    return 0
+                with open(file_path, 'r') as f:
+                    records = json.load(f)
+                imported = 0
+                for record in records:
+                    if record["id"] in self._by_id or mrn_key(record["medicalRecordNumber"]) in self._by_mrn:
+                        continue
+                    self._conn.execute(
+                        "INSERT INTO patients (id, mrn_key, record) VALUES (?, ?, ?)",
+                        (record["id"], mrn_key(record["medicalRecordNumber"]), json.dumps(record)),
+                    )
+                    self._index(record)
+                    imported += 1
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+                next_id = max(int(row[0]) if row else 0, self._next_id_from_existing())
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)",
+                    (str(next_id),),
+                )
+                self._conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+                return imported
+        except Exception:
+            self._load_indexes()
+            raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_repository: Optional[PatientRepository] = None
+_repository_lock = threading.Lock()
+
+
+def get_patient_repository() -> PatientRepository:
+    """Return the process-wide patient repository, opening it on first use"""
+    global _repository
+    with _repository_lock:
+        if _repository is None:
+            _repository = PatientRepository(settings.PATIENT_DB_FILE)
+            # Legacy JSON registry, imported into the repository on first start
+            if os.path.exists(settings.PATIENTS_FILE):
+                imported = _repository.import_json_file(settings.PATIENTS_FILE)
+                if imported:
+                    print(f"Imported {imported} patients from {settings.PATIENTS_FILE}")
+        return _repository
+
+
+def close_patient_repository():
+    """Close the repository (used at application shutdown)"""
+    global _repository
+    with _repository_lock:
+        if _repository is not None:
+            _repository.close()
+            _repository = None
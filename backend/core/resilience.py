@@ -0,0 +1,263 @@
+import asyncio
+import collections
+import random
+import sys
+import threading
+import time
+from typing import AsyncContextManager, Awaitable, Callable, Dict, Optional, TypeVar
+
+from core.config import settings
+from core.metrics import CIRCUIT_REJECTED, CIRCUIT_STATE, UPSTREAM_HEDGES, UPSTREAM_RETRIES, upstream_stage
+from core.scheduler import UpstreamBusyError
+
+T = TypeVar("T")
+
+# Statuses that mean the upstream is overloaded or failing rather than the request being wrong
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Of those, the ones after which a non-idempotent request (message or run create) was not applied
+NOT_APPLIED_STATUS_CODES = {429, 503}
+
+
+class CircuitOpenError(UpstreamBusyError):
+    """The upstream's circuit breaker is open; calls fail fast until it is probed again"""
+
+
+class UpstreamUnavailableError(UpstreamBusyError):
+    """An upstream call still failed with a transient error after every retry"""
+
+
+def is_transient(error: BaseException, idempotent: bool = True) -> bool:
+    """Whether error is worth retrying (and counts against the circuit breaker).
+
+    Timeouts and 5xx responses may hide a request that was applied upstream,
+    so non-idempotent calls are only retried on connection failures, 429 and 503.
+    """
+    # The SDK is imported lazily; if it is not loaded yet, error cannot be one of its exceptions
+    openai = sys.modules.get("openai")
+    if isinstance(error, asyncio.TimeoutError) or (openai is not None and isinstance(error, openai.APITimeoutError)):
+        return idempotent
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code in TRANSIENT_STATUS_CODES:
+        return idempotent or status_code in NOT_APPLIED_STATUS_CODES
+    return False
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """The Retry-After delay an upstream asked for, if any"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given (1-based) retry"""
+    ceiling = min(settings.UPSTREAM_RETRY_MAX_DELAY, settings.UPSTREAM_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream.
+
+    After CIRCUIT_FAILURE_THRESHOLD transient failures in a row the circuit
+    opens and calls fail fast for CIRCUIT_RESET_SECONDS. Then one probe call is
+    let through (half-open): success closes the circuit, failure opens it again.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, upstream: str, failure_threshold: int, reset_seconds: float):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(self.CLOSED, upstream=upstream)
+
+    def _set_state(self, state: int):
+        self.state = state
+        CIRCUIT_STATE.set(state, upstream=self.upstream)
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        CIRCUIT_REJECTED.inc(upstream=self.upstream)
+        raise CircuitOpenError(
+            f"Upstream {self.upstream} is failing; requests are paused for a moment",
+            max(remaining, 1.0)
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                print(f"Circuit for {self.upstream} closed")
+                self._set_state(self.CLOSED)
+
+    def abandon(self):
+        """The call was cancelled before it told us anything; let another call probe"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                print(f"Circuit for {self.upstream} opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(upstream: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = CircuitBreaker(upstream, settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_SECONDS)
+            _breakers[upstream] = breaker
+        return breaker
+
+
+async def call_upstream(
+    upstream: str,
+    stage: str,
+    call: Callable[[], Awaitable[T]],
+    idempotent: bool = True,
+    deadline: Optional[float] = None,
+) -> T:
+    """Make one logical upstream call, retrying transient failures with jittered backoff.
+
+    call() is invoked once per attempt, each timed as the given stage. Retries
+    stop after UPSTREAM_RETRY_ATTEMPTS attempts or when the next attempt would
+    start after deadline (a time.monotonic() value); an attempt cut off by the
+    deadline raises asyncio.TimeoutError. Failures feed the upstream's circuit
+    breaker, which fails fast with CircuitOpenError while open.
+    """
+    breaker = get_circuit_breaker(upstream)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        attempt += 1
+        try:
+            with upstream_stage(stage):
+                if deadline is None:
+                    result = await call()
+                else:
+                    result = await asyncio.wait_for(call(), max(deadline - time.monotonic(), 0.001))
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            if not is_transient(e, idempotent):
+                # The upstream answered, so it is up; the request itself was rejected
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if deadline is not None and isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline:
+                raise
+            delay = retry_after(e) or backoff_delay(attempt)
+            out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+            if attempt >= settings.UPSTREAM_RETRY_ATTEMPTS or out_of_time:
+                raise UpstreamUnavailableError(f"Upstream {upstream} {stage} failed: {e}", delay) from e
+            print(f"Retrying {stage} on {upstream} in {delay:.2f}s after: {e}")
+            UPSTREAM_RETRIES.inc(upstream=upstream, stage=stage)
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for picking a hedging delay"""
+
+    def __init__(self, size: int = 200):
+        self._samples = collections.deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float, minimum_samples: int = 20) -> Optional[float]:
+        if len(self._samples) < minimum_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def hedged(
+    stage: str,
+    call: Callable[[], Awaitable[T]],
+    latencies: LatencyTracker,
+    admit: Optional[Callable[[], AsyncContextManager]] = None,
+) -> T:
+    """Run call(), starting a duplicate if it is slower than the recent p95; the first success wins.
+
+    Only for idempotent calls. The slower copy is cancelled. Once a duplicate
+    is running, a failed or cancelled copy waits for the other. admit, when
+    given, wraps the duplicate (e.g. a scheduler slot and its tokens); if it
+    raises UpstreamBusyError the duplicate is simply not made.
+    """
+    delay = max(latencies.percentile(settings.HEDGE_PERCENTILE) or 0.0, settings.HEDGE_MIN_DELAY)
+
+    async def timed_call() -> T:
+        start = time.perf_counter()
+        result = await call()
+        latencies.observe(time.perf_counter() - start)
+        return result
+
+    async def hedge_call() -> T:
+        if admit is None:
+            return await timed_call()
+        async with admit():
+            return await timed_call()
+
+    primary = asyncio.ensure_future(timed_call())
+    pending = {primary}
+    hedge_started = False
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            hedge_started = True
+            pending.add(asyncio.ensure_future(hedge_call()))
+        error = None
+        while pending or done:
+            for task in done:
+                if task.cancelled():
+                    # Cancelled from inside the call (we only cancel copies on the way out)
+                    error = error or asyncio.CancelledError()
+                    continue
+                if task.exception() is None:
+                    if hedge_started:
+                        UPSTREAM_HEDGES.inc(stage=stage, winner="primary" if task is primary else "hedge")
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if hedge_started:
+            UPSTREAM_HEDGES.inc(stage=stage, winner="none")
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
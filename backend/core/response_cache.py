@@ -0,0 +1,196 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+from core.config import settings
+from core.metrics import RESPONSE_CACHE_REQUESTS
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is offered instead
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def encode_json(payload: Any) -> bytes:
+    """Compact UTF-8 JSON, as FastAPI's JSONResponse would render it"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an entity tag"""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """The best content coding the client accepts: brotli when installed, then gzip"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, parameters = part.partition(";")
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in (("br",) if brotli is not None else ()) + ("gzip",):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class _Entry:
+    __slots__ = ("generation", "body", "etag", "headers", "encoded", "size")
+
+    def __init__(self, generation: Hashable, body: bytes, headers: Dict[str, str]):
+        self.generation = generation
+        self.body = body
+        self.etag = f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.headers = headers
+        self.encoded: Dict[str, bytes] = {}
+        self.size = len(body)
+
+
+class CachedResponse:
+    """Status, body and headers ready to hand to a Response"""
+
+    __slots__ = ("status_code", "body", "headers", "media_type")
+
+    def __init__(self, status_code: int, body: bytes, headers: Dict[str, str], media_type: Optional[str]):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers
+        self.media_type = media_type
+
+
+class ResponseCache:
+    """Encoded JSON responses for read routes, reused until their store changes.
+
+    Each entry is keyed by route and parameters and tagged with the store
+    generation it was built from. While the store's generation is unchanged,
+    requests are answered with the stored bytes: 304 when If-None-Match
+    matches the ETag, otherwise the body, compressed once per coding when it
+    is at least min_compress_bytes. The ETag is a hash of the body, so every
+    worker process gives the same tag for the same data. Entries are evicted
+    least recently used first once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes: int, min_compress_bytes: int):
+        self.max_bytes = max_bytes
+        self.min_compress_bytes = min_compress_bytes
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _remember(self, key: Hashable, entry: _Entry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def _get(self, key: Hashable, generation: Hashable) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _encoded_body(self, key: Hashable, entry: _Entry, encoding: str) -> bytes:
+        body = entry.encoded.get(encoding)
+        if body is not None:
+            return body
+        body = compress(entry.body, encoding)
+        with self._lock:
+            if encoding not in entry.encoded:
+                entry.encoded[encoding] = body
+                entry.size += len(body)
+                if self._entries.get(key) is entry:
+                    self._bytes += len(body)
+                    self._evict()
+        return body
+
+    def respond(
+        self,
+        key: Tuple[Hashable, ...],
+        generation: Hashable,
+        build: Callable[[], Tuple[Any, Dict[str, str]]],
+        request_headers: Mapping[str, str],
+    ) -> CachedResponse:
+        """Answer a read from the cache, calling build() for (payload, extra headers) on a miss.
+
+        Read generation before building: if the store changes while build()
+        runs, the entry is tagged with the older generation and rebuilt on
+        the next request, never served past a change. Exceptions from
+        build() propagate and nothing is cached.
+        """
+        entry = self._get(key, generation)
+        result = "hit"
+        if entry is None:
+            result = "miss"
+            payload, headers = build()
+            entry = _Entry(generation, encode_json(payload), headers)
+            with self._lock:
+                self._remember(key, entry)
+
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", **entry.headers}
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, entry.etag):
+            RESPONSE_CACHE_REQUESTS.inc(cache=str(key[0]), result="not_modified" if result == "hit" else result)
+            return CachedResponse(304, b"", headers, None)
+        RESPONSE_CACHE_REQUESTS.inc(cache=str(key[0]), result=result)
+
+        body = entry.body
+        encoding = choose_encoding(request_headers.get("accept-encoding") or "")
+        if encoding is not None and self.min_compress_bytes and len(body) >= self.min_compress_bytes:
+            body = self._encoded_body(key, entry, encoding)
+            headers["Content-Encoding"] = encoding
+        return CachedResponse(200, body, headers, JSON_MEDIA_TYPE)
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+                min_compress_bytes=settings.RESPONSE_COMPRESSION_MIN_BYTES,
+            )
+        return _response_cache
@@ -0,0 +1,423 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from core.config import settings
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "variant", "phash")
+
+    def __init__(self, value: str, expires_at: float, variant: str, phash: Optional[int]):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = len(value.encode("utf-8"))
+        self.variant = variant
+        self.phash = phash
+
+
+class AnalysisCache:
+    """Two-tier cache for deterministic model results.
+
+    The memory tier is an LRU bounded by the total size of cached values; the
+    disk tier (one JSON file per key) survives restarts and refills the memory
+    tier on access. Entries expire after ttl seconds in both tiers.
+
+    Results do not live longer for being read, so the disk tier is kept in
+    write order: expired files are swept from the oldest end on every write,
+    and the oldest files are evicted once the tier exceeds disk_max_bytes.
+    The disk index is built from file times on first use, so with several
+    worker processes each keeps the bound approximately. The *_async methods
+    do their disk I/O in a thread.
+
+    Entries can carry a perceptual hash so near-duplicate inputs (re-exported
+    or re-compressed copies of the same film) are matched within
+    max_distance bits, but only among entries of the same variant (model and
+    prompt version) that are currently in memory.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        # key -> (size, written_at), oldest first
+        self._disk_index: "Optional[OrderedDict[str, Tuple[int, float]]]" = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_digest: str, variant: str) -> str:
+        return hashlib.sha256(f"{variant}:{content_digest}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, entry: _Entry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                return entry.value
+            self._forget(key)
+            return None
+
+    def _load(self, key: str, now: float) -> Optional[str]:
+        """Read an entry from disk into the memory tier"""
+        entry = self._read_disk(key, now)
+        if entry is None:
+            return None
+        with self._lock:
+            self._remember(key, entry)
+        return entry.value
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is not None:
+            return value
+        return self._load(key, now)
+
+    async def get_async(self, key: str) -> Optional[str]:
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is not None or not self.disk_dir:
+            return value
+        return await asyncio.to_thread(self._load, key, now)
+
+    def find_similar(self, phash: int, variant: str, max_distance: int) -> Optional[str]:
+        """Return the closest cached value whose perceptual hash is within max_distance bits"""
+        now = time.time()
+        best_key, best_distance = None, max_distance + 1
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.phash is None or entry.variant != variant or entry.expires_at <= now:
+                    continue
+                distance = hamming_distance(phash, entry.phash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key].value
+
+    def _put_memory(self, key: str, value: str, variant: str, phash: Optional[int]) -> _Entry:
+        entry = _Entry(value, time.time() + self.ttl, variant, phash)
+        with self._lock:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, value: str, variant: str = "", phash: Optional[int] = None):
+        self._write_disk(key, self._put_memory(key, value, variant, phash))
+
+    async def put_async(self, key: str, value: str, variant: str = "", phash: Optional[int] = None):
+        entry = self._put_memory(key, value, variant, phash)
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, entry)
+
+    def _read_disk(self, key: str, now: float) -> Optional[_Entry]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cache entry {key}: {e}")
+            return None
+        if data["expires_at"] <= now:
+            self._remove_disk([key])
+            return None
+        return _Entry(data["value"], data["expires_at"], data.get("variant", ""), data.get("phash"))
+
+    def _load_disk_index(self):
+        """Index the disk tier oldest first; caller holds the lock"""
+        if self._disk_index is not None:
+            return
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        files.sort()
+        self._disk_index = OrderedDict((key, (size, written_at)) for written_at, key, size in files)
+        self._disk_bytes = sum(size for _, _, size in files)
+
+    def _remove_disk(self, keys: List[str]):
+        with self._lock:
+            if self._disk_index is not None:
+                for key in keys:
+                    self._disk_bytes -= self._disk_index.pop(key, (0, 0.0))[0]
+        for key in keys:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _write_disk(self, key: str, entry: _Entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = json.dumps({
+                "value": entry.value,
+                "expires_at": entry.expires_at,
+                "variant": entry.variant,
+                "phash": entry.phash,
+            }).encode("utf-8")
+            size = len(data)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry {key}: {e}")
+            return
+        now = time.time()
+        expired_before = now - self.ttl
+        evicted = []
+        with self._lock:
+            self._load_disk_index()
+            self._disk_bytes -= self._disk_index.pop(key, (0, 0.0))[0]
+            self._disk_index[key] = (size, now)
+            self._disk_bytes += size
+            while len(self._disk_index) > 1:
+                old_key, (old_size, written_at) = next(iter(self._disk_index.items()))
+                if written_at > expired_before and not (self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes):
+                    break
+                del self._disk_index[old_key]
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+
+_analysis_cache: Optional[AnalysisCache] = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> AnalysisCache:
+    global _analysis_cache
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            _analysis_cache = AnalysisCache(
+                max_bytes=settings.ANALYSIS_CACHE_MAX_BYTES,
+                ttl=settings.ANALYSIS_CACHE_TTL_SECONDS,
+                disk_dir=settings.ANALYSIS_CACHE_DIR or None,
+                disk_max_bytes=settings.ANALYSIS_CACHE_DISK_MAX_BYTES,
+            )
+        return _analysis_cache
+
+
+class _AudioEntry:
+    __slots__ = ("audio", "size")
+
+    def __init__(self, audio: bytes):
+        self.audio = audio
+        self.size = len(audio)
+
+
+class AudioCache:
+    """Two-tier cache for synthesized speech, keyed by (text, voice, model).
+
+    Audio never goes stale, so both tiers are bounded by size alone: the
+    memory tier is an LRU over clip bytes, and the disk tier (one file per
+    key) evicts its least recently used files once they exceed
+    disk_max_bytes. The disk index is built from file times on first use,
+    so with several worker processes each keeps the bound approximately.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, _AudioEntry]" = OrderedDict()
+        self._bytes = 0
+        self._disk_index: "Optional[OrderedDict[str, int]]" = None
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text: str, voice: str, variant: str) -> str:
+        return hashlib.sha256(f"{variant}:{voice}:{text}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.audio")
+
+    def _remember(self, key: str, entry: _AudioEntry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def _get_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.audio
+
+    def _load(self, key: str) -> Optional[bytes]:
+        """Read a clip from disk into the memory tier"""
+        audio = self._read_disk(key)
+        if audio is None:
+            return None
+        with self._lock:
+            self._remember(key, _AudioEntry(audio))
+        return audio
+
+    def get(self, key: str) -> Optional[bytes]:
+        audio = self._get_memory(key)
+        if audio is not None:
+            return audio
+        return self._load(key)
+
+    async def get_async(self, key: str) -> Optional[bytes]:
+        audio = self._get_memory(key)
+        if audio is not None or not self.disk_dir:
+            return audio
+        return await asyncio.to_thread(self._load, key)
+
+    def put(self, key: str, audio: bytes):
+        with self._lock:
+            self._remember(key, _AudioEntry(audio))
+        self._write_disk(key, audio)
+
+    async def put_async(self, key: str, audio: bytes):
+        with self._lock:
+            self._remember(key, _AudioEntry(audio))
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, audio)
+
+    def _load_disk_index(self):
+        """Index the disk tier oldest first; caller holds the lock"""
+        if self._disk_index is not None:
+            return
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".audio"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, name[:-len(".audio")], stat.st_size))
+        files.sort()
+        self._disk_index = OrderedDict((key, size) for _, key, size in files)
+        self._disk_bytes = sum(size for _, _, size in files)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading audio cache entry {key}: {e}")
+            return None
+        with self._lock:
+            self._load_disk_index()
+            if key in self._disk_index:
+                self._disk_index.move_to_end(key)
+        return audio
+
+    def _write_disk(self, key: str, audio: bytes):
+        if not self.disk_dir or (self.disk_max_bytes and len(audio) > self.disk_max_bytes):
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing audio cache entry {key}: {e}")
+            return
+        if not self.disk_max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            self._load_disk_index()
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(audio)
+            self._disk_bytes += len(audio)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_index) > 1:
+                old_key, size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+
+_audio_cache: Optional[AudioCache] = None
+_audio_cache_lock = threading.Lock()
+
+
+def get_audio_cache() -> AudioCache:
+    global _audio_cache
+    with _audio_cache_lock:
+        if _audio_cache is None:
+            _audio_cache = AudioCache(
+                max_bytes=settings.SPEECH_CACHE_MAX_BYTES,
+                disk_dir=settings.SPEECH_CACHE_DIR or None,
+                disk_max_bytes=settings.SPEECH_CACHE_DISK_MAX_BYTES,
+            )
+        return _audio_cache
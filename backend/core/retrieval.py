@@ -0,0 +1,112 @@
+import math
+import re
+from collections import Counter
+from typing import List, Tuple
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+# Common words that carry no ranking signal
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it of on or that the this to was were what which with
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def chunk_text(text: str, max_tokens: int = 300, overlap_tokens: int = 40) -> List[str]:
+    """Split text into passages of about max_tokens, breaking on line boundaries.
+
+    Consecutive passages share roughly overlap_tokens of trailing lines so a
+    sentence cut at a boundary still appears whole in one passage. Lines longer
+    than a passage are split on whitespace.
+    """
+    max_chars = max_tokens * 4
+    overlap_chars = overlap_tokens * 4
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        while len(line) > max_chars:
+            cut = line.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            lines.append(line[:cut])
+            line = line[cut:].strip()
+        if line:
+            lines.append(line)
+
+    chunks = []
+    current: List[str] = []
+    current_chars = 0
+    for line in lines:
+        if current and current_chars + len(line) > max_chars:
+            chunks.append("\n".join(current))
+            # Carry trailing lines over as overlap
+            carried: List[str] = []
+            carried_chars = 0
+            for previous in reversed(current):
+                if carried_chars + len(previous) > overlap_chars:
+                    break
+                carried.insert(0, previous)
+                carried_chars += len(previous) + 1
+            current, current_chars = carried, carried_chars
+        current.append(line)
+        current_chars += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 ranking over a fixed list of passages"""
+
+    def __init__(self, passages: List[str], k1: float = 1.5, b: float = 0.75):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(tokenize(passage)) for passage in passages]
+        self._lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = (sum(self._lengths) / len(passages)) if passages else 0.0
+        document_freqs = Counter()
+        for freqs in self._term_freqs:
+            document_freqs.update(freqs.keys())
+        count = len(passages)
+        self._idf = {
+            term: math.log(1 + (count - freq + 0.5) / (freq + 0.5))
+            for term, freq in document_freqs.items()
+        }
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Return (passage index, score) pairs for the best matches, best first"""
+        terms = [term for term in set(tokenize(query)) if term in self._idf]
+        if not terms:
+            return []
+        scores = []
+        for index, freqs in enumerate(self._term_freqs):
+            score = 0.0
+            length_norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / (self._avg_length or 1))
+            for term in terms:
+                freq = freqs.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + length_norm)
+            if score > 0:
+                scores.append((index, score))
+        scores.sort(key=lambda item: -item[1])
+        return scores[:top_k]
+
+    def select(self, query: str, token_budget: int, top_k: int = 10) -> List[int]:
+        """Indexes of the best passages that fit in token_budget, in document order"""
+        selected = []
+        used = 0
+        for index, _ in self.search(query, top_k):
+            cost = estimate_tokens(self.passages[index])
+            if used + cost > token_budget:
+                continue
+            selected.append(index)
+            used += cost
+        return sorted(selected)
@@ -0,0 +1,301 @@
+import asyncio
+import contextlib
+import itertools
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+from core.config import settings
+from core.metrics import SCHEDULER_ACTIVE, SCHEDULER_QUEUE_DEPTH, SCHEDULER_REJECTED, SCHEDULER_WAIT
+
+# Lower numbers are admitted first; queued background jobs run below every interactive lane
+LANE_PRIORITIES = {"chat": 0, "document": 1, "imaging": 1}
+INTERACTIVE_PRIORITY = 0
+BACKGROUND_PRIORITY = 2
+# Weight of the latest call in the running average of how long a slot is held
+HOLD_TIME_WEIGHT = 0.2
+
+
+class UpstreamBusyError(Exception):
+    """The upstream cannot take the request right now; retry after retry_after seconds"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Refills continuously at tokens_per_minute, holding at most one minute of tokens"""
+
+    def __init__(self, tokens_per_minute: float):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def cost(self, tokens: float) -> float:
+        # Requests larger than the bucket are admitted once it is full rather than never
+        return min(tokens, self.capacity)
+
+    def wait_time(self, tokens: float) -> float:
+        """Seconds until tokens are available"""
+        self._refill()
+        missing = self.cost(tokens) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, tokens: float):
+        self._refill()
+        self.tokens -= self.cost(tokens)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "lane", "upstream", "tokens", "future")
+
+    def __init__(self, priority: int, seq: int, lane: str, upstream: str, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.lane = lane
+        self.upstream = upstream
+        self.tokens = tokens
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class UpstreamScheduler:
+    """Admission control for upstream model calls, shared by every router in a process.
+
+    Every lane (chat, document, imaging) draws on one shared pool of
+    total_concurrency slots, of which interactive_reserve are kept for
+    interactive chat; each lane also has its own cap, and each upstream
+    (azure, openai) a tokens-per-minute bucket sized to its quota. Waiters
+    are admitted strictly by priority, then arrival, so when the pool is
+    full a freed slot goes to chat before document, imaging or background
+    work. A waiter held back by its upstream's bucket also holds back
+    lower-priority work on that upstream, so large requests are not starved.
+    Requests whose estimated wait exceeds their lane's limit, or that would
+    overflow the lane's queue, are rejected up front with UpstreamBusyError
+    instead of timing out later. The estimate covers both the token bucket
+    and the slots: the waiters already queued ahead, and how soon the calls
+    holding the slots should finish given recent hold times.
+    """
+
+    def __init__(
+        self,
+        concurrency: Dict[str, int],
+        max_wait: Dict[str, float],
+        tokens_per_minute: Dict[str, int],
+        max_queue: int,
+        total_concurrency: int = 0,
+        interactive_reserve: int = 0,
+    ):
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.total_concurrency = total_concurrency
+        self.interactive_reserve = interactive_reserve
+        self.buckets = {upstream: TokenBucket(tpm) for upstream, tpm in tokens_per_minute.items() if tpm > 0}
+        self._active_total = 0
+        self._active = {lane: 0 for lane in concurrency}
+        self._queued = {lane: 0 for lane in concurrency}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Start times of the calls holding slots, and the running average hold time per lane (None: the pool)
+        self._holding: Dict[str, List[float]] = {lane: [] for lane in concurrency}
+        self._hold_time: Dict[Optional[str], float] = {}
+
+    def _token_wait(self, priority: int, upstream: str, tokens: int) -> float:
+        """Time until the bucket could cover this request and every waiter ahead of it on the same upstream"""
+        bucket = self.buckets.get(upstream)
+        if bucket is None:
+            return 0.0
+        ahead = sum(
+            bucket.cost(waiter.tokens) for waiter in self._waiters
+            if waiter.upstream == upstream and waiter.priority <= priority and not waiter.future.done()
+        )
+        return bucket.wait_time(ahead + bucket.cost(tokens))
+
+    @staticmethod
+    def _slot_wait(slots: int, active: int, ahead: int, hold_time: Optional[float], started: List[float]) -> float:
+        """Time until one of slots frees for a request with ahead waiters in front of it.
+
+        The first slot frees when the longest-running call reaches the usual
+        hold time; each further round of slots takes another hold time.
+        """
+        free = slots - active
+        if ahead < free or hold_time is None or slots <= 0:
+            return 0.0
+        first = max(0.0, hold_time - (time.monotonic() - min(started))) if started else 0.0
+        return first + (ahead - max(free, 0)) // slots * hold_time
+
+    def _estimate_wait(self, lane: str, priority: int, upstream: str, tokens: int) -> float:
+        """Time until this request could be admitted: the longest of its token, lane and pool waits"""
+        waiting = [waiter for waiter in self._waiters if waiter.priority <= priority and not waiter.future.done()]
+        wait = max(self._token_wait(priority, upstream, tokens), self._slot_wait(
+            self.concurrency[lane],
+            self._active[lane],
+            sum(1 for waiter in waiting if waiter.lane == lane),
+            self._hold_time.get(lane),
+            self._holding[lane],
+        ))
+        if self.total_concurrency:
+            limit = self.total_concurrency
+            if priority > INTERACTIVE_PRIORITY:
+                limit -= self.interactive_reserve
+            wait = max(wait, self._slot_wait(
+                limit,
+                self._active_total,
+                len(waiting),
+                self._hold_time.get(None),
+                [start for started in self._holding.values() for start in started],
+            ))
+        return wait
+
+    def _observe_hold(self, lane: str, seconds: float):
+        for key in (lane, None):
+            previous = self._hold_time.get(key)
+            self._hold_time[key] = seconds if previous is None else previous + HOLD_TIME_WEIGHT * (seconds - previous)
+
+    def _pool_full(self, priority: int) -> bool:
+        """Whether the shared pool has no slot for this priority; all but interactive work leave the reserve free"""
+        if not self.total_concurrency:
+            return False
+        limit = self.total_concurrency
+        if priority > INTERACTIVE_PRIORITY:
+            limit -= self.interactive_reserve
+        return self._active_total >= limit
+
+    def _reject(self, lane: str, reason: str, message: str, retry_after: float):
+        SCHEDULER_REJECTED.inc(lane=lane, reason=reason)
+        raise UpstreamBusyError(message, retry_after)
+
+    def _dispatch(self):
+        """Admit every waiter that fits, in priority order"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        blocked_upstreams = set()
+        retry_in = None
+        for waiter in sorted(self._waiters):
+            if waiter.future.done():
+                continue
+            if waiter.upstream in blocked_upstreams or self._active[waiter.lane] >= self.concurrency[waiter.lane]:
+                continue
+            if self._pool_full(waiter.priority):
+                # Everything later in the order has the same or a lower priority
+                break
+            bucket = self.buckets.get(waiter.upstream)
+            if bucket is not None:
+                wait = bucket.wait_time(waiter.tokens)
+                if wait > 0:
+                    blocked_upstreams.add(waiter.upstream)
+                    retry_in = wait if retry_in is None else min(retry_in, wait)
+                    continue
+                bucket.take(waiter.tokens)
+            self._active[waiter.lane] += 1
+            self._active_total += 1
+            waiter.future.set_result(None)
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+        if retry_in is not None:
+            self._timer = asyncio.get_running_loop().call_later(retry_in, self._dispatch)
+
+    def _release(self, lane: str):
+        self._active[lane] -= 1
+        self._active_total -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def admit(self, lane: str, upstream: str, tokens: int, priority: Optional[int] = None, max_wait: Optional[float] = None):
+        """Hold an upstream slot for the block; tokens is the estimated prompt plus reply size.
+
+        max_wait defaults to the lane's limit; pass math.inf for background work
+        that should queue rather than be rejected.
+        """
+        priority = LANE_PRIORITIES[lane] if priority is None else priority
+        max_wait = self.max_wait[lane] if max_wait is None else max_wait
+
+        if self.max_queue and self._queued[lane] >= self.max_queue and max_wait != math.inf:
+            self._reject(lane, "queue_full", f"Too many {lane} requests are waiting; try again shortly", max_wait)
+        estimate = self._estimate_wait(lane, priority, upstream, tokens)
+        if estimate > max_wait:
+            self._reject(lane, "over_deadline", f"Upstream {upstream} is busy; try again in {estimate:.0f}s", estimate)
+
+        waiter = _Waiter(priority, next(self._seq), lane, upstream, tokens, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._queued[lane] += 1
+        SCHEDULER_QUEUE_DEPTH.inc(lane=lane)
+        start = time.perf_counter()
+        try:
+            self._dispatch()
+            timeout = None if max_wait == math.inf else max_wait
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    self._reject(lane, "timeout", f"Upstream {upstream} is busy; try again shortly", max_wait)
+            except asyncio.CancelledError:
+                if not waiter.future.cancel():
+                    # Admitted just as the caller went away; hand the slot straight back
+                    self._release(lane)
+                raise
+        finally:
+            self._queued[lane] -= 1
+            SCHEDULER_QUEUE_DEPTH.dec(lane=lane)
+            SCHEDULER_WAIT.observe(time.perf_counter() - start, lane=lane)
+
+        SCHEDULER_ACTIVE.inc(lane=lane)
+        held_since = time.monotonic()
+        self._holding[lane].append(held_since)
+        try:
+            yield
+        finally:
+            SCHEDULER_ACTIVE.dec(lane=lane)
+            self._holding[lane].remove(held_since)
+            self._observe_hold(lane, time.monotonic() - held_since)
+            self._release(lane)
+
+
+_scheduler: Optional[UpstreamScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_upstream_scheduler() -> UpstreamScheduler:
+    """Return the process-wide scheduler, built from settings on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = UpstreamScheduler(
+                concurrency={
+                    "chat": settings.SCHEDULER_CHAT_CONCURRENCY,
+                    "document": settings.SCHEDULER_DOCUMENT_CONCURRENCY,
+                    "imaging": settings.SCHEDULER_IMAGING_CONCURRENCY,
+                },
+                max_wait={
+                    "chat": settings.SCHEDULER_CHAT_MAX_WAIT,
+                    "document": settings.SCHEDULER_DOCUMENT_MAX_WAIT,
+                    "imaging": settings.SCHEDULER_IMAGING_MAX_WAIT,
+                },
+                tokens_per_minute={
+                    "azure": settings.AZURE_TOKENS_PER_MINUTE,
+                    "openai": settings.OPENAI_TOKENS_PER_MINUTE,
+                },
+                max_queue=settings.SCHEDULER_MAX_QUEUE,
+                total_concurrency=settings.SCHEDULER_TOTAL_CONCURRENCY,
+                interactive_reserve=settings.SCHEDULER_CHAT_RESERVE,
+            )
+        return _scheduler
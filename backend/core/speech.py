@@ -0,0 +1,383 @@
+import abc
+import array
+import asyncio
+import base64
+import collections
+import hashlib
+import io
+import re
+import threading
+import time
+import wave
+from typing import TYPE_CHECKING, AsyncIterator, Deque, List, Optional, Tuple
+
+from core.clients import upstream_clients
+from core.coalescing import SingleFlight
+from core.config import settings
+from core.metrics import SPEECH_CACHE_REQUESTS, SPEECH_FIRST_AUDIO
+from core.resilience import call_upstream
+from core.result_cache import AudioCache, get_audio_cache
+from core.scheduler import UpstreamBusyError
+
+if TYPE_CHECKING:
+    import httpx
+
+# Sentence ends: terminal punctuation (plus closing quotes/brackets) followed by whitespace, or a line break
+SENTENCE_BOUNDARY = re.compile(r"([.!?]+[\"'”’)\]]*)\s+|\n+")
+# Words whose trailing period does not end a sentence
+ABBREVIATIONS = {
+    "dr.", "mr.", "mrs.", "ms.", "prof.", "st.", "vs.", "etc.", "e.g.", "i.e.", "approx.",
+    "no.", "fig.", "cf.", "al.", "min.", "max.", "mg.", "ml.",
+}
+ORDINAL = re.compile(r"(?:\d+|[a-z])\.")
+
+MARKDOWN_PATTERNS = (
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"^\s*(?:[-*+•]|\d+[.)])\s+", re.MULTILINE), ""),
+    (re.compile(r"[*_`#>|~]+"), ""),
+    (re.compile(r"\s+"), " "),
+)
+VOICE_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def speakable(text: str) -> str:
+    """Strip the markdown a reply is formatted with, so it is not read out"""
+    for pattern, replacement in MARKDOWN_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def check_voice(voice: Optional[str]) -> Optional[str]:
+    """Validate a caller-supplied voice id; it ends up in the provider's URL"""
+    if voice is not None and not VOICE_PATTERN.fullmatch(voice):
+        raise ValueError(f"Invalid voice {voice!r}")
+    return voice
+
+
+class SentenceSplitter:
+    """Cut streamed text into sentences as soon as each one is complete.
+
+    Sentences shorter than min_chars are merged with the next, so list
+    markers and headings do not become clips of their own; text running past
+    max_chars without a boundary is cut at the last space.
+    """
+
+    def __init__(self, min_chars: int, max_chars: int):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+        self._pending = ""
+
+    def _ends_sentence(self, text: str) -> bool:
+        words = text.split()
+        if not words:
+            return False
+        word = words[-1].lower().rstrip("\"'”’)]")
+        return word not in ABBREVIATIONS and not ORDINAL.fullmatch(word)
+
+    def _take(self, piece: str) -> Optional[str]:
+        self._pending = f"{self._pending} {piece}" if self._pending else piece
+        if len(self._pending) < self.min_chars:
+            return None
+        sentence, self._pending = self._pending, ""
+        return sentence
+
+    def feed(self, delta: str) -> List[str]:
+        """Add streamed text; returns the sentences it completed"""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self._buffer):
+            end = match.end(1) if match.group(1) else match.start()
+            piece = self._buffer[start:end].strip()
+            if match.group(1) and not self._ends_sentence(piece):
+                continue
+            start = match.end()
+            if piece:
+                sentence = self._take(piece)
+                if sentence:
+                    sentences.append(sentence)
+        self._buffer = self._buffer[start:]
+
+        while len(self._pending) + len(self._buffer) > self.max_chars:
+            room = max(self.max_chars - len(self._pending), 1)
+            cut = self._buffer.rfind(" ", 0, room)
+            cut = cut if cut > 0 else room
+            sentences.append(f"{self._pending} {self._buffer[:cut]}".strip())
+            self._pending, self._buffer = "", self._buffer[cut:].lstrip()
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """The trailing text once the stream has ended"""
+        rest = f"{self._pending} {self._buffer}".strip()
+        self._pending = self._buffer = ""
+        return rest or None
+
+
+def split_sentences(text: str, min_chars: int, max_chars: int) -> List[str]:
+    splitter = SentenceSplitter(min_chars, max_chars)
+    sentences = splitter.feed(text)
+    rest = splitter.flush()
+    return sentences + [rest] if rest else sentences
+
+
+class SpeechProviderError(Exception):
+    """The text-to-speech provider rejected or failed a request"""
+
+    def __init__(self, message: str, status_code: int, response: Optional["httpx.Response"] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+
+class SpeechProvider(abc.ABC):
+    """A text-to-speech backend; synthesize() returns one complete audio clip.
+
+    streamable providers produce clips that play back-to-back when their
+    bytes are concatenated (MP3 frames); others are returned one clip per
+    request.
+    """
+
+    name = ""
+    media_type = "application/octet-stream"
+    streamable = False
+
+    def __init__(self, voice: str, model: str):
+        self.voice = voice
+        self.model = model
+
+    @property
+    def variant(self) -> str:
+        """Everything besides text and voice that changes the audio, for cache keys"""
+        return f"{self.name}:{self.model}"
+
+    @abc.abstractmethod
+    async def synthesize(self, text: str, voice: str) -> bytes:
+        """Audio for text in the given voice"""
+
+
+class ElevenLabsProvider(SpeechProvider):
+    name = "elevenlabs"
+    media_type = "audio/mpeg"
+    streamable = True
+
+    def __init__(self, voice: str, model: str, api_key: str, base_url: str, output_format: str):
+        super().__init__(voice, model)
+        if not api_key:
+            raise ValueError("ELEVENLABS_API_KEY is required for the elevenlabs speech provider")
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.output_format = output_format
+
+    @property
+    def variant(self) -> str:
+        return f"{self.name}:{self.model}:{self.output_format}"
+
+    async def synthesize(self, text: str, voice: str) -> bytes:
+        import httpx
+
+        try:
+            response = await upstream_clients.elevenlabs().post(
+                f"{self.base_url}/v1/text-to-speech/{voice}",
+                params={"output_format": self.output_format},
+                headers={"xi-api-key": self.api_key, "accept": self.media_type},
+                json={"text": text, "model_id": self.model},
+            )
+        except httpx.TimeoutException as e:
+            raise SpeechProviderError(f"Speech synthesis timed out: {e}", 504)
+        except httpx.TransportError as e:
+            raise SpeechProviderError(f"Speech provider unreachable: {e}", 503)
+        if response.status_code != 200:
+            raise SpeechProviderError(
+                f"Speech provider returned {response.status_code}: {response.text[:200]}",
+                response.status_code,
+                response
+            )
+        return response.content
+
+
+class LocalSpeechProvider(SpeechProvider):
+    """Offline stand-in: a quiet tone as long as the text would take to read.
+
+    Deterministic for a given text and voice, and needs no network or
+    credentials, so development setups and benchmarks exercise the same
+    splitting, caching and streaming paths as a real provider.
+    """
+
+    name = "local"
+    media_type = "audio/wav"
+    streamable = False
+
+    SAMPLE_RATE = 16000
+    SECONDS_PER_CHAR = 0.06
+    MAX_SECONDS = 60.0
+
+    async def synthesize(self, text: str, voice: str) -> bytes:
+        seconds = min(max(len(text) * self.SECONDS_PER_CHAR, 0.3), self.MAX_SECONDS)
+        pitch = 160 + int(hashlib.sha256(voice.encode("utf-8")).hexdigest(), 16) % 120
+        period = self.SAMPLE_RATE // pitch
+        half = period // 2
+        wave_period = array.array("h", [1500] * half + [-1500] * (period - half))
+        samples = (wave_period * (int(seconds * self.SAMPLE_RATE) // period + 1))[:int(seconds * self.SAMPLE_RATE)]
+
+        output = io.BytesIO()
+        with wave.open(output, "wb") as clip:
+            clip.setnchannels(1)
+            clip.setsampwidth(2)
+            clip.setframerate(self.SAMPLE_RATE)
+            clip.writeframes(samples.tobytes())
+        return output.getvalue()
+
+
+def build_speech_provider() -> SpeechProvider:
+    """The provider named by SPEECH_PROVIDER"""
+    name = settings.SPEECH_PROVIDER.strip().lower()
+    if name == LocalSpeechProvider.name:
+        return LocalSpeechProvider(settings.SPEECH_VOICE, settings.SPEECH_MODEL)
+    if name == ElevenLabsProvider.name:
+        return ElevenLabsProvider(
+            settings.SPEECH_VOICE,
+            settings.SPEECH_MODEL,
+            api_key=settings.ELEVENLABS_API_KEY,
+            base_url=settings.ELEVENLABS_BASE_URL,
+            output_format=settings.SPEECH_OUTPUT_FORMAT,
+        )
+    raise ValueError(f"Unknown SPEECH_PROVIDER {settings.SPEECH_PROVIDER!r}")
+
+
+class SpeechSynthesizer:
+    """Synthesizes clips through the audio cache; concurrent requests for one clip share a call"""
+
+    def __init__(self, provider: SpeechProvider, cache: AudioCache):
+        self.provider = provider
+        self.cache = cache
+        self._flights = SingleFlight()
+
+    async def synthesize(self, text: str, voice: Optional[str] = None) -> Tuple[bytes, bool]:
+        """Return (audio, whether it came from the cache)"""
+        voice = voice or self.provider.voice
+        key = AudioCache.make_key(text, voice, self.provider.variant)
+        audio = await self.cache.get_async(key)
+        if audio is not None:
+            SPEECH_CACHE_REQUESTS.inc(result="hit")
+            return audio, True
+        SPEECH_CACHE_REQUESTS.inc(result="miss")
+
+        async def fill(is_disconnected) -> bytes:
+            audio = await call_upstream(
+                self.provider.name,
+                "speech_synthesize",
+                lambda: self.provider.synthesize(text, voice)
+            )
+            await self.cache.put_async(key, audio)
+            return audio
+
+        return await self._flights.do(key, fill), False
+
+
+_synthesizer: Optional[SpeechSynthesizer] = None
+_synthesizer_lock = threading.Lock()
+
+
+def get_speech_synthesizer() -> SpeechSynthesizer:
+    global _synthesizer
+    with _synthesizer_lock:
+        if _synthesizer is None:
+            _synthesizer = SpeechSynthesizer(build_speech_provider(), get_audio_cache())
+        return _synthesizer
+
+
+class SpeechClip:
+    __slots__ = ("index", "text", "audio", "media_type", "cached", "error")
+
+    def __init__(self, index: int, text: str, media_type: str):
+        self.index = index
+        self.text = text
+        self.media_type = media_type
+        self.audio = b""
+        self.cached = False
+        self.error: Optional[Exception] = None
+
+    def event(self) -> Tuple[str, dict]:
+        """(event name, payload) for relaying the clip as a server-sent event"""
+        if self.error is not None:
+            detail = {"index": self.index, "text": self.text, "detail": str(self.error)}
+            if isinstance(self.error, UpstreamBusyError):
+                detail["retry_after"] = self.error.retry_after_header
+            return "audio_error", detail
+        return "audio", {
+            "index": self.index,
+            "text": self.text,
+            "media_type": self.media_type,
+            "cached": self.cached,
+            "audio": base64.b64encode(self.audio).decode("ascii"),
+        }
+
+
+class SpeechPipeline:
+    """Speak a reply while it is still being generated.
+
+    Text is fed in as it streams; each completed sentence is synthesized
+    straight away, up to SPEECH_CONCURRENCY at a time, and clips come back
+    in reply order. A failed clip carries its error instead of audio so the
+    rest of the reply is still spoken.
+    """
+
+    def __init__(self, synthesizer: SpeechSynthesizer, voice: Optional[str] = None, concurrency: Optional[int] = None):
+        self.synthesizer = synthesizer
+        self.voice = voice
+        self.splitter = SentenceSplitter(settings.SPEECH_MIN_SENTENCE_CHARS, settings.SPEECH_MAX_SENTENCE_CHARS)
+        self._semaphore = asyncio.Semaphore(max(concurrency or settings.SPEECH_CONCURRENCY, 1))
+        self._pending: Deque[Tuple[SpeechClip, asyncio.Task]] = collections.deque()
+        self._count = 0
+        self._started = time.perf_counter()
+        self._first_audio = True
+
+    async def _synthesize(self, clip: SpeechClip) -> SpeechClip:
+        async with self._semaphore:
+            try:
+                clip.audio, clip.cached = await self.synthesizer.synthesize(clip.text, self.voice)
+            except Exception as e:
+                print(f"Error synthesizing speech clip {clip.index}: {e}")
+                clip.error = e
+        if self._first_audio and clip.error is None:
+            SPEECH_FIRST_AUDIO.observe(time.perf_counter() - self._started)
+            self._first_audio = False
+        return clip
+
+    def _schedule(self, sentence: str):
+        text = speakable(sentence)
+        if not text:
+            return
+        clip = SpeechClip(self._count, text, self.synthesizer.provider.media_type)
+        self._count += 1
+        self._pending.append((clip, asyncio.ensure_future(self._synthesize(clip))))
+
+    def feed(self, delta: str):
+        for sentence in self.splitter.feed(delta):
+            self._schedule(sentence)
+
+    def finish(self):
+        """The reply is complete; speak whatever text is left"""
+        rest = self.splitter.flush()
+        if rest:
+            self._schedule(rest)
+
+    def ready(self) -> List[SpeechClip]:
+        """Clips that are done, in order, without waiting for later ones"""
+        clips = []
+        while self._pending and self._pending[0][1].done():
+            clips.append(self._pending.popleft()[1].result())
+        return clips
+
+    async def drain(self) -> AsyncIterator[SpeechClip]:
+        """Wait for the remaining clips, yielding each in order"""
+        while self._pending:
+            clip, task = self._pending[0]
+            await task
+            self._pending.popleft()
+            yield clip
+
+    def cancel(self):
+        while self._pending:
+            self._pending.popleft()[1].cancel()
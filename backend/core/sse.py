@@ -0,0 +1,14 @@
+import json
+from typing import Optional
+
+# Headers that stop proxies from buffering an event stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(data: dict, event: Optional[str] = None) -> str:
+    """Encode one server-sent event; the payload is sent as a single JSON data line"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
@@ -1,10 +1,11 @@
+import importlib.util
 import os
-import uvicorn
+import sys
 import time
 
-from fastapi import FastAPI, Request, Response, Depends
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
+from starlette.routing import Match
 
 # from core.logging import logger
 from typing import Any, Callable, TypeVar
@@ -12,6 +13,15 @@ from typing import Any, Callable, TypeVar
 from routers.thinker import router as information_thinker
 from routers.diagnosis_assistant import router as diagnosis_assistant
 from routers.patient import router as patient_router
+from routers.speech import router as speech_router
+from core.conversation_store import close_conversation_stores
+from core.patient_store import close_patient_repository
+from core.clients import upstream_clients
+from core.config import settings
+from core.document_parser import shutdown_parser_executor
+from core.image_pipeline import shutdown_image_executor
+from core.jobs import get_job_queue, close_job_queue
+from core.metrics import registry, CONTENT_TYPE, HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT
 
 app = FastAPI(
     title="Clinic managment system",
@@ -24,6 +34,7 @@ app = FastAPI(
 app.include_router(information_thinker, tags = ["Thinker"])
 app.include_router(diagnosis_assistant, tags = ["Assistant"])
 app.include_router(patient_router, prefix="/patients", tags = ["Patients"])
+app.include_router(speech_router, tags = ["Speech"])
 
 origins = [
   "http://localhost:3000"
@@ -35,6 +46,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # @app.on_event("startup")
@@ -49,18 +61,84 @@ app.add_middleware(
 #         document_models = [DeepLearning, TrainStore]
 
 
+@app.on_event("startup")
+async def app_init():
+    """
+        initialize crucial application services
+    """
+    if settings.PRELOAD_UPSTREAM_CLIENTS:
+        upstream_clients.start()
+    get_job_queue().start()
+
+
+@app.on_event("shutdown")
+async def app_shutdown():
+    """
+        return running jobs to the queue, release upstream connections and storage handles
+    """
+    await close_job_queue()
+    await upstream_clients.aclose()
+    shutdown_parser_executor()
+    shutdown_image_executor()
+    close_conversation_stores()
+    close_patient_repository()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+        Prometheus metrics for this worker process
+    """
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+
 F = TypeVar("F", bound=Callable[..., Any])
 
+def route_template(request: Request) -> str:
+    """
+    Route path template (e.g. /patients/{patient_id}) used as the metrics label
+    """
+    partial = None
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
 @app.middleware("http")
 async def process_time_log_middleware(request: Request, call_next: F) -> Response:
     """
-    Add API process time in response headers and log calls
+    Add API process time in response headers, record request metrics and log calls
     """
     start_time = time.time()
-    response: Response = await call_next(request)
+    method, route = request.method, route_template(request)
+    HTTP_REQUESTS_IN_FLIGHT.inc(method=method, route=route)
+    try:
+        response: Response = await call_next(request)
+    except Exception:
+        HTTP_REQUESTS_IN_FLIGHT.dec(method=method, route=route)
+        HTTP_REQUEST_DURATION.observe(time.time() - start_time, method=method, route=route, status="500")
+        raise
     process_time = str(round(time.time() - start_time, 3))
     response.headers["X-Process-Time"] = process_time
 
+    # X-Process-Time covers the handler; the histogram also covers sending the (possibly streamed) body
+    body_iterator = response.body_iterator
+
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(method=method, route=route)
+            HTTP_REQUEST_DURATION.observe(
+                time.time() - start_time, method=method, route=route, status=str(response.status_code)
+            )
+
+    response.body_iterator = observed_body()
+
     # logger.info(
     #     "Method=%s Path=%s StatusCode=%s ProcessTime=%s",
     #     request.method,
@@ -71,14 +149,36 @@ async def process_time_log_middleware(request: Request, call_next: F) -> Respons
     
     return response
 
+def server_options(production: bool) -> dict:
+    """
+    uvicorn options for a development server (one process, auto-reload) or a production one
+    (several workers, uvloop and httptools when installed, bounded graceful shutdown)
+    """
+    # Storage is process-safe, so WORKERS=0 runs one worker per core; reload only works with a single worker
+    workers = int(os.getenv("WORKERS", 0 if production else 1)) or os.cpu_count()
+    if not production:
+        return {"log_level": "debug", "workers": workers, "reload": workers == 1}
+    return {
+        "log_level": os.getenv("LOG_LEVEL", "info"),
+        "workers": workers,
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        # On SIGTERM, stop accepting connections and give in-flight requests and streams this long to
+        # finish before the shutdown hook returns running jobs to the queue
+        "timeout_graceful_shutdown": int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", 30)),
+        "timeout_keep_alive": int(os.getenv("KEEPALIVE_SECONDS", 5)),
+        "access_log": os.getenv("ACCESS_LOG", "false").lower() in ("1", "true", "yes"),
+        "proxy_headers": True,
+        "server_header": False,
+    }
+
 if __name__ == "__main__":
+    import uvicorn
+
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(
-        "main:app", 
-        host=host, 
-        port=port, 
-        log_level="debug", 
-        # workers=os.cpu_count(), 
-        reload=True,
-    )
+    production = "--production" in sys.argv or os.getenv("PRODUCTION", "").lower() in ("1", "true", "yes")
+    options = server_options(production)
+    if production:
+        print(f"Starting {options['workers']} workers (loop={options['loop']}, http={options['http']})")
+    uvicorn.run("main:app", host=host, port=port, **options)
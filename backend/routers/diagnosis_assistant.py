@@ -1,9 +1,16 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter
-from fastapi.responses import JSONResponse
-from openai import OpenAI
-import os
+from fastapi import UploadFile, File, HTTPException, APIRouter, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List
+import asyncio
 from core.config import settings
-import base64
+from core.clients import get_openai_client
+from core.image_pipeline import prepare_image
+from core.result_cache import get_analysis_cache
+from core.sse import format_sse, SSE_HEADERS
+from core.coalescing import SingleFlight
+from core.resilience import call_upstream, hedged, LatencyTracker
+from core.scheduler import get_upstream_scheduler, UpstreamBusyError
+import hashlib
 
 insturction = """You are an orthopedic assistant helping to analyze X-ray images. Please extract clinically relevant information that orthopedic surgeons typically focus on. These include:
 
@@ -37,39 +44,175 @@ router = APIRouter(
     responses={404: {"description": "error"}}
 )
 
-client = OpenAI(
-    api_key=settings.OPENAI_CREDENTIAL_KEY,
-)
-
+analysis_flights = SingleFlight()
+# Recent vision call latencies; a call slower than their p95 gets a hedged duplicate
+vision_latencies = LatencyTracker()
+
+
+ANALYSIS_MODEL = "gpt-4o"
+ANALYSIS_PROMPT = "Please perform a professional analysis of this X‑ray image. Extract clinically relevant information ..."
+ANALYSIS_MAX_TOKENS = 300
+# Upstream quota estimate per analysis: a high-detail 768x1024 image is 6 tiles of 170 tokens plus 85
+ANALYSIS_IMAGE_TOKENS = 1105
+
+# Cached analyses are only reused for the same model, prompt and preprocessing settings
+PROMPT_VERSION = hashlib.sha256(f"{ANALYSIS_PROMPT}|{ANALYSIS_MAX_TOKENS}".encode("utf-8")).hexdigest()[:12]
+
+
+def analysis_variant(original: bool) -> str:
+    if original:
+        return f"{ANALYSIS_MODEL}:{PROMPT_VERSION}:original"
+    return (
+        f"{ANALYSIS_MODEL}:{PROMPT_VERSION}:{settings.IMAGE_MAX_EDGE}:"
+        f"{settings.IMAGE_GRAYSCALE}:{settings.IMAGE_FORMAT}:{settings.IMAGE_JPEG_QUALITY}"
+    )
+
+
+async def analyze_image_bytes(image_data: bytes, content_type: str, original: bool = False, no_cache: bool = False) -> tuple[str, str]:
+    """Analyze one X-ray, consulting the result cache. Returns (analysis, cache status: HIT, NEAR or MISS)."""
+    cache = get_analysis_cache()
+    variant = analysis_variant(original)
+    cache_key = cache.make_key(hashlib.sha256(image_data).hexdigest(), variant)
+    if not no_cache:
+        cached = await cache.get_async(cache_key)
+        if cached is not None:
+            return cached, "HIT"
+
+    # Concurrent submissions of the same image share one upstream call. Bypassing requests
+    # only share with each other, so they never receive a cached or near-duplicate result.
+    return await analysis_flights.do(
+        (cache_key, no_cache),
+        lambda is_disconnected: run_image_analysis(image_data, content_type, original, no_cache, cache_key, variant)
+    )
+
+
+async def run_image_analysis(
+    image_data: bytes,
+    content_type: str,
+    original: bool,
+    no_cache: bool,
+    cache_key: str,
+    variant: str
+) -> tuple[str, str]:
+    """Preprocess an image and call the vision model, storing the result in the cache"""
+    cache = get_analysis_cache()
+    near_duplicates = settings.ANALYSIS_CACHE_NEAR_DUPLICATES
+    try:
+        image_url, _, phash = await prepare_image(image_data, content_type, original=original, with_phash=near_duplicates)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read image: {e}")
 
-@router.post("/analyze-image/")
-async def analyze_image(file: UploadFile = File(...)):
-    if file.content_type.split("/")[0] != "image":
-        raise HTTPException(status_code=400, detail="Please upload a images.")
-     
-    image_data = await file.read()
+    if not no_cache and phash is not None:
+        similar = cache.find_similar(phash, variant, settings.ANALYSIS_CACHE_PHASH_DISTANCE)
+        if similar is not None:
+            return similar, "NEAR"
 
     try:
-        b64_image = base64.b64encode(image_data).decode("utf-8")
-
         messages = [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": "Please perform a professional analysis of this X‑ray image. Extract clinically relevant information ..."},
-                    {"type": "image_url", "image_url": {"url": f"data:{file.content_type};base64,{b64_image}"}}
+                    {"type": "text", "text": ANALYSIS_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image_url}}
                 ]
             }
         ]
 
-        resp = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            max_tokens=300,
-            temperature=0
-        )
+        def vision_call():
+            return get_openai_client().chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+                max_tokens=ANALYSIS_MAX_TOKENS,
+                temperature=0
+            )
+
+        scheduler = get_upstream_scheduler()
+        analysis_tokens = ANALYSIS_IMAGE_TOKENS + ANALYSIS_MAX_TOKENS
+
+        def admit_hedge():
+            # A duplicate call needs its own slot and tokens, and is skipped rather than queued
+            return scheduler.admit("imaging", "openai", analysis_tokens, max_wait=0)
+
+        async with scheduler.admit("imaging", "openai", analysis_tokens):
+            if settings.VISION_HEDGING:
+                resp = await call_upstream(
+                    "openai", "vision_call", lambda: hedged("vision_call", vision_call, vision_latencies, admit=admit_hedge)
+                )
+            else:
+                resp = await call_upstream("openai", "vision_call", vision_call)
+    except UpstreamBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": e.retry_after_header})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Model error：{e}")
 
     result = resp.choices[0].message.content
-    return JSONResponse(content={"analysis": result})
+    await cache.put_async(cache_key, result, variant=variant, phash=phash)
+    return result, "MISS"
+
+
+@router.post("/analyze-image/")
+async def analyze_image(
+    file: UploadFile = File(...),
+    original: bool = Query(False),
+    no_cache: bool = Query(False)
+):
+    """Analyze an X-ray. The image is downsampled and re-encoded first unless original=true.
+
+    Results are cached by image content; no_cache=true forces a fresh analysis.
+    """
+    if file.content_type.split("/")[0] != "image":
+        raise HTTPException(status_code=400, detail="Please upload a images.")
+     
+    image_data = await file.read()
+
+    result, cache_status = await analyze_image_bytes(image_data, file.content_type, original=original, no_cache=no_cache)
+    return JSONResponse(content={"analysis": result}, headers={"X-Cache": cache_status})
+
+
+@router.post("/analyze-images/")
+async def analyze_images(
+    files: List[UploadFile] = File(...),
+    original: bool = Query(False),
+    no_cache: bool = Query(False)
+):
+    """Analyze a batch of X-rays concurrently, streaming each result as a server-sent event.
+
+    Emits one `result` or `error` event per image as soon as it finishes (with
+    its index in the upload order), then a `done` event with counts.
+    """
+    if len(files) > settings.IMAGE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.IMAGE_BATCH_MAX_FILES} images per batch.")
+
+    # Read every upload now; the files are closed once this handler returns
+    uploads = [(index, file.filename, file.content_type, await file.read()) for index, file in enumerate(files)]
+    semaphore = asyncio.Semaphore(settings.IMAGE_BATCH_CONCURRENCY)
+
+    async def analyze_one(index: int, filename: str, content_type: str, image_data: bytes) -> dict:
+        if not content_type or content_type.split("/")[0] != "image":
+            return {"index": index, "filename": filename, "status_code": 400, "detail": "Please upload a images."}
+        try:
+            async with semaphore:
+                result, cache_status = await analyze_image_bytes(image_data, content_type, original=original, no_cache=no_cache)
+            return {"index": index, "filename": filename, "analysis": result, "cache": cache_status}
+        except HTTPException as e:
+            return {"index": index, "filename": filename, "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            return {"index": index, "filename": filename, "status_code": 500, "detail": f"Model error：{e}"}
+
+    async def stream_results():
+        tasks = [asyncio.create_task(analyze_one(*upload)) for upload in uploads]
+        succeeded = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if "analysis" in result:
+                    succeeded += 1
+                    yield format_sse(result, event="result")
+                else:
+                    yield format_sse(result, event="error")
+            yield format_sse({"total": len(tasks), "succeeded": succeeded, "failed": len(tasks) - succeeded}, event="done")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -1,10 +1,9 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel, Field
 from typing import List, Optional
-import uuid
-import json
-import os
-from datetime import datetime
+
+from core.patient_store import get_patient_repository, DuplicateMrnError
+from core.response_cache import get_response_cache
 
 router = APIRouter(
     responses={404: {"description": "error"}}
@@ -62,153 +61,131 @@ class PatientUpdate(BaseModel):
 
 class PatientSearchRequest(BaseModel):
     query: str
+    # Without a limit every match is returned, as before paging existed
+    limit: Optional[int] = Field(None, ge=1, le=500)
+    offset: int = Field(0, ge=0)
+    fuzzy: bool = False
 
 class PatientSearchResponse(BaseModel):
     patients: List[Patient]
     total: int
 
-# File path for patient data
-PATIENTS_FILE = "data/patients.json"
-
 def load_patients() -> List[dict]:
-    """Load patients from JSON file"""
+    """Load all patients from the repository"""
     try:
-        if os.path.exists(PATIENTS_FILE):
-            with open(PATIENTS_FILE, 'r') as f:
-                return json.load(f)
-        else:
-            # Create data directory if it doesn't exist
-            os.makedirs(os.path.dirname(PATIENTS_FILE), exist_ok=True)
-            return []
+        return get_patient_repository().all()
     except Exception as e:
         print(f"Error loading patients: {e}")
         return []
 
 def save_patients(patients: List[dict]):
-    """Save patients to JSON file"""
+    """Replace the whole patient registry"""
     try:
-        os.makedirs(os.path.dirname(PATIENTS_FILE), exist_ok=True)
-        with open(PATIENTS_FILE, 'w') as f:
-            json.dump(patients, f, indent=2)
+        get_patient_repository().replace_all(patients)
     except Exception as e:
         print(f"Error saving patients: {e}")
         raise HTTPException(status_code=500, detail=f"Error saving patients: {str(e)}")
 
 def get_next_id() -> str:
     """Generate next available ID"""
-    patients = load_patients()
-    if not patients:
-        return "1"
-    max_id = max(int(p["id"]) for p in patients)
-    return str(max_id + 1)
-
-def search_patients(query: str) -> List[Patient]:
-    """Search patients by name, MRN, or other criteria"""
-    query_lower = query.lower()
-    matching_patients = []
-    patients_data = load_patients()
-    
-    for patient_data in patients_data:
-        # Search by name, MRN, email, or phone
-        if (query_lower in patient_data["name"].lower() or
-            query_lower in patient_data["medicalRecordNumber"].lower() or
-            (patient_data.get("email") and query_lower in patient_data["email"].lower()) or
-            (patient_data.get("phone") and query_lower in patient_data["phone"].lower())):
-            matching_patients.append(Patient(**patient_data))
-    
-    return matching_patients
+    return get_patient_repository().allocate_id()
+
+def search_patients(query: str, limit: Optional[int] = None, offset: int = 0, fuzzy: bool = False) -> tuple[List[Patient], int]:
+    """Search patients by name, MRN, email or phone. Returns (ranked page, total matches)."""
+    patients_data, total = get_patient_repository().search(query, limit=limit, offset=offset, fuzzy=fuzzy)
+    return [Patient(**patient_data) for patient_data in patients_data], total
 
 def get_patient_by_id(patient_id: str) -> Optional[Patient]:
     """Get a specific patient by ID"""
-    patients_data = load_patients()
-    for patient_data in patients_data:
-        if patient_data["id"] == patient_id:
-            return Patient(**patient_data)
-    return None
+    patient_data = get_patient_repository().get(patient_id)
+    return Patient(**patient_data) if patient_data else None
 
 def get_patient_by_mrn(mrn: str) -> Optional[Patient]:
     """Get a specific patient by Medical Record Number"""
-    patients_data = load_patients()
-    for patient_data in patients_data:
-        if patient_data["medicalRecordNumber"].lower() == mrn.lower():
-            return Patient(**patient_data)
-    return None
+    patient_data = get_patient_repository().get_by_mrn(mrn)
+    return Patient(**patient_data) if patient_data else None
 
 # CRUD Endpoints
 @router.post("/", response_model=Patient)
 async def create_patient(patient: PatientCreate):
     """Create a new patient"""
     try:
-        patients_data = load_patients()
+        repository = get_patient_repository()
         
         # Check if MRN already exists
-        for existing_patient in patients_data:
-            if existing_patient["medicalRecordNumber"].lower() == patient.medicalRecordNumber.lower():
-                raise HTTPException(status_code=400, detail="Medical Record Number already exists")
+        if repository.mrn_in_use(patient.medicalRecordNumber):
+            raise HTTPException(status_code=400, detail="Medical Record Number already exists")
         
         new_patient = {
             "id": get_next_id(),
             **patient.dict()
         }
         
-        patients_data.append(new_patient)
-        save_patients(patients_data)
+        repository.insert(new_patient)
         
         return Patient(**new_patient)
     except HTTPException:
         raise
+    except DuplicateMrnError:
+        # Another worker took the MRN between the check and the insert
+        raise HTTPException(status_code=400, detail="Medical Record Number already exists")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating patient: {str(e)}")
 
 @router.get("/", response_model=List[Patient])
-async def get_all_patients():
-    """Get all patients"""
+async def get_all_patients(http_request: Request):
+    """Get all patients. The encoded list is reused until a patient changes; send If-None-Match to get 304."""
     try:
-        patients_data = load_patients()
-        return [Patient(**patient_data) for patient_data in patients_data]
+        repository = get_patient_repository()
+
+        def build():
+            # A failed read raises rather than caching an empty list
+            return [Patient(**patient_data).dict() for patient_data in repository.all()], {}
+
+        cached = get_response_cache().respond(("patients",), repository.generation(), build, http_request.headers)
+        return Response(cached.body, status_code=cached.status_code, headers=cached.headers, media_type=cached.media_type)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting patients: {str(e)}")
 
 @router.get("/{patient_id}", response_model=Patient)
-async def get_patient(patient_id: str):
+async def get_patient(http_request: Request, patient_id: str):
     """Get a specific patient by ID"""
-    patient = get_patient_by_id(patient_id)
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    return patient
+    def build():
+        patient = get_patient_by_id(patient_id)
+        if not patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        return patient.dict(), {}
+
+    cached = get_response_cache().respond(
+        ("patient", patient_id), get_patient_repository().generation(), build, http_request.headers
+    )
+    return Response(cached.body, status_code=cached.status_code, headers=cached.headers, media_type=cached.media_type)
 
 @router.put("/{patient_id}", response_model=Patient)
 async def update_patient(patient_id: str, patient_update: PatientUpdate):
     """Update a patient"""
     try:
-        patients_data = load_patients()
+        repository = get_patient_repository()
         
-        # Find the patient
-        patient_index = None
-        for i, patient in enumerate(patients_data):
-            if patient["id"] == patient_id:
-                patient_index = i
-                break
-        
-        if patient_index is None:
+        if repository.get(patient_id) is None:
             raise HTTPException(status_code=404, detail="Patient not found")
         
         # Check if MRN is being changed and if it conflicts
-        if patient_update.medicalRecordNumber:
-            for i, existing_patient in enumerate(patients_data):
-                if (i != patient_index and 
-                    existing_patient["medicalRecordNumber"].lower() == patient_update.medicalRecordNumber.lower()):
-                    raise HTTPException(status_code=400, detail="Medical Record Number already exists")
+        if (patient_update.medicalRecordNumber and
+            repository.mrn_in_use(patient_update.medicalRecordNumber, exclude_id=patient_id)):
+            raise HTTPException(status_code=400, detail="Medical Record Number already exists")
         
         # Update the patient
         update_data = patient_update.dict(exclude_unset=True)
-        patients_data[patient_index].update(update_data)
-        
-        save_patients(patients_data)
+        updated_patient = repository.update(patient_id, update_data)
+        if updated_patient is None:
+            raise HTTPException(status_code=404, detail="Patient not found")
         
-        return Patient(**patients_data[patient_index])
+        return Patient(**updated_patient)
     except HTTPException:
         raise
+    except DuplicateMrnError:
+        raise HTTPException(status_code=400, detail="Medical Record Number already exists")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating patient: {str(e)}")
 
@@ -216,14 +193,9 @@ async def update_patient(patient_id: str, patient_update: PatientUpdate):
 async def delete_patient(patient_id: str):
     """Delete a patient"""
     try:
-        patients_data = load_patients()
-        
-        # Find and remove the patient
-        for i, patient in enumerate(patients_data):
-            if patient["id"] == patient_id:
-                deleted_patient = patients_data.pop(i)
-                save_patients(patients_data)
-                return {"message": f"Patient {deleted_patient['name']} deleted successfully"}
+        deleted_patient = get_patient_repository().delete(patient_id)
+        if deleted_patient:
+            return {"message": f"Patient {deleted_patient['name']} deleted successfully"}
         
         raise HTTPException(status_code=404, detail="Patient not found")
     except HTTPException:
@@ -236,10 +208,15 @@ async def delete_patient(patient_id: str):
 async def search_patients_endpoint(request: PatientSearchRequest):
     """Search for patients by name, MRN, or other criteria"""
     try:
-        patients = search_patients(request.query)
+        patients, total = search_patients(
+            request.query,
+            limit=request.limit,
+            offset=request.offset,
+            fuzzy=request.fuzzy
+        )
         return PatientSearchResponse(
             patients=patients,
-            total=len(patients)
+            total=total
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching patients: {str(e)}")
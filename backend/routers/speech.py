@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Form, HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from core.config import settings
+from core.scheduler import UpstreamBusyError
+from core.speech import SpeechPipeline, get_speech_synthesizer, check_voice, speakable
+
+router = APIRouter(
+    responses={404: {"description": "error"}}
+)
+
+
+def clip_error(error: Exception) -> HTTPException:
+    if isinstance(error, UpstreamBusyError):
+        return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": error.retry_after_header})
+    return HTTPException(status_code=502, detail=f"Speech synthesis failed: {error}")
+
+
+@router.post("/voice-over")
+async def voice_over(voice_data: str = Form(...), voice: str = Form(None)):
+    """Read text aloud. With a streaming provider the audio is sent sentence by sentence as each
+    clip is ready; otherwise the whole text is returned as one clip."""
+    if len(voice_data) > settings.SPEECH_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"Text exceeds {settings.SPEECH_MAX_CHARS} characters")
+    try:
+        voice = check_voice(voice)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    text = speakable(voice_data)
+    if not text:
+        raise HTTPException(status_code=422, detail="Nothing to read out")
+
+    synthesizer = get_speech_synthesizer()
+    media_type = synthesizer.provider.media_type
+    if not synthesizer.provider.streamable:
+        try:
+            audio, cached = await synthesizer.synthesize(text, voice)
+        except Exception as e:
+            raise clip_error(e)
+        return Response(content=audio, media_type=media_type, headers={"X-Cache": "HIT" if cached else "MISS"})
+
+    speech = SpeechPipeline(synthesizer, voice=voice)
+    speech.feed(voice_data)
+    speech.finish()
+    clips = speech.drain()
+    # Wait for the first clip so a failure can still be reported as an HTTP error
+    first = await clips.__anext__()
+    if first.error is not None:
+        speech.cancel()
+        raise clip_error(first.error)
+
+    async def audio():
+        try:
+            yield first.audio
+            async for clip in clips:
+                if clip.error is not None:
+                    # Headers are gone; end the audio early rather than skip a sentence
+                    break
+                yield clip.audio
+        finally:
+            speech.cancel()
+
+    return StreamingResponse(audio(), media_type=media_type)
@@ -1,55 +1,72 @@
-from fastapi import Form, APIRouter, HTTPException, Depends, UploadFile, File, Query
-from fastapi.responses import JSONResponse
+from fastapi import Form, APIRouter, HTTPException, UploadFile, File, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from openai import AzureOpenAI
 from core.config import settings
+from core.clients import get_azure_client
+from core.assistants import run_assistant, stream_run_text, ClientDisconnectedError, RunFailedError, RunTimeoutError
+from core.completions import chat_backend, build_chat_messages, complete_chat, stream_chat_text, BACKEND_COMPLETIONS
+from core.sse import format_sse, SSE_HEADERS
+from core.conversation_store import get_conversation_store
+from core.document_store import get_document_store, content_digest
+from core.coalescing import SingleFlight, KeyedLocks
+from core.scheduler import get_upstream_scheduler, UpstreamBusyError, BACKGROUND_PRIORITY
+from core.jobs import get_job_queue, register_job_handler, QueueFullError, COMPLETED, FINISHED_STATUSES
+from core.document_parser import extract_text_async, check_document_size, DocumentParseError, DocumentTooLargeError
+from core.retrieval import BM25Index, chunk_text, estimate_tokens
+from core.resilience import call_upstream
+from core.speech import SpeechPipeline, get_speech_synthesizer, check_voice
+from core.response_cache import get_response_cache
+import math
 import time
-import PyPDF2
-import io
-import docx
-import tempfile
-import os
 import uuid
-import json
-from typing import Dict, Optional, List
-from datetime import datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Optional, List
+
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
 
 router = APIRouter(
     responses={404: {"description": "error"}}
 )
 
-# Separate JSON file storage for different conversation types
-MEDICAL_CONVERSATIONS_FILE = "data/medical_conversations.json"
-DOCUMENT_CONVERSATIONS_FILE = "data/document_conversations.json"
+# Concurrent identical turns share one upstream run; turns on one conversation (thread) run one at a time
+turn_flights = SingleFlight()
+conversation_locks = KeyedLocks()
+
+def turn_flight_key(conversation_type: str, conversation_id: Optional[str], query: str, *context) -> Optional[tuple]:
+    """Coalescing key for a turn, or None when it starts a new conversation.
+
+    Requests without a conversation id come from anyone, so they are never
+    merged: one caller would receive a reply meant for another.
+    """
+    if not conversation_id:
+        return None
+    return (conversation_type, conversation_id, query.strip().casefold(), *context)
 
 def load_conversations(conversation_type: str = "document") -> Dict[str, dict]:
-    """Load conversations from JSON file based on type"""
-    file_path = MEDICAL_CONVERSATIONS_FILE if conversation_type == "medical" else DOCUMENT_CONVERSATIONS_FILE
+    """Load all conversations of a type (full records, including messages)"""
     try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-                return data.get("conversations", {})
-        else:
-            # Create data directory if it doesn't exist
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            return {}
+        return get_conversation_store(conversation_type).load_all()
     except Exception as e:
         print(f"Error loading {conversation_type} conversations: {e}")
         return {}
 
 def save_conversations(conversations: Dict[str, dict], conversation_type: str = "document"):
-    """Save conversations to JSON file based on type"""
-    file_path = MEDICAL_CONVERSATIONS_FILE if conversation_type == "medical" else DOCUMENT_CONVERSATIONS_FILE
+    """Replace all conversations of a type"""
     try:
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'w') as f:
-            json.dump({"conversations": conversations}, f, indent=2)
+        get_conversation_store(conversation_type).save_all(conversations)
     except Exception as e:
         print(f"Error saving {conversation_type} conversations: {e}")
         raise HTTPException(status_code=500, detail=f"Error saving conversations: {str(e)}")
 
+def conversation_exists(conversation_id: str, conversation_type: str = "document") -> bool:
+    """Check whether a conversation exists without loading it"""
+    return get_conversation_store(conversation_type).exists(conversation_id)
+
+def get_conversation(conversation_id: str, conversation_type: str = "document") -> Optional[dict]:
+    """Load a single conversation record"""
+    return get_conversation_store(conversation_type).get(conversation_id)
+
 class ThinkerRequest(BaseModel):
     patient_information: str
     query: str
@@ -58,103 +75,123 @@ class ThinkerRequest(BaseModel):
 def create_new_conversation(conversation_type: str = "document") -> str:
     """Create a new conversation session"""
     conversation_id = str(uuid.uuid4())
-    conversations = load_conversations(conversation_type)
-    conversations[conversation_id] = {
+    get_conversation_store(conversation_type).create(conversation_id, {
         "thread_id": None,
         "patient_context": "",
         "document_context": "",
+        "document_ref": None,  # Reference to the uploaded document in the document store
         "patient_data": None,  # Store patient object data
         "title": "Untitled Conversation",
         "created_at": time.time(),
         "last_query": "",
         "messages": [],
         "conversation_type": conversation_type
-    }
-    save_conversations(conversations, conversation_type)
+    })
     return conversation_id
 
 def get_or_create_conversation(conversation_id: Optional[str] = None, conversation_type: str = "document") -> tuple[str, dict]:
     """Get existing conversation or create new one"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id and conversation_id in conversations:
-        return conversation_id, conversations[conversation_id]
-    else:
-        new_id = create_new_conversation(conversation_type)
-        conversations = load_conversations(conversation_type)  # Reload to get the new conversation
-        return new_id, conversations[new_id]
+    if conversation_id:
+        session = get_conversation(conversation_id, conversation_type)
+        if session is not None:
+            return conversation_id, session
+    new_id = create_new_conversation(conversation_type)
+    return new_id, get_conversation(new_id, conversation_type)
 
 def update_conversation(conversation_id: str, updates: dict, conversation_type: str = "document"):
     """Update a conversation with new data"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
-        conversations[conversation_id].update(updates)
-        save_conversations(conversations, conversation_type)
+    get_conversation_store(conversation_type).update(conversation_id, updates)
 
 def add_message_to_conversation(conversation_id: str, message: dict, conversation_type: str = "document"):
     """Add a message to a conversation"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
-        if "messages" not in conversations[conversation_id]:
-            conversations[conversation_id]["messages"] = []
-        conversations[conversation_id]["messages"].append({
-            **message,
-            "timestamp": time.time()
-        })
-        save_conversations(conversations, conversation_type)
+    get_conversation_store(conversation_type).append_message(conversation_id, {
+        **message,
+        "timestamp": time.time()
+    })
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extract text from PDF file"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
-
-def extract_text_from_docx(file_content: bytes) -> str:
-    """Extract text from DOCX file"""
-    try:
-        doc = docx.Document(io.BytesIO(file_content))
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading DOCX: {str(e)}")
+async def parse_document(file_content: bytes, filename: str) -> tuple[dict, str]:
+    """Store an uploaded document by content hash and return (document reference, extracted text).
 
-def extract_text_from_txt(file_content: bytes) -> str:
-    """Extract text from TXT file"""
+    Extracted text is cached per hash, so re-uploading a document skips parsing.
+    """
     try:
-        return file_content.decode('utf-8')
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading TXT: {str(e)}")
-
-def parse_document(file: UploadFile) -> str:
-    """Parse uploaded document and extract text"""
-    file_content = file.file.read()
-    file.file.seek(0)  # Reset file pointer
-    
-    file_extension = file.filename.split('.')[-1].lower()
-    
-    if file_extension == 'pdf':
-        return extract_text_from_pdf(file_content)
-    elif file_extension in ['docx', 'doc']:
-        return extract_text_from_docx(file_content)
-    elif file_extension == 'txt':
-        return extract_text_from_txt(file_content)
+        # Oversized uploads are rejected before anything is written to disk
+        check_document_size(len(file_content))
+    except DocumentTooLargeError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    store = get_document_store()
+    digest = content_digest(file_content)
+    text = store.get_text(digest)
+    if text is None:
+        # Parser workers read the stored blob; an upload that cannot be parsed is not kept
+        stored_before = store.has_blob(digest)
+        store.put_blob(file_content)
+        try:
+            text = await extract_text_async(store.blob_path(digest), filename)
+        except BaseException as e:
+            if not stored_before:
+                store.delete_blob(digest)
+            if isinstance(e, DocumentParseError):
+                raise HTTPException(status_code=e.status_code, detail=str(e))
+            raise
+        store.put_text(digest, text)
+        store.put_chunks(digest, chunk_text(text, settings.RETRIEVAL_CHUNK_TOKENS))
     else:
-        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_extension}")
+        print(f"Document cache hit: {digest}")
 
-@router.post("/thinker")
-async def thinker(
-    file: UploadFile = File(None),
-    patient_information: str = Form(""),
-    query: str = Form(""),
-    conversation_id: str = Form(None)
-):
-    instruction = """You are a professional medical document assistant. Based on the uploaded medical document and any additional patient information provided, please extract and summarize the following four types of information. Present the result in English in the format below:
+    document_ref = {
+        "sha256": digest,
+        "filename": filename,
+        "size": len(file_content),
+        "characters": len(text)
+    }
+    return document_ref, text
+
+@lru_cache(maxsize=32)
+def load_document_index(digest: str) -> BM25Index:
+    """BM25 index over a stored document's passages, chunking it on first use if needed"""
+    store = get_document_store()
+    chunks = store.get_chunks(digest)
+    if chunks is None:
+        chunks = chunk_text(store.get_text(digest) or "", settings.RETRIEVAL_CHUNK_TOKENS)
+        store.put_chunks(digest, chunks)
+    return BM25Index(chunks)
+
+def select_document_content(document_ref: Optional[dict], document_text: str, query: str, token_budget: int) -> str:
+    """Return the document text to send with a turn, limited to token_budget.
+
+    Documents that fit the budget are sent whole; otherwise the passages
+    ranked highest for the query are sent, in document order. The budget, not
+    RETRIEVAL_TOP_K, limits how many are taken, and budget left over after the
+    matches (all of it, when nothing matches) goes to the opening passages.
+    """
+    if not document_text or estimate_tokens(document_text) <= token_budget or not document_ref:
+        return document_text
+
+    index = load_document_index(document_ref["sha256"])
+    top_k = max(settings.RETRIEVAL_TOP_K, math.ceil(token_budget / max(settings.RETRIEVAL_CHUNK_TOKENS, 1)))
+    selected = set(index.select(query, token_budget, top_k=top_k))
+    used = sum(estimate_tokens(index.passages[position]) for position in selected)
+    for position, passage in enumerate(index.passages):
+        if position in selected:
+            continue
+        cost = estimate_tokens(passage)
+        if used + cost > token_budget:
+            break
+        selected.add(position)
+        used += cost
+    passages = [f"[Passage {position + 1} of {len(index.passages)}]\n{index.passages[position]}" for position in sorted(selected)]
+    return "\n\n".join(passages)
+
+def get_document_context(session: dict) -> str:
+    """Return a conversation's document text, resolving stored document references"""
+    document_ref = session.get("document_ref")
+    if document_ref:
+        return get_document_store().get_text(document_ref["sha256"]) or ""
+    return session.get("document_context", "")
+
+DOCUMENT_INSTRUCTION = """You are a professional medical document assistant. Based on the uploaded medical document and any additional patient information provided, please extract and summarize the following four types of information. Present the result in English in the format below:
 
 **Allergies:**
 [List any allergies mentioned in the document]
@@ -170,101 +207,8 @@ async def thinker(
 
 Only include information that is directly related to the patient. If a category is not mentioned in the document, write "No relevant information." Use concise, clinical language and maintain medical terminology."""
 
-    try:
-        client = AzureOpenAI(
-            azure_endpoint=settings.CLIENT_CREDENTIAL_ENDPOINT,
-            api_key=settings.CLIENT_CREDENTIAL_KEY,
-            api_version="2024-05-01-preview"
-        )
-
-        # Get or create conversation session
-        conv_id, session = get_or_create_conversation(conversation_id, "document")
-        
-        # Create or reuse thread
-        if session["thread_id"] is None:
-            thread = client.beta.threads.create()
-            session["thread_id"] = thread.id
-            update_conversation(conv_id, {"thread_id": thread.id}, "document")
-        else:
-            thread_id = session["thread_id"]
-
-        # Parse document if uploaded
-        document_text = ""
-        if file:
-            document_text = parse_document(file)
-            session["document_context"] = document_text
-            update_conversation(conv_id, {"document_context": document_text}, "document")
-            print(f"Parsed document: {len(document_text)} characters")
-
-        # Update patient context if provided
-        if patient_information:
-            session["patient_context"] = patient_information
-            update_conversation(conv_id, {"patient_context": patient_information}, "document")
-
-        # Combine all context for the query
-        combined_content = f"Document Content:\n{session.get('document_context', '')}\n\nPatient Information:\n{session.get('patient_context', '')}\n\nCurrent Query:\n{query}"
-
-        client.beta.threads.messages.create(
-            thread_id=session["thread_id"],
-            role="user",
-            content=combined_content
-        )
-
-        run = client.beta.threads.runs.create(
-            thread_id=session["thread_id"],
-            assistant_id=settings.ASSISTANT_ID,
-            additional_instructions=instruction
-        )
-
-        while run.status not in ["completed", "failed"]:
-            print("Processing document analysis...")
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(thread_id=session["thread_id"], run_id=run.id)
-
-        if run.status == 'completed':
-            messages = client.beta.threads.messages.list(thread_id=session["thread_id"])
-            message = messages.data[0].content[0].text.value
-            print("Analysis completed successfully")
-            
-            # Update conversation with last query and response
-            update_conversation(conv_id, {
-                "last_query": query,
-                "last_response": message
-            }, "document")
-            
-            # Add messages to conversation history
-            add_message_to_conversation(conv_id, {
-                "sender": "user",
-                "content": query,
-                "type": "query"
-            }, "document")
-            add_message_to_conversation(conv_id, {
-                "sender": "assistant",
-                "content": message,
-                "type": "response"
-            }, "document")
-            
-            return JSONResponse(content={
-                "response": message,
-                "conversation_id": conv_id
-            })
-        else:
-            raise HTTPException(status_code=500, detail="Failed to get response from assistant")
-            
-    except Exception as e:
-        print(f"Error in thinker endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
-
-
-@router.post("/chat-response")
-async def chat_response(
-    request: str = Form(...),
-    conversation_id: str = Form(None)
-):
-    """Medical Assistant Chat endpoint with enhanced medical context and instructions"""
-    
-    # Enhanced medical assistant instructions with comprehensive capabilities
-    medical_instructions = """You are a comprehensive medical assistant designed to provide helpful, accurate, and safe medical information and guidance.
+# Enhanced medical assistant instructions with comprehensive capabilities
+MEDICAL_INSTRUCTIONS = """You are a comprehensive medical assistant designed to provide helpful, accurate, and safe medical information and guidance.
 
 IMPORTANT GUIDELINES:
 1. **Medical Disclaimer**: Always remind users that you are an AI assistant and cannot replace professional medical advice, diagnosis, or treatment
@@ -369,114 +313,613 @@ SPECIALIZED RESPONSES:
 
 Remember: Your primary role is to provide helpful, accurate medical information while ensuring users understand the importance of professional medical care for specific health concerns. Always err on the side of caution and safety."""
 
-    try:
-        client = AzureOpenAI(
-            azure_endpoint=settings.CLIENT_CREDENTIAL_ENDPOINT,
-            api_key=settings.CLIENT_CREDENTIAL_KEY,
-            api_version="2024-05-01-preview"
+async def ensure_thread(client: "AsyncAzureOpenAI", conv_id: str, session: dict, conversation_type: str) -> str:
+    """Return the conversation's thread id, creating the thread on first use"""
+    if session["thread_id"] is None:
+        # An extra empty thread is harmless, so creation is retried like a read
+        thread = await call_upstream("azure", "thread_create", lambda: client.beta.threads.create())
+        session["thread_id"] = thread.id
+        update_conversation(conv_id, {"thread_id": thread.id}, conversation_type)
+    return session["thread_id"]
+
+async def build_document_turn(
+    file_content: Optional[bytes],
+    filename: Optional[str],
+    patient_information: str,
+    query: str,
+    conversation_id: Optional[str]
+) -> tuple[str, dict, str]:
+    """Update the document conversation and build the user's turn. Returns (conversation id, session, turn content)."""
+    # Get or create conversation session
+    conv_id, session = get_or_create_conversation(conversation_id, "document")
+
+    # Parse document if uploaded; only a reference to the stored text is kept in the conversation
+    if file_content:
+        document_ref, document_text = await parse_document(file_content, filename)
+        session.update({"document_ref": document_ref, "document_context": ""})
+        update_conversation(conv_id, {"document_ref": document_ref, "document_context": ""}, "document")
+        print(f"Parsed document: {len(document_text)} characters")
+    elif session.get("document_context") and not session.get("document_ref"):
+        # Move legacy inline document text into the document store
+        document_text = session["document_context"]
+        document_ref = {
+            "sha256": get_document_store().put_inline_text(document_text),
+            "filename": None,
+            "size": len(document_text.encode("utf-8")),
+            "characters": len(document_text)
+        }
+        session["document_ref"] = document_ref
+        update_conversation(conv_id, {"document_ref": document_ref, "document_context": ""}, "document")
+    else:
+        document_text = get_document_context(session)
+
+    # Update patient context if provided
+    if patient_information:
+        session["patient_context"] = patient_information
+        update_conversation(conv_id, {"patient_context": patient_information}, "document")
+
+    # Send the whole document only when it fits the budget; otherwise the most relevant passages
+    if file_content:
+        token_budget = settings.RETRIEVAL_UPLOAD_TOKEN_BUDGET
+        retrieval_query = f"{query}\n{DOCUMENT_INSTRUCTION}"
+    else:
+        token_budget = settings.RETRIEVAL_TOKEN_BUDGET
+        retrieval_query = query
+    document_content = select_document_content(session.get("document_ref"), document_text, retrieval_query, token_budget)
+
+    # Combine all context for the query
+    combined_content = f"Document Content:\n{document_content}\n\nPatient Information:\n{session.get('patient_context', '')}\n\nCurrent Query:\n{query}"
+    return conv_id, session, combined_content
+
+async def build_medical_turn(request: str, conversation_id: Optional[str]) -> tuple[str, dict, str]:
+    """Get or create the medical conversation. Returns (conversation id, session, turn content)."""
+    conv_id, session = get_or_create_conversation(conversation_id, "medical")
+    return conv_id, session, request
+
+async def post_turn(
+    client: "AsyncAzureOpenAI",
+    conv_id: str,
+    session: dict,
+    content: str,
+    conversation_type: str,
+    preamble: Optional[str] = None
+) -> str:
+    """Post the user's turn (after an optional preamble message) to the conversation's thread. Returns the thread id."""
+    thread_id = await ensure_thread(client, conv_id, session, conversation_type)
+    for message in (preamble, content):
+        if message is None:
+            continue
+        await call_upstream(
+            "azure",
+            "message_create",
+            lambda: client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=message
+            ),
+            idempotent=False
+        )
+    return thread_id
+
+def medical_preamble(conversation_id: Optional[str]) -> Optional[str]:
+    """The medical instructions are posted to the thread as system context, only for new conversations"""
+    return f"System Instructions: {MEDICAL_INSTRUCTIONS}" if conversation_id is None else None
+
+def completion_messages(conv_id: str, content: str, instructions: str, conversation_type: str) -> List[dict]:
+    """Chat messages for a completions turn: instructions, the stored history within budget and the new turn"""
+    page = get_conversation_store(conversation_type).get_messages(conv_id, limit=settings.CHAT_HISTORY_MAX_MESSAGES)
+    history = page[0] if page else []
+    return build_chat_messages(instructions, history, content, settings.CHAT_HISTORY_TOKEN_BUDGET)
+
+def admit_turn(conversation_type: str, prompt_tokens: int, background: bool = False):
+    """Wait for an upstream slot for one turn; medical turns go through the interactive chat lane.
+
+    Background turns (queued jobs) run below every interactive request and wait instead of being rejected.
+    """
+    return get_upstream_scheduler().admit(
+        "chat" if conversation_type == "medical" else "document",
+        "azure",
+        prompt_tokens + (settings.CHAT_MAX_TOKENS or settings.SCHEDULER_REPLY_TOKENS),
+        priority=BACKGROUND_PRIORITY if background else None,
+        max_wait=math.inf if background else None
+    )
+
+async def reply_to_turn(
+    client: "AsyncAzureOpenAI",
+    conv_id: str,
+    session: dict,
+    content: str,
+    instructions: str,
+    conversation_type: str,
+    preamble: Optional[str] = None,
+    is_disconnected=None,
+    background: bool = False
+) -> str:
+    """Get the reply to a built turn from the configured backend"""
+    if chat_backend() == BACKEND_COMPLETIONS:
+        messages = completion_messages(conv_id, content, instructions, conversation_type)
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        async with admit_turn(conversation_type, prompt_tokens, background):
+            return await complete_chat(client, messages, is_disconnected=is_disconnected)
+
+    prompt_tokens = estimate_tokens(f"{instructions}{preamble or ''}{content}")
+    async with admit_turn(conversation_type, prompt_tokens, background):
+        thread_id = await post_turn(client, conv_id, session, content, conversation_type, preamble)
+        return await run_assistant(client, thread_id, instructions, is_disconnected=is_disconnected)
+
+async def stream_reply_to_turn(
+    client: "AsyncAzureOpenAI",
+    conv_id: str,
+    session: dict,
+    content: str,
+    instructions: str,
+    conversation_type: str,
+    preamble: Optional[str] = None,
+    is_disconnected=None
+):
+    """Yield the reply to a built turn as text deltas from the configured backend"""
+    if chat_backend() == BACKEND_COMPLETIONS:
+        messages = completion_messages(conv_id, content, instructions, conversation_type)
+        async with admit_turn(conversation_type, sum(estimate_tokens(message["content"]) for message in messages)):
+            async for delta in stream_chat_text(client, messages, is_disconnected=is_disconnected):
+                yield delta
+        return
+
+    async with admit_turn(conversation_type, estimate_tokens(f"{instructions}{preamble or ''}{content}")):
+        thread_id = await post_turn(client, conv_id, session, content, conversation_type, preamble)
+        async for delta in stream_run_text(client, thread_id, instructions, is_disconnected=is_disconnected):
+            yield delta
+
+def record_turn(conv_id: str, query: str, message: str, conversation_type: str):
+    """Persist a completed question/answer pair in the conversation history"""
+    # Update conversation with last query and response
+    update_conversation(conv_id, {
+        "last_query": query,
+        "last_response": message
+    }, conversation_type)
+    
+    # Add messages to conversation history
+    add_message_to_conversation(conv_id, {
+        "sender": "user",
+        "content": query,
+        "type": "query"
+    }, conversation_type)
+    add_message_to_conversation(conv_id, {
+        "sender": "assistant",
+        "content": message,
+        "type": "response"
+    }, conversation_type)
+
+async def run_document_turn(
+    file_content: Optional[bytes],
+    filename: Optional[str],
+    patient_information: str,
+    query: str,
+    conversation_id: Optional[str],
+    is_disconnected=None,
+    background: bool = False
+) -> tuple[str, str]:
+    """Run one document analysis turn, one at a time per conversation. Returns (conversation id, reply)."""
+    client = get_azure_client()
+    async with conversation_locks.hold(conversation_id):
+        conv_id, session, content = await build_document_turn(file_content, filename, patient_information, query, conversation_id)
+
+        print("Processing document analysis...")
+        message = await reply_to_turn(
+            client,
+            conv_id,
+            session,
+            content,
+            DOCUMENT_INSTRUCTION,
+            "document",
+            is_disconnected=is_disconnected,
+            background=background
         )
+        print("Analysis completed successfully")
+
+        record_turn(conv_id, query, message, "document")
+    return conv_id, message
+
+async def run_medical_turn(request: str, conversation_id: Optional[str], is_disconnected=None) -> tuple[str, str]:
+    """Run one medical chat turn, one at a time per conversation. Returns (conversation id, reply)."""
+    client = get_azure_client()
+    async with conversation_locks.hold(conversation_id):
+        conv_id, session, content = await build_medical_turn(request, conversation_id)
+
+        message = await reply_to_turn(
+            client,
+            conv_id,
+            session,
+            content,
+            MEDICAL_INSTRUCTIONS,
+            "medical",
+            preamble=medical_preamble(conversation_id),
+            is_disconnected=is_disconnected
+        )
+
+        record_turn(conv_id, request, message, "medical")
+    return conv_id, message
+
+async def stream_turn(
+    http_request: Request,
+    conversation_id: Optional[str],
+    query: str,
+    build,
+    instructions: str,
+    conversation_type: str,
+    preamble: Optional[str] = None,
+    speech: Optional[SpeechPipeline] = None
+):
+    """Relay a reply's text deltas as server-sent events and persist the reply once it completes.
+
+    build() updates the conversation and returns (conversation id, session, turn content);
+    it runs inside the stream so the conversation lock is held for the whole turn. With a
+    speech pipeline, each sentence is also sent as an audio event as soon as it is synthesized.
+    """
+    client = get_azure_client()
+    try:
+        async with conversation_locks.hold(conversation_id):
+            conv_id, session, content = await build()
+            yield format_sse({"conversation_id": conv_id}, event="conversation")
+            parts = []
+            async for delta in stream_reply_to_turn(
+                client, conv_id, session, content, instructions, conversation_type,
+                preamble=preamble, is_disconnected=http_request.is_disconnected
+            ):
+                parts.append(delta)
+                yield format_sse({"delta": delta})
+                if speech is not None:
+                    speech.feed(delta)
+                    for clip in speech.ready():
+                        event, data = clip.event()
+                        yield format_sse(data, event=event)
+            message = "".join(parts)
+            record_turn(conv_id, query, message, conversation_type)
+        if speech is not None:
+            speech.finish()
+            async for clip in speech.drain():
+                event, data = clip.event()
+                yield format_sse(data, event=event)
+        yield format_sse({"response": message, "conversation_id": conv_id}, event="done")
+    except ClientDisconnectedError:
+        print(f"Client disconnected, {conversation_type} run cancelled")
+    except UpstreamBusyError as e:
+        yield format_sse({"detail": str(e), "status_code": 503, "retry_after": e.retry_after_header}, event="error")
+    except HTTPException as e:
+        yield format_sse({"detail": e.detail, "status_code": e.status_code}, event="error")
+    except Exception as e:
+        print(f"Error streaming {conversation_type} response: {str(e)}")
+        yield format_sse({"detail": str(e)}, event="error")
+    finally:
+        if speech is not None:
+            speech.cancel()
 
-        # Get or create conversation session
-        conv_id, session = get_or_create_conversation(conversation_id, "medical")
+@router.post("/thinker")
+async def thinker(
+    http_request: Request,
+    file: UploadFile = File(None),
+    patient_information: str = Form(""),
+    query: str = Form(""),
+    conversation_id: str = Form(None)
+):
+    try:
+        file_content = await file.read() if file else None
+        filename = file.filename if file else None
+
+        # Identical concurrent submissions (double clicks, two tabs) share one upstream run
+        flight_key = turn_flight_key(
+            "document",
+            conversation_id,
+            query,
+            patient_information,
+            content_digest(file_content) if file_content else None
+        )
+        conv_id, message = await turn_flights.do(
+            flight_key,
+            lambda is_disconnected: run_document_turn(
+                file_content, filename, patient_information, query, conversation_id, is_disconnected
+            ),
+            is_disconnected=http_request.is_disconnected
+        )
         
-        # Create or reuse thread
-        if session["thread_id"] is None:
-            thread = client.beta.threads.create()
-            session["thread_id"] = thread.id
-            update_conversation(conv_id, {"thread_id": thread.id}, "medical")
-        else:
-            thread_id = session["thread_id"]
-
-        # Add the medical instructions as system context (only for new conversations)
-        if conversation_id is None:
-            client.beta.threads.messages.create(
-                thread_id=session["thread_id"],
-                role="user",
-                content=f"System Instructions: {medical_instructions}"
-            )
-
-        # Add the user's question
-        client.beta.threads.messages.create(
-            thread_id=session["thread_id"],
-            role="user",
-            content=request
+        return JSONResponse(content={
+            "response": message,
+            "conversation_id": conv_id
+        })
+            
+    except HTTPException:
+        raise
+    except ClientDisconnectedError:
+        print("Client disconnected, document analysis run cancelled")
+        return Response(status_code=499)
+    except UpstreamBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": e.retry_after_header})
+    except RunTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RunFailedError as e:
+        print(f"Error in thinker endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to get response from assistant")
+    except Exception as e:
+        print(f"Error in thinker endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@router.post("/thinker/stream")
+async def thinker_stream(
+    http_request: Request,
+    file: UploadFile = File(None),
+    patient_information: str = Form(""),
+    query: str = Form(""),
+    conversation_id: str = Form(None)
+):
+    """Document analysis streamed as server-sent events (conversation, delta..., done | error)"""
+    # Read the upload now; the file is closed once this handler returns
+    file_content = await file.read() if file else None
+    filename = file.filename if file else None
+
+    async def build():
+        return await build_document_turn(file_content, filename, patient_information, query, conversation_id)
+
+    return StreamingResponse(
+        stream_turn(http_request, conversation_id, query, build, DOCUMENT_INSTRUCTION, "document"),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+async def run_document_job(payload: dict) -> dict:
+    """Job handler for queued /thinker analyses; the upload is read back from the document store"""
+    file_content = filename = None
+    document = payload.get("document")
+    if document:
+        file_content = get_document_store().get_blob(document["sha256"])
+        if file_content is None:
+            raise HTTPException(status_code=410, detail="The uploaded document is no longer available")
+        filename = document["filename"]
+    try:
+        conv_id, message = await run_document_turn(
+            file_content, filename, payload["patient_information"], payload["query"], payload["conversation_id"],
+            background=True
         )
+    except RunTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RunFailedError:
+        raise HTTPException(status_code=500, detail="Failed to get response from assistant")
+    return {"response": message, "conversation_id": conv_id}
+
+register_job_handler("document", run_document_job)
+
+def job_response(job: dict) -> dict:
+    """Public view of a job; the reply is included once it has completed"""
+    result = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "conversation_id": (job["result"] or {}).get("conversation_id") or job["payload"].get("conversation_id"),
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "queue_position": get_job_queue().store.queue_position(job)
+    }
+    if job["status"] == COMPLETED:
+        result["response"] = job["result"]["response"]
+    if job["error"]:
+        result["error"] = job["error"]
+    return result
 
-        run = client.beta.threads.runs.create(
-            thread_id=session["thread_id"],
-            assistant_id=settings.ASSISTANT_ID,
-            additional_instructions=medical_instructions
+def get_job_or_404(job_id: str) -> dict:
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/thinker/jobs", status_code=202)
+async def submit_thinker_job(
+    file: UploadFile = File(None),
+    patient_information: str = Form(""),
+    query: str = Form(""),
+    conversation_id: str = Form(None)
+):
+    """Queue a document analysis and return its job id without waiting for the reply.
+
+    The upload is stored by content hash and the conversation is created up
+    front, so the reply lands in the returned conversation once the job
+    completes. Poll GET /thinker/jobs/{job_id} or subscribe to its events.
+    """
+    payload = {"patient_information": patient_information, "query": query, "conversation_id": conversation_id}
+    if file:
+        file_content = await file.read()
+        try:
+            check_document_size(len(file_content))
+        except DocumentTooLargeError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        payload["document"] = {"sha256": get_document_store().put_blob(file_content), "filename": file.filename}
+    if not conversation_id or not conversation_exists(conversation_id, "document"):
+        payload["conversation_id"] = create_new_conversation("document")
+
+    try:
+        job = get_job_queue().submit("document", payload)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(max(1, int(settings.JOB_POLL_INTERVAL)))}
         )
+    return JSONResponse(
+        status_code=202,
+        content=job_response(job),
+        headers={"Location": f"/thinker/jobs/{job['id']}"}
+    )
+
+@router.get("/thinker/jobs/{job_id}")
+async def get_thinker_job(job_id: str):
+    """Status of a queued document analysis, with the reply once completed"""
+    return job_response(get_job_or_404(job_id))
+
+@router.delete("/thinker/jobs/{job_id}")
+async def cancel_thinker_job(job_id: str):
+    """Cancel a queued or running document analysis"""
+    job = get_job_or_404(job_id)
+    if not get_job_queue().cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is already {job['status']}")
+    return {"message": "Job cancelled successfully"}
+
+@router.get("/thinker/jobs/{job_id}/events")
+async def thinker_job_events(http_request: Request, job_id: str):
+    """Job status as server-sent events: status on every change, then done (completed) or error"""
+    get_job_or_404(job_id)
+    queue = get_job_queue()
+
+    async def events():
+        last = None
+        while True:
+            job = queue.get(job_id)
+            if job is None:
+                yield format_sse({"detail": "Job not found", "status_code": 404}, event="error")
+                return
+            view = job_response(job)
+            if job["status"] in FINISHED_STATUSES:
+                yield format_sse(view, event="done" if job["status"] == COMPLETED else "error")
+                return
+            state = (view["status"], view["queue_position"])
+            if state != last:
+                last = state
+                yield format_sse(view, event="status")
+            await queue.wait_for_change(settings.JOB_POLL_INTERVAL)
+            if await http_request.is_disconnected():
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
-        while run.status not in ["completed", "failed"]:
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(thread_id=session["thread_id"], run_id=run.id)
 
-        if run.status == 'completed':
-            messages = client.beta.threads.messages.list(thread_id=session["thread_id"])
-            message = messages.data[0].content[0].text.value
-            
-            # Update conversation with last query and response
-            update_conversation(conv_id, {
-                "last_query": request,
-                "last_response": message
-            }, "medical")
-            
-            # Add messages to conversation history
-            add_message_to_conversation(conv_id, {
-                "sender": "user",
-                "content": request,
-                "type": "query"
-            }, "medical")
-            add_message_to_conversation(conv_id, {
-                "sender": "assistant",
-                "content": message,
-                "type": "response"
-            }, "medical")
-            
-            # Return clean text without JSON wrapping
-            return JSONResponse(content={
-                "response": message,
-                "conversation_id": conv_id
-            })
-        else:
-            raise HTTPException(status_code=500, detail="Failed to get response from assistant")
+@router.post("/chat-response")
+async def chat_response(
+    http_request: Request,
+    request: str = Form(...),
+    conversation_id: str = Form(None)
+):
+    """Medical Assistant Chat endpoint with enhanced medical context and instructions"""
+    try:
+        # Identical concurrent submissions share one upstream run
+        conv_id, message = await turn_flights.do(
+            turn_flight_key("medical", conversation_id, request),
+            lambda is_disconnected: run_medical_turn(request, conversation_id, is_disconnected),
+            is_disconnected=http_request.is_disconnected
+        )
+        
+        # Return clean text without JSON wrapping
+        return JSONResponse(content={
+            "response": message,
+            "conversation_id": conv_id
+        })
             
+    except HTTPException:
+        raise
+    except ClientDisconnectedError:
+        return Response(status_code=499)
+    except UpstreamBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": e.retry_after_header})
+    except RunTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RunFailedError:
+        raise HTTPException(status_code=500, detail="Failed to get response from assistant")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@router.post("/chat-response/stream")
+async def chat_response_stream(
+    http_request: Request,
+    request: str = Form(...),
+    conversation_id: str = Form(None)
+):
+    """Medical Assistant Chat streamed as server-sent events (conversation, delta..., done | error)"""
+    async def build():
+        return await build_medical_turn(request, conversation_id)
+
+    return StreamingResponse(
+        stream_turn(
+            http_request, conversation_id, request, build, MEDICAL_INSTRUCTIONS, "medical",
+            preamble=medical_preamble(conversation_id)
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@router.post("/chat-response/speech")
+async def chat_response_speech(
+    http_request: Request,
+    request: str = Form(...),
+    conversation_id: str = Form(None),
+    voice: str = Form(None)
+):
+    """Medical Assistant Chat streamed with speech: the /chat-response/stream events plus an
+    audio event per sentence (base64 clip), sent as soon as that sentence is synthesized"""
+    try:
+        voice = check_voice(voice)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    speech = SpeechPipeline(get_speech_synthesizer(), voice=voice)
+
+    async def build():
+        return await build_medical_turn(request, conversation_id)
+
+    return StreamingResponse(
+        stream_turn(
+            http_request, conversation_id, request, build, MEDICAL_INSTRUCTIONS, "medical",
+            preamble=medical_preamble(conversation_id), speech=speech
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+def cached_read(http_request: Request, key: tuple, conversation_type: str, build) -> Response:
+    """Serve a conversation read from the response cache until the conversation store changes"""
+    store = get_conversation_store(conversation_type)
+    cached = get_response_cache().respond(key, store.generation(), lambda: build(store), http_request.headers)
+    return Response(cached.body, status_code=cached.status_code, headers=cached.headers, media_type=cached.media_type)
 
 @router.get("/conversations")
-async def list_conversations(conversation_type: str = Query("document")):
-    """List all active conversations with summary info"""
-    conversations = load_conversations(conversation_type)
-    result = []
-    for conv_id, session in conversations.items():
-        result.append({
-            "conversation_id": conv_id,
-            "created_at": session.get("created_at"),
-            "title": session.get("title", "Untitled Conversation"),
-            "last_query": session.get("last_query", ""),
-            "message_count": len(session.get("messages", [])),
-            "conversation_type": session.get("conversation_type", conversation_type)
-        })
-    return result
+async def list_conversations(
+    http_request: Request,
+    conversation_type: str = Query("document"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None)
+):
+    """List conversation summaries, most recently active first.
+
+    Without limit every summary is returned. With limit, the cursor for the
+    next page (if any) is sent in the X-Next-Cursor header.
+    """
+    def build(store):
+        summaries, next_cursor = store.list_summaries(limit=limit, cursor=cursor)
+        return summaries, {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+    try:
+        return cached_read(http_request, ("conversations", conversation_type, limit, cursor), conversation_type, build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/medical-conversations")
-async def list_medical_conversations():
+async def list_medical_conversations(
+    http_request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None)
+):
     """List all medical assistant conversations"""
-    return await list_conversations("medical")
+    return await list_conversations(http_request, "medical", limit, cursor)
 
 @router.get("/document-conversations")
-async def list_document_conversations():
+async def list_document_conversations(
+    http_request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None)
+):
     """List all document analysis conversations"""
-    return await list_conversations("document")
+    return await list_conversations(http_request, "document", limit, cursor)
 
 @router.post("/conversation/{conversation_id}/rename")
 async def rename_conversation(conversation_id: str, title: str = Query(...), conversation_type: str = Query("document")):
     """Rename a conversation"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
+    if conversation_exists(conversation_id, conversation_type):
         update_conversation(conversation_id, {"title": title}, conversation_type)
         return {"message": "Conversation renamed successfully"}
     else:
@@ -485,28 +928,50 @@ async def rename_conversation(conversation_id: str, title: str = Query(...), con
 @router.delete("/conversation/{conversation_id}")
 async def delete_conversation(conversation_id: str, conversation_type: str = Query("document")):
     """Delete a conversation session"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
-        del conversations[conversation_id]
-        save_conversations(conversations, conversation_type)
+    if get_conversation_store(conversation_type).delete(conversation_id):
         return {"message": "Conversation deleted successfully"}
     else:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
 @router.get("/conversation/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str, conversation_type: str = Query("document")):
-    """Get all messages for a specific conversation"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
-        return {
+async def get_conversation_messages(
+    http_request: Request,
+    conversation_id: str,
+    conversation_type: str = Query("document"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    before: Optional[int] = Query(None, description="Return messages older than this message_id"),
+    after: Optional[int] = Query(None, description="Return messages newer than this message_id"),
+    since: Optional[float] = Query(None, description="Return messages with a later timestamp (epoch seconds)"),
+    include_context: bool = Query(False)
+):
+    """Get a page of messages for a conversation, oldest first.
+
+    Without paging parameters every message is returned. With limit alone the
+    newest page is returned; has_more tells whether older (or, with after or
+    since, newer) messages remain. Patient and document context are only
+    included with include_context=true. An unchanged page answers
+    If-None-Match with 304.
+    """
+    def build(store):
+        page = store.get_messages(conversation_id, limit=limit, before=before, after=after, since=since)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+
+        messages, has_more = page
+        result = {
             "conversation_id": conversation_id,
-            "messages": conversations[conversation_id].get("messages", []),
-            "patient_context": conversations[conversation_id].get("patient_context", ""),
-            "document_context": conversations[conversation_id].get("document_context", ""),
-            "conversation_type": conversations[conversation_id].get("conversation_type", conversation_type)
+            "messages": messages,
+            "has_more": has_more,
+            "conversation_type": conversation_type
         }
-    else:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+        if include_context:
+            session = store.get_record(conversation_id) or {}
+            result["patient_context"] = session.get("patient_context", "")
+            result["document_context"] = get_document_context(session)
+        return result, {}
+
+    key = ("messages", conversation_type, conversation_id, limit, before, after, since, include_context)
+    return cached_read(http_request, key, conversation_type, build)
 
 @router.post("/new-conversation")
 async def new_conversation(conversation_type: str = Query("document")):
@@ -527,30 +992,30 @@ async def new_document_conversation():
 @router.post("/conversation/{conversation_id}/save-patient")
 async def save_patient_data(conversation_id: str, patient_data: dict, conversation_type: str = Query("document")):
     """Save patient data to a conversation"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
+    if conversation_exists(conversation_id, conversation_type):
         update_conversation(conversation_id, {"patient_data": patient_data}, conversation_type)
         return {"message": "Patient data saved successfully"}
     else:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
 @router.get("/conversation/{conversation_id}/patient-data")
-async def get_patient_data(conversation_id: str, conversation_type: str = Query("document")):
+async def get_patient_data(http_request: Request, conversation_id: str, conversation_type: str = Query("document")):
     """Get patient data from a conversation"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
+    def build(store):
+        session = store.get_record(conversation_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Conversation not found")
         return {
-            "patient_data": conversations[conversation_id].get("patient_data"),
-            "patient_context": conversations[conversation_id].get("patient_context", "")
-        }
-    else:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+            "patient_data": session.get("patient_data"),
+            "patient_context": session.get("patient_context", "")
+        }, {}
+
+    return cached_read(http_request, ("patient-data", conversation_type, conversation_id), conversation_type, build)
 
 @router.post("/conversation/{conversation_id}/save-message")
 async def save_message(conversation_id: str, message_data: dict, conversation_type: str = Query("document")):
     """Save a single message to a conversation"""
-    conversations = load_conversations(conversation_type)
-    if conversation_id in conversations:
+    if conversation_exists(conversation_id, conversation_type):
         add_message_to_conversation(conversation_id, message_data, conversation_type)
         return {"message": "Message saved successfully"}
     else:
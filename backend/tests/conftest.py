@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Settings require credentials, but no test calls a real upstream. Storage
+# defaults point at a throwaway directory so nothing touches backend/data.
+_data_dir = tempfile.mkdtemp(prefix="backend-tests-")
+for name, value in {
+    "AZURE_OPENAI_ENDPOINT": "http://127.0.0.1:9",
+    "AZURE_OPENAI_API_KEY": "test",
+    "ASSISTANT_ID": "asst_test",
+    "OPENAI_API_KEY": "test",
+    "CONVERSATION_DB_FILE": os.path.join(_data_dir, "conversations.db"),
+    "MEDICAL_CONVERSATIONS_FILE": os.path.join(_data_dir, "medical_conversations.json"),
+    "DOCUMENT_CONVERSATIONS_FILE": os.path.join(_data_dir, "document_conversations.json"),
+    "PATIENT_DB_FILE": os.path.join(_data_dir, "patients.db"),
+    "PATIENTS_FILE": os.path.join(_data_dir, "patients.json"),
+    "JOB_DB_FILE": os.path.join(_data_dir, "jobs.db"),
+    "DOCUMENT_STORE_DIR": os.path.join(_data_dir, "documents"),
+    "ANALYSIS_CACHE_DIR": os.path.join(_data_dir, "cache", "analysis"),
+    "SPEECH_CACHE_DIR": os.path.join(_data_dir, "cache", "speech"),
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from openai import AsyncAzureOpenAI
+
+from benchmarks import fake_upstream
+from core import resilience
+from core.assistants import ClientDisconnectedError, RunFailedError, RunTimeoutError, run_assistant, wait_for_run
+from core.clients import AZURE_API_VERSION
+from core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def fast_fake_upstream(monkeypatch):
+    """A quick, fault-free fake upstream with fresh state and closed circuits"""
+    monkeypatch.setattr(fake_upstream, "threads", {})
+    monkeypatch.setattr(fake_upstream, "runs", {})
+    for name, value in {
+        "run_latency": 0.3,
+        "request_latency": 0.0,
+        "reply_words": 5,
+        "error_rate": 0.0,
+        "slow_rate": 0.0,
+        "run_failure_rate": 0.0,
+        "requires_action_rate": 0.0,
+    }.items():
+        monkeypatch.setattr(fake_upstream.config, name, value)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(settings, "RUN_POLL_INITIAL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "RUN_POLL_BACKOFF", 2.0)
+    monkeypatch.setattr(settings, "RUN_POLL_MAX_INTERVAL", 0.08)
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_BASE_DELAY", 0.01)
+
+
+def fake_client() -> AsyncAzureOpenAI:
+    """An Azure client whose requests are served in-process by the fake upstream app"""
+    return AsyncAzureOpenAI(
+        azure_endpoint="http://fake-upstream",
+        api_key="test",
+        api_version=AZURE_API_VERSION,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_upstream.app)),
+        max_retries=0,
+    )
+
+
+def run_with_client(scenario):
+    async def main():
+        client = fake_client()
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+async def start_run(client):
+    thread = await client.beta.threads.create()
+    await client.beta.threads.messages.create(thread_id=thread.id, role="user", content="How is the knee?")
+    run = await client.beta.threads.runs.create(thread_id=thread.id, assistant_id="asst_test")
+    return thread.id, run
+
+
+def record_polls(client, monkeypatch) -> list:
+    """Times at which the run is retrieved"""
+    polls = []
+    runs = client.beta.threads.runs
+    retrieve = runs.retrieve
+
+    async def timed_retrieve(*args, **kwargs):
+        polls.append(time.monotonic())
+        return await retrieve(*args, **kwargs)
+
+    monkeypatch.setattr(runs, "retrieve", timed_retrieve)
+    return polls
+
+
+def test_polling_backs_off_up_to_the_maximum_interval(monkeypatch):
+    async def scenario(client):
+        polls = record_polls(client, monkeypatch)
+        thread_id, run = await start_run(client)
+        run = await wait_for_run(client, thread_id, run, timeout=5)
+        return run, polls
+
+    run, polls = run_with_client(scenario)
+    assert run.status == "completed"
+    gaps = [later - earlier for earlier, later in zip(polls, polls[1:])]
+    # 0.01, 0.02, 0.04, then 0.08 until the 0.3s run is done; fixed 10ms polling would take ~30
+    assert 4 <= len(polls) <= 9
+    assert gaps[0] < gaps[2]
+    assert max(gaps) < 0.08 + 0.05
+
+
+def test_run_assistant_returns_the_reply():
+    async def scenario(client):
+        thread = await client.beta.threads.create()
+        await client.beta.threads.messages.create(thread_id=thread.id, role="user", content="How is the knee?")
+        return await run_assistant(client, thread.id, "Be brief", timeout=5)
+
+    reply = run_with_client(scenario)
+    assert reply == fake_upstream.reply_text()
+
+
+def test_timeout_cancels_the_run(monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "run_latency", 5.0)
+
+    async def scenario(client):
+        thread_id, run = await start_run(client)
+        with pytest.raises(RunTimeoutError):
+            await wait_for_run(client, thread_id, run, timeout=0.1)
+        return run.id
+
+    run_id = run_with_client(scenario)
+    assert fake_upstream.runs[run_id]["status"] == "cancelled"
+
+
+def test_client_disconnect_cancels_the_run(monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "run_latency", 5.0)
+
+    async def scenario(client):
+        thread_id, run = await start_run(client)
+        checks = 0
+
+        async def is_disconnected():
+            nonlocal checks
+            checks += 1
+            return checks > 2
+
+        with pytest.raises(ClientDisconnectedError):
+            await wait_for_run(client, thread_id, run, timeout=5, is_disconnected=is_disconnected)
+        return run.id
+
+    run_id = run_with_client(scenario)
+    assert fake_upstream.runs[run_id]["status"] == "cancelled"
+
+
+def test_cancelling_the_waiting_task_cancels_the_run(monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "run_latency", 5.0)
+
+    async def scenario(client):
+        thread_id, run = await start_run(client)
+        waiting = asyncio.create_task(wait_for_run(client, thread_id, run, timeout=5))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return run.id
+
+    run_id = run_with_client(scenario)
+    assert fake_upstream.runs[run_id]["status"] == "cancelled"
+
+
+def test_requires_action_is_cancelled_and_reported(monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "requires_action_rate", 1.0)
+    monkeypatch.setattr(fake_upstream.config, "run_latency", 0.05)
+
+    async def scenario(client):
+        thread = await client.beta.threads.create()
+        await client.beta.threads.messages.create(thread_id=thread.id, role="user", content="Look it up")
+        with pytest.raises(RunFailedError, match="tool calls"):
+            await run_assistant(client, thread.id, "Be brief", timeout=5)
+
+    run_with_client(scenario)
+    assert [run["status"] for run in fake_upstream.runs.values()] == ["cancelled"]
@@ -0,0 +1,205 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from openai import AsyncAzureOpenAI
+
+from benchmarks import fake_upstream
+from core import resilience
+from core.clients import AZURE_API_VERSION
+from core.coalescing import KeyedLocks, SingleFlight
+from core.config import settings
+from routers import thinker
+
+
+class Upstream:
+    """Counts calls and lets the test decide when they finish"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = False
+        self.release = asyncio.Event()
+
+    async def __call__(self, *args, **kwargs):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return f"reply {self.calls}"
+
+
+def test_concurrent_calls_with_one_key_share_one_execution():
+    async def scenario():
+        flights, upstream = SingleFlight(), Upstream()
+        waiters = [asyncio.create_task(flights.do("knee", upstream)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert flights.in_flight("knee")
+        upstream.release.set()
+        results = await asyncio.gather(*waiters)
+        assert not flights.in_flight("knee")
+        # A later call starts a new execution
+        return results, upstream.calls, await flights.do("knee", upstream)
+
+    assert asyncio.run(scenario()) == (["reply 1"] * 3, 1, "reply 2")
+
+
+def test_different_and_none_keys_are_not_coalesced():
+    async def scenario():
+        flights, upstream = SingleFlight(), Upstream()
+        waiters = [asyncio.create_task(flights.do(key, upstream)) for key in ("knee", "hip", None, None)]
+        await asyncio.sleep(0.01)
+        upstream.release.set()
+        await asyncio.gather(*waiters)
+        return upstream.calls, flights._flights
+
+    assert asyncio.run(scenario()) == (4, {})
+
+
+def test_a_shared_failure_reaches_every_waiter():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def fail(is_disconnected):
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+
+        return await asyncio.gather(*(flights.do("knee", fail) for _ in range(2)), return_exceptions=True)
+
+    assert [str(error) for error in asyncio.run(scenario())] == ["upstream down"] * 2
+
+
+def test_the_shared_call_is_cancelled_only_when_every_waiter_is():
+    async def scenario():
+        flights, upstream = SingleFlight(), Upstream()
+        first = asyncio.create_task(flights.do("knee", upstream))
+        second = asyncio.create_task(flights.do("knee", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        still_running = flights.in_flight("knee")
+        second.cancel()
+        await asyncio.sleep(0.01)
+        return first.cancelled(), still_running, second.cancelled(), flights.in_flight("knee"), upstream.cancelled
+
+    assert asyncio.run(scenario()) == (True, True, True, False, True)
+
+
+def test_disconnect_is_reported_once_every_client_has_gone():
+    async def scenario():
+        flights = SingleFlight()
+        gone = {"a": False, "b": False}
+        checks = []
+
+        async def run(is_disconnected):
+            for _ in range(3):
+                checks.append(await is_disconnected())
+                await asyncio.sleep(0.02)
+                gone["a"] = True
+            gone["b"] = True
+            return await is_disconnected()
+
+        async def client(name):
+            return gone[name]
+
+        return checks, await asyncio.gather(
+            flights.do("knee", run, lambda: client("a")),
+            flights.do("knee", run, lambda: client("b")),
+        )
+
+    checks, results = asyncio.run(scenario())
+    assert checks == [False, False, False] and results == [True, True]
+
+
+def test_keyed_locks_serialize_per_key_and_are_dropped_when_free():
+    async def scenario():
+        locks, order = KeyedLocks(), []
+
+        async def turn(key, name):
+            async with locks.hold(key):
+                order.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                order.append(f"{name} end")
+
+        await asyncio.gather(turn("c1", "a"), turn("c1", "b"), turn("c2", "c"))
+        serialized = order.index("a end") < order.index("b start")
+        overlapped = order.index("c start") < order.index("a end")
+
+        order.clear()
+        await asyncio.gather(turn(None, "a"), turn(None, "b"))
+        return serialized, overlapped, order[:2], locks._locks, locks._users
+
+    assert asyncio.run(scenario()) == (True, True, ["a start", "b start"], {}, {})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Route the Azure client to a fresh fake upstream whose runs overlap"""
+    monkeypatch.setattr(fake_upstream, "threads", {})
+    monkeypatch.setattr(fake_upstream, "runs", {})
+    for name, value in {
+        "run_latency": 0.3,
+        "request_latency": 0.0,
+        "reply_words": 5,
+        "error_rate": 0.0,
+        "slow_rate": 0.0,
+        "run_failure_rate": 0.0,
+        "requires_action_rate": 0.0,
+    }.items():
+        monkeypatch.setattr(fake_upstream.config, name, value)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(settings, "CHAT_BACKEND", "assistants")
+    monkeypatch.setattr(thinker, "get_azure_client", lambda: AsyncAzureOpenAI(
+        azure_endpoint="http://fake-upstream",
+        api_key="test",
+        api_version=AZURE_API_VERSION,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_upstream.app)),
+        max_retries=0,
+    ))
+    return fake_upstream
+
+
+app = FastAPI()
+app.include_router(thinker.router)
+
+
+def post_concurrently(path: str, forms: list) -> list:
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://backend") as client:
+            responses = await asyncio.gather(*(client.post(path, data=form) for form in forms))
+        return [(response.status_code, response.json()) for response in responses]
+
+    return asyncio.run(scenario())
+
+
+def test_identical_turns_on_one_conversation_share_a_run(upstream):
+    conversation_id = thinker.create_new_conversation("medical")
+    results = post_concurrently("/chat-response", [
+        {"request": "My knee hurts", "conversation_id": conversation_id},
+        {"request": "  my KNEE hurts ", "conversation_id": conversation_id},
+    ])
+    assert [status for status, _ in results] == [200, 200]
+    assert results[0][1] == results[1][1]
+    assert len(upstream.runs) == 1
+
+
+def test_anonymous_turns_are_never_shared(upstream):
+    results = post_concurrently("/chat-response", [{"request": "My knee hurts"}] * 2)
+    assert [status for status, _ in results] == [200, 200]
+    assert results[0][1]["conversation_id"] != results[1][1]["conversation_id"]
+    assert len(upstream.runs) == 2
+
+    results = post_concurrently("/thinker", [{"query": "Summarize", "patient_information": "Knee pain"}] * 2)
+    assert results[0][1]["conversation_id"] != results[1][1]["conversation_id"]
+    assert len(upstream.runs) == 4
+
+
+def test_turn_flight_keys():
+    assert thinker.turn_flight_key("medical", None, "My knee hurts") is None
+    assert thinker.turn_flight_key("medical", "", "My knee hurts") is None
+    assert thinker.turn_flight_key("medical", "c1", " My Knee hurts\n") == ("medical", "c1", "my knee hurts")
+    assert thinker.turn_flight_key("document", "c1", "Summarize", "Knee pain", None) == (
+        "document", "c1", "summarize", "Knee pain", None
+    )
@@ -0,0 +1,184 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from openai import AsyncAzureOpenAI
+
+from benchmarks import fake_upstream
+from core import resilience
+from core.assistants import ClientDisconnectedError, RunTimeoutError
+from core.clients import AZURE_API_VERSION
+from core.completions import build_chat_messages, chat_backend, complete_chat, stream_chat_text, trim_history
+from core.config import settings
+from core.retrieval import estimate_tokens
+
+
+def turn(sender: str, content: str) -> dict:
+    return {"sender": sender, "content": content, "timestamp": "2024-01-01T00:00:00"}
+
+
+# Every message is 40 characters, 11 estimated tokens
+HISTORY = [
+    turn("user", "Q1 " + "a" * 37),
+    turn("assistant", "A1 " + "b" * 37),
+    turn("user", "Q2 " + "c" * 37),
+    turn("assistant", "A2 " + "d" * 37),
+    turn("user", "Q3 " + "e" * 37),
+    turn("assistant", "A3 " + "f" * 37),
+]
+
+
+def labels(messages: list) -> list:
+    return [message["content"][:2] for message in messages]
+
+
+def test_history_is_replayed_as_chat_roles():
+    history = [turn("user", "My knee hurts"), turn("system", "note"), turn("assistant", ""), turn("assistant", "Rest it")]
+    assert trim_history(history, 1000) == [
+        {"role": "user", "content": "My knee hurts"},
+        {"role": "assistant", "content": "Rest it"},
+    ]
+
+
+def test_the_oldest_turns_are_dropped_to_fit_the_budget():
+    assert estimate_tokens(HISTORY[0]["content"]) == 11
+    assert labels(trim_history(HISTORY, 66)) == ["Q1", "A1", "Q2", "A2", "Q3", "A3"]
+    assert labels(trim_history(HISTORY, 44)) == ["Q2", "A2", "Q3", "A3"]
+    # Room for five messages still drops Q1's answer rather than start with it
+    assert labels(trim_history(HISTORY, 60)) == ["Q2", "A2", "Q3", "A3"]
+    assert trim_history(HISTORY, 10) == []
+
+
+def test_chat_messages_keep_the_instructions_and_the_new_turn_whatever_the_budget():
+    messages = build_chat_messages("You are a medical assistant.", HISTORY, "Is swelling normal?", 22)
+    assert messages[0] == {"role": "system", "content": "You are a medical assistant."}
+    assert labels(messages[1:-1]) == ["Q3", "A3"]
+    assert messages[-1] == {"role": "user", "content": "Is swelling normal?"}
+    assert build_chat_messages("Instructions", HISTORY, "Hello", 0) == [
+        {"role": "system", "content": "Instructions"},
+        {"role": "user", "content": "Hello"},
+    ]
+
+
+def test_chat_backend_setting(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_BACKEND", " Completions ")
+    assert chat_backend() == "completions"
+    monkeypatch.setattr(settings, "CHAT_BACKEND", "threads")
+    with pytest.raises(ValueError):
+        chat_backend()
+
+
+class RecordingUpstream:
+    """The fake upstream app, recording the JSON body of every chat completion request"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith("/chat/completions"):
+            return await fake_upstream.app(scope, receive, send)
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        self.requests.append((scope["path"], json.loads(body)))
+
+        replayed = []
+
+        async def replay():
+            # The body once, then whatever the client sends next (a disconnect)
+            if replayed:
+                return await receive()
+            replayed.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await fake_upstream.app(scope, replay, send)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "reply_words", 12)
+    monkeypatch.setattr(fake_upstream.config, "token_interval", 0.0)
+    monkeypatch.setattr(fake_upstream.config, "error_rate", 0.0)
+    monkeypatch.setattr(fake_upstream.config, "slow_rate", 0.0)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    return RecordingUpstream()
+
+
+def run_with_client(upstream: RecordingUpstream, scenario):
+    async def main():
+        client = AsyncAzureOpenAI(
+            azure_endpoint="http://fake-upstream",
+            api_key="test",
+            api_version=AZURE_API_VERSION,
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream)),
+            max_retries=0,
+        )
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+MESSAGES = [{"role": "system", "content": "Instructions"}, {"role": "user", "content": "My knee hurts"}]
+
+
+def test_replies_stream_word_by_word_from_the_deployment(upstream, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_DEPLOYMENT", "chat-deployment")
+    monkeypatch.setattr(settings, "CHAT_MAX_TOKENS", 400)
+
+    async def scenario(client):
+        return [delta async for delta in stream_chat_text(client, MESSAGES)]
+
+    deltas = run_with_client(upstream, scenario)
+    assert len(deltas) == 12
+    assert "".join(deltas) == fake_upstream.reply_text()
+    path, body = upstream.requests[0]
+    assert path == "/openai/deployments/chat-deployment/chat/completions"
+    assert (body["messages"], body["stream"], body["max_tokens"]) == (MESSAGES, True, 400)
+
+
+def test_complete_chat_returns_the_whole_reply(upstream, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_MAX_TOKENS", 0)
+
+    async def scenario(client):
+        return await complete_chat(client, MESSAGES, model="other-deployment")
+
+    assert run_with_client(upstream, scenario) == fake_upstream.reply_text()
+    path, body = upstream.requests[0]
+    assert path == "/openai/deployments/other-deployment/chat/completions"
+    assert "max_tokens" not in body
+
+
+def test_a_disconnected_client_stops_the_stream(upstream):
+    checks = []
+
+    async def is_disconnected():
+        checks.append(1)
+        return len(checks) >= 3
+
+    async def scenario(client):
+        deltas = []
+        with pytest.raises(ClientDisconnectedError):
+            async for delta in stream_chat_text(client, MESSAGES, is_disconnected=is_disconnected):
+                deltas.append(delta)
+        return deltas
+
+    deltas = run_with_client(upstream, scenario)
+    # Checked after every chunk; the stream ends at the third check
+    assert len(checks) == 3 and 0 < len(deltas) <= 3
+
+
+def test_slow_completions_time_out(upstream, monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "token_interval", 0.05)
+
+    async def scenario(client):
+        return await complete_chat(client, MESSAGES, timeout=0.1)
+
+    with pytest.raises(RunTimeoutError):
+        run_with_client(upstream, scenario)
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREDENTIALS = ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "ASSISTANT_ID", "OPENAI_API_KEY")
+
+
+def run_python(code: str, **environment) -> subprocess.CompletedProcess:
+    env = {name: value for name, value in os.environ.items() if name not in CREDENTIALS}
+    env.update(environment)
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=60
+    )
+
+
+def test_the_app_imports_without_credentials():
+    result = run_python("import main, core.config")
+    assert result.returncode == 0, result.stderr
+
+
+def test_missing_credentials_are_reported_on_first_use():
+    result = run_python("from core.config import settings\nsettings.JOB_WORKERS")
+    assert result.returncode != 0
+    assert "UndefinedValueError: AZURE_OPENAI_ENDPOINT not found" in result.stderr
+
+
+def test_settings_are_read_from_the_environment_when_first_used():
+    credentials = {name: "test" for name in CREDENTIALS}
+    code = (
+        "import os\n"
+        "from core.config import settings\n"
+        "os.environ['JOB_WORKERS'] = '7'\n"
+        "print(settings.JOB_WORKERS + 1, settings.UPSTREAM_HTTP2, settings.CLIENT_CREDENTIAL_KEY)"
+    )
+    result = run_python(code, **credentials, UPSTREAM_HTTP2="false")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["8", "False", "test"]
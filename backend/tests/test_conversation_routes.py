@@ -0,0 +1,94 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core.conversation_store import get_conversation_store
+from routers.thinker import create_new_conversation, router
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+@pytest.fixture
+def conversation_id():
+    """A medical conversation with patient context and three messages"""
+    conversation_id = create_new_conversation("medical")
+    store = get_conversation_store("medical")
+    store.update(conversation_id, {"patient_context": "Patient: Anna Lee, 34", "title": "Knee pain"})
+    for number in range(3):
+        store.append_message(conversation_id, {"role": "user", "content": f"Message {number}", "timestamp": 1001.0 + number})
+    return conversation_id
+
+
+def get_messages(conversation_id: str, **params):
+    return client.get(f"/conversation/{conversation_id}/messages", params={"conversation_type": "medical", **params})
+
+
+def test_messages_are_paged_without_context_by_default(conversation_id):
+    response = get_messages(conversation_id, limit=2)
+    assert response.status_code == 200
+    body = response.json()
+    assert [m["content"] for m in body["messages"]] == ["Message 1", "Message 2"]
+    assert body["has_more"] is True
+    assert "patient_context" not in body and "document_context" not in body
+
+    older = get_messages(conversation_id, limit=2, before=body["messages"][0]["message_id"]).json()
+    assert [m["content"] for m in older["messages"]] == ["Message 0"]
+    assert older["has_more"] is False
+
+
+def test_context_is_included_on_request(conversation_id):
+    body = get_messages(conversation_id, include_context="true").json()
+    assert body["patient_context"] == "Patient: Anna Lee, 34"
+    assert body["document_context"] == ""
+    assert len(body["messages"]) == 3
+
+
+def test_incremental_fetch_returns_only_new_messages(conversation_id):
+    newest = get_messages(conversation_id).json()["messages"][-1]["message_id"]
+    assert get_messages(conversation_id, after=newest).json()["messages"] == []
+    get_conversation_store("medical").append_message(
+        conversation_id, {"role": "assistant", "content": "Rest it", "timestamp": 1010.0}
+    )
+    assert [m["content"] for m in get_messages(conversation_id, after=newest).json()["messages"]] == ["Rest it"]
+    assert [m["content"] for m in get_messages(conversation_id, since=1003.0).json()["messages"]] == ["Rest it"]
+
+
+def test_missing_conversations_and_bad_parameters(conversation_id):
+    assert get_messages("missing").status_code == 404
+    assert get_messages(conversation_id, limit=0).status_code == 422
+
+
+def test_reads_answer_304_until_the_conversation_store_changes(conversation_id):
+    first = get_messages(conversation_id)
+    etag = first.headers["etag"]
+    not_modified = client.get(
+        f"/conversation/{conversation_id}/messages",
+        params={"conversation_type": "medical"},
+        headers={"If-None-Match": etag},
+    )
+    assert (not_modified.status_code, not_modified.content) == (304, b"")
+
+    get_conversation_store("medical").append_message(
+        conversation_id, {"role": "assistant", "content": "Rest it", "timestamp": 1010.0}
+    )
+    changed = client.get(
+        f"/conversation/{conversation_id}/messages",
+        params={"conversation_type": "medical"},
+        headers={"If-None-Match": etag},
+    )
+    assert changed.status_code == 200
+    assert changed.json()["messages"][-1]["content"] == "Rest it"
+
+
+def test_listings_page_with_the_next_cursor_header(conversation_id):
+    create_new_conversation("medical")
+    first = client.get("/medical-conversations", params={"limit": 1})
+    assert first.status_code == 200 and len(first.json()) == 1
+    cursor = first.headers["x-next-cursor"]
+    assert client.get("/medical-conversations", params={"limit": 1}, headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    second = client.get("/medical-conversations", params={"limit": 1, "cursor": cursor}).json()
+    assert second[0]["conversation_id"] != first.json()[0]["conversation_id"]
+    assert client.get("/medical-conversations", params={"cursor": "not-a-cursor"}).status_code == 400
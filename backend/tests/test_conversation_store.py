@@ -0,0 +1,342 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from core.conversation_store import (
+    InvalidCursorError,
+    JsonConversationStore,
+    SqliteConversationStore,
+    encode_cursor,
+)
+
+
+def conversation(title: str = "Knee pain", messages=None, **fields) -> dict:
+    return {
+        "title": title,
+        "created_at": 1000.0,
+        "last_query": "",
+        "messages": messages or [],
+        **fields,
+    }
+
+
+def message(content: str, timestamp: float, role: str = "user") -> dict:
+    return {"role": role, "content": content, "timestamp": timestamp}
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SqliteConversationStore("medical", str(tmp_path / "conversations.db"))
+    else:
+        store = JsonConversationStore("medical", str(tmp_path / "medical_conversations.json"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = SqliteConversationStore("medical", str(tmp_path / "conversations.db"))
+    yield store
+    store.close()
+
+
+def test_create_get_update_and_delete(store):
+    store.create("c1", conversation(messages=[message("Hello", 1001.0)]))
+    assert store.exists("c1")
+    assert not store.exists("c2")
+
+    assert store.update("c1", {"title": "Left knee pain", "patient_id": "7"})
+    assert not store.update("c2", {"title": "Missing"})
+    record = store.get("c1")
+    assert record["title"] == "Left knee pain"
+    assert record["patient_id"] == "7"
+    assert [m["content"] for m in record["messages"]] == ["Hello"]
+    assert "messages" not in store.get_record("c1")
+
+    assert store.delete("c1")
+    assert not store.delete("c1")
+    assert store.get("c1") is None
+
+
+def test_append_message_adds_to_one_conversation(store):
+    store.create("c1", conversation())
+    store.create("c2", conversation("Headache"))
+    assert store.append_message("c1", message("Hello", 1001.0))
+    assert store.append_message("c1", message("Hi, how can I help?", 1002.0, "assistant"))
+    assert not store.append_message("missing", message("Hello", 1003.0))
+
+    assert [m["content"] for m in store.get("c1")["messages"]] == ["Hello", "Hi, how can I help?"]
+    assert store.get("c2")["messages"] == []
+
+
+def test_update_does_not_replace_messages(sqlite_store):
+    sqlite_store.create("c1", conversation(messages=[message("Hello", 1001.0)]))
+    sqlite_store.update("c1", {"messages": [], "last_query": "Hello"})
+    assert len(sqlite_store.get("c1")["messages"]) == 1
+
+
+def test_load_all_and_save_all_round_trip(store):
+    conversations = {
+        "c1": conversation(messages=[message("Hello", 1001.0)]),
+        "c2": conversation("Headache"),
+    }
+    store.save_all(conversations)
+    assert store.load_all() == conversations
+
+    store.save_all({"c2": conversations["c2"]})
+    assert list(store.load_all()) == ["c2"]
+
+
+def test_conversation_types_are_kept_apart(tmp_path):
+    db_path = str(tmp_path / "conversations.db")
+    medical = SqliteConversationStore("medical", db_path)
+    document = SqliteConversationStore("document", db_path)
+    try:
+        medical.create("c1", conversation())
+        document.create("d1", conversation("Report"))
+        assert medical.get("d1") is None
+        assert not document.exists("c1")
+        assert list(medical.load_all()) == ["c1"]
+        document.save_all({})
+        assert list(medical.load_all()) == ["c1"]
+    finally:
+        medical.close()
+        document.close()
+
+
+def test_legacy_json_file_is_imported_once(sqlite_store, tmp_path):
+    legacy_file = tmp_path / "medical_conversations.json"
+    legacy_file.write_text(json.dumps({"conversations": {"c1": conversation(messages=[message("Hello", 1001.0)])}}))
+    assert sqlite_store.import_json_file(str(legacy_file)) == 1
+    sqlite_store.delete("c1")
+    assert sqlite_store.import_json_file(str(legacy_file)) == 0
+    assert sqlite_store.get("c1") is None
+
+
+def open_store(backend: str, path: str, conversation_type: str = "medical"):
+    if backend == "sqlite":
+        return SqliteConversationStore(conversation_type, os.path.join(path, "conversations.db"))
+    return JsonConversationStore(conversation_type, os.path.join(path, f"{conversation_type}_conversations.json"))
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "json"])
+def test_generation_moves_on_every_write_in_any_worker(backend, tmp_path):
+    store, other_worker = open_store(backend, str(tmp_path)), open_store(backend, str(tmp_path))
+    try:
+        seen = [other_worker.generation()]
+
+        def changed() -> bool:
+            seen.append(other_worker.generation())
+            return seen[-1] != seen[-2]
+
+        store.create("c1", conversation())
+        assert changed()
+        store.append_message("c1", message("Hello", 1001.0))
+        assert changed()
+        store.update("c1", {"title": "Left knee pain"})
+        assert changed()
+        other_worker.get("c1")
+        assert not changed()
+        store.delete("c1")
+        assert changed()
+    finally:
+        store.close()
+        other_worker.close()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "json"])
+def test_reads_see_writes_from_another_worker(backend, tmp_path):
+    store, other_worker = open_store(backend, str(tmp_path)), open_store(backend, str(tmp_path))
+    try:
+        store.create("c1", conversation())
+        assert other_worker.get("c1")["messages"] == []
+        other_worker.append_message("c1", message("Hello", 1001.0))
+        store.append_message("c1", message("Hi, how can I help?", 1002.0, "assistant"))
+        assert [m["content"] for m in other_worker.get("c1")["messages"]] == ["Hello", "Hi, how can I help?"]
+        assert other_worker.list_summaries()[0][0]["message_count"] == 2
+    finally:
+        store.close()
+        other_worker.close()
+
+
+def append_messages(backend, path, worker, count):
+    store = open_store(backend, path)
+    try:
+        for number in range(count):
+            store.append_message("c1", message(f"Worker {worker} message {number}", 1000.0 + number))
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "json"])
+def test_concurrent_worker_processes_do_not_lose_writes(backend, tmp_path):
+    store = open_store(backend, str(tmp_path))
+    store.create("c1", conversation())
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=append_messages, args=(backend, str(tmp_path), worker, 15)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+    try:
+        assert len(store.get("c1")["messages"]) == 60
+    finally:
+        store.close()
+
+
+def test_summaries_are_listed_most_recently_active_first(store):
+    store.create("old", conversation("Old", messages=[message("Hello", 1001.0)]))
+    store.create("new", conversation("New", messages=[message("Hello", 1005.0)]))
+    store.create("empty", conversation("Empty"))
+    summaries, cursor = store.list_summaries()
+    assert cursor is None
+    assert [summary["conversation_id"] for summary in summaries] == ["new", "old", "empty"]
+    assert summaries[0] == {
+        "conversation_id": "new",
+        "created_at": 1000.0,
+        "updated_at": 1005.0,
+        "title": "New",
+        "last_query": "",
+        "message_count": 1,
+        "conversation_type": "medical",
+    }
+
+
+def test_summary_cursors_page_through_every_conversation_once(store):
+    # Three conversations share an activity time, so the id breaks the tie
+    for number, timestamp in enumerate([1001.0, 1003.0, 1003.0, 1003.0, 1002.0]):
+        store.create(f"c{number}", conversation(messages=[message("Hello", timestamp)]))
+    pages, cursor = [], None
+    while True:
+        page, cursor = store.list_summaries(limit=2, cursor=cursor)
+        pages.append([summary["conversation_id"] for summary in page])
+        if cursor is None:
+            break
+    assert pages == [["c3", "c2"], ["c1", "c4"], ["c0"]]
+
+
+def test_a_full_last_page_has_no_cursor(store):
+    store.create("c1", conversation())
+    store.create("c2", conversation())
+    page, cursor = store.list_summaries(limit=2)
+    assert len(page) == 2 and cursor is None
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "e30", encode_cursor(1), encode_cursor({"a": 1}, "c1")])
+def test_invalid_cursors_are_rejected(store, cursor):
+    store.create("c1", conversation())
+    with pytest.raises(InvalidCursorError):
+        store.list_summaries(limit=1, cursor=cursor)
+
+
+def test_summary_index_follows_writes(sqlite_store):
+    sqlite_store.create("c1", conversation(messages=[message("Hello", 1001.0)]))
+    sqlite_store.create("c2", conversation(messages=[message("Hello", 1002.0)]))
+
+    sqlite_store.append_message("c1", message("Still sore", 1003.0))
+    summaries, _ = sqlite_store.list_summaries()
+    assert [(s["conversation_id"], s["message_count"]) for s in summaries] == [("c1", 2), ("c2", 1)]
+
+    # Renaming is not activity; a new question is
+    sqlite_store.update("c2", {"title": "Renamed"})
+    assert sqlite_store.list_summaries()[0][0]["conversation_id"] == "c1"
+    before = time.time()
+    sqlite_store.update("c2", {"last_query": "Is it broken?"})
+    first = sqlite_store.list_summaries()[0][0]
+    assert (first["conversation_id"], first["title"], first["last_query"]) == ("c2", "Renamed", "Is it broken?")
+    assert first["updated_at"] >= before
+
+    sqlite_store.delete("c2")
+    assert [s["conversation_id"] for s in sqlite_store.list_summaries()[0]] == ["c1"]
+
+
+def test_summary_index_is_built_for_existing_conversations(tmp_path):
+    db_path = str(tmp_path / "conversations.db")
+    store = SqliteConversationStore("medical", db_path)
+    store.create("c1", conversation(messages=[message("Hello", 1001.0)]))
+    # As stored before the summary index existed
+    store._conn.execute("DELETE FROM conversation_summaries")
+    store._conn.execute("DELETE FROM meta")
+    store.close()
+
+    reopened = SqliteConversationStore("medical", db_path)
+    try:
+        summaries, _ = reopened.list_summaries()
+        assert [(s["conversation_id"], s["message_count"], s["updated_at"]) for s in summaries] == [("c1", 1, 1001.0)]
+    finally:
+        reopened.close()
+
+
+@pytest.fixture
+def chat(store):
+    """A conversation with five messages one second apart, and its message ids"""
+    store.create("c1", conversation())
+    for number in range(5):
+        store.append_message("c1", message(f"Message {number}", 1001.0 + number))
+    messages, _ = store.get_messages("c1")
+    return store, [m["message_id"] for m in messages]
+
+
+def contents(page):
+    messages, has_more = page
+    return [m["content"] for m in messages], has_more
+
+
+def test_all_messages_carry_increasing_ids(chat):
+    store, ids = chat
+    assert ids == sorted(ids) and len(set(ids)) == 5
+    assert contents(store.get_messages("c1")) == ([f"Message {n}" for n in range(5)], False)
+    assert store.get_messages("missing") is None
+
+
+def test_limit_returns_the_newest_page_and_before_pages_back(chat):
+    store, ids = chat
+    assert contents(store.get_messages("c1", limit=2)) == (["Message 3", "Message 4"], True)
+    assert contents(store.get_messages("c1", limit=2, before=ids[3])) == (["Message 1", "Message 2"], True)
+    assert contents(store.get_messages("c1", limit=2, before=ids[1])) == (["Message 0"], False)
+
+
+def test_after_and_since_fetch_newer_messages_oldest_first(chat):
+    store, ids = chat
+    assert contents(store.get_messages("c1", limit=2, after=ids[1])) == (["Message 2", "Message 3"], True)
+    assert contents(store.get_messages("c1", limit=2, after=ids[3])) == (["Message 4"], False)
+    assert contents(store.get_messages("c1", after=ids[4])) == ([], False)
+    assert contents(store.get_messages("c1", since=1002.0)) == (["Message 2", "Message 3", "Message 4"], False)
+    assert contents(store.get_messages("c1", limit=1, since=1002.0)) == (["Message 2"], True)
+
+
+def test_message_ids_are_stable_as_messages_are_added(chat):
+    store, ids = chat
+    store.append_message("c1", message("Message 5", 1006.0))
+    messages, has_more = store.get_messages("c1", after=ids[-1])
+    assert [m["content"] for m in messages] == ["Message 5"] and not has_more
+    assert [m["message_id"] for m in store.get_messages("c1", limit=5, before=messages[0]["message_id"])[0]] == ids
+
+
+def test_update_only_touches_conversations_of_the_stores_type(tmp_path):
+    db_path = str(tmp_path / "conversations.db")
+    medical = SqliteConversationStore("medical", db_path)
+    document = SqliteConversationStore("document", db_path)
+    try:
+        document.create("d1", conversation("Report"))
+        assert not medical.update("d1", {"title": "Hijacked"})
+        assert document.get("d1")["title"] == "Report"
+        assert document.list_summaries()[0][0]["title"] == "Report"
+    finally:
+        medical.close()
+        document.close()
+
+
+def test_missing_legacy_json_file_is_skipped_without_a_lock_file(sqlite_store, tmp_path):
+    legacy_file = tmp_path / "medical_conversations.json"
+    assert sqlite_store.import_json_file(str(legacy_file)) == 0
+    assert not (tmp_path / "medical_conversations.json.lock").exists()
+    # A file that appears later is still imported
+    legacy_file.write_text(json.dumps({"conversations": {"c1": conversation()}}))
+    assert sqlite_store.import_json_file(str(legacy_file)) == 1
+    assert not (tmp_path / "medical_conversations.json.lock").exists()
@@ -0,0 +1,174 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi import HTTPException
+
+from core import document_parser
+from core.config import settings
+from core.document_parser import (
+    DocumentParseError,
+    DocumentTooLargeError,
+    extract_pdf_page_range,
+    extract_text_async,
+    pool_failure,
+)
+from core.document_store import DocumentStore, content_digest
+from routers import thinker
+
+
+def pdf(pages) -> bytes:
+    """A minimal PDF with one line of text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>"
+    body, offsets = b"%PDF-1.4\n", []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{content}\nendobj\n".encode()
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return body
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = DocumentStore(str(tmp_path / "documents"))
+    monkeypatch.setattr(thinker, "get_document_store", lambda: store)
+    return store
+
+
+def parse(content: bytes, filename: str):
+    return asyncio.run(thinker.parse_document(content, filename))
+
+
+def test_parsed_uploads_are_stored_with_their_text(store):
+    content = b"Knee MRI: no tear."
+    document_ref, text = parse(content, "report.txt")
+    digest = content_digest(content)
+    assert document_ref == {"sha256": digest, "filename": "report.txt", "size": len(content), "characters": len(text)}
+    assert text == "Knee MRI: no tear."
+    assert store.get_blob(digest) == content
+    assert store.get_text(digest) == text
+    assert store.get_chunks(digest) == [text]
+
+
+def test_uploads_that_fail_to_parse_are_not_kept(store):
+    for content, filename in ((b"not a pdf", "report.pdf"), (b"\xff\xfe\xfa", "notes.txt"), (b"plain", "scan.bmp")):
+        with pytest.raises(HTTPException) as raised:
+            parse(content, filename)
+        assert raised.value.status_code == 400
+        assert not store.has_blob(content_digest(content))
+        assert store.get_text(content_digest(content)) is None
+
+
+def test_a_failed_parse_keeps_a_blob_stored_earlier(store):
+    # Queued jobs store the upload before a worker parses it
+    digest = store.put_blob(b"not a pdf")
+    with pytest.raises(HTTPException):
+        parse(b"not a pdf", "report.pdf")
+    assert store.has_blob(digest)
+
+
+class RecordingPool(ProcessPoolExecutor):
+    """A parser pool that records the page ranges handed to its workers"""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.ranges = []
+
+    def submit(self, fn, *args, **kwargs):
+        if fn is extract_pdf_page_range:
+            self.ranges.append(args[1:])
+        return super().submit(fn, *args, **kwargs)
+
+
+@pytest.fixture
+def parser_pool(monkeypatch):
+    """A fresh two-worker pool, shut down after the test"""
+    document_parser.shutdown_parser_executor()
+    pool = RecordingPool(max_workers=2)
+    monkeypatch.setattr(document_parser, "_executor", pool)
+    yield pool
+    document_parser.shutdown_parser_executor()
+
+
+def write(tmp_path, name: str, content: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_pdf_pages_are_split_across_workers_and_kept_in_order(parser_pool, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DOCUMENT_PAGES_PER_TASK", 2)
+    path = write(tmp_path, "report.pdf", pdf([f"Page {n}" for n in range(1, 8)]))
+    text = asyncio.run(extract_text_async(path, "report.pdf"))
+    assert text == "".join(f"Page {n}\n" for n in range(1, 8))
+    assert parser_pool.ranges == [(0, 2), (2, 4), (4, 6), (6, 7)]
+
+
+def test_other_formats_are_extracted_whole(parser_pool, tmp_path):
+    path = write(tmp_path, "notes.txt", "Knee MRI: no tear.\nRest.".encode("utf-8"))
+    assert asyncio.run(extract_text_async(path, "notes.TXT")) == "Knee MRI: no tear.\nRest."
+    assert parser_pool.ranges == []
+
+
+@pytest.mark.parametrize("content, filename, message", [
+    (b"not a pdf", "report.pdf", "Error reading PDF"),
+    (b"not a docx", "report.docx", "Error reading DOCX"),
+    (b"\xff\xfe\xfa", "notes.txt", "Error reading TXT"),
+    (b"plain", "scan.bmp", "Unsupported file type: bmp"),
+])
+def test_unreadable_documents_raise_parse_errors(parser_pool, tmp_path, content, filename, message):
+    with pytest.raises(DocumentParseError) as raised:
+        asyncio.run(extract_text_async(write(tmp_path, filename, content), filename))
+    assert message in str(raised.value)
+    assert raised.value.status_code == 400
+
+
+def test_documents_over_the_limits_are_rejected(parser_pool, tmp_path, monkeypatch):
+    path = write(tmp_path, "report.pdf", pdf(["Page 1", "Page 2", "Page 3"]))
+    monkeypatch.setattr(settings, "DOCUMENT_MAX_PAGES", 2)
+    with pytest.raises(DocumentTooLargeError, match="3 pages"):
+        asyncio.run(extract_text_async(path, "report.pdf"))
+    assert parser_pool.ranges == []
+
+    monkeypatch.setattr(settings, "DOCUMENT_MAX_BYTES", 10)
+    with pytest.raises(DocumentTooLargeError) as raised:
+        asyncio.run(extract_text_async(path, "report.pdf"))
+    assert raised.value.status_code == 413
+
+
+def test_a_pool_whose_worker_died_is_replaced(parser_pool, tmp_path):
+    async def kill_a_worker():
+        await asyncio.get_running_loop().run_in_executor(document_parser.get_parser_executor(), os._exit, 1)
+
+    with pytest.raises(BrokenProcessPool) as raised:
+        asyncio.run(kill_a_worker())
+    assert isinstance(pool_failure(raised.value, "PDF"), DocumentParseError)
+    assert document_parser._executor is None
+
+    path = write(tmp_path, "report.pdf", pdf(["Page 1", "Page 2"]))
+    assert asyncio.run(extract_text_async(path, "report.pdf")) == "Page 1\nPage 2\n"
+    assert document_parser.get_parser_executor() is not parser_pool
+
+
+def test_shutdown_discards_the_pool_until_it_is_next_needed(parser_pool):
+    document_parser.shutdown_parser_executor()
+    assert document_parser._executor is None
+    document_parser.shutdown_parser_executor()
+    replacement = document_parser.get_parser_executor()
+    assert replacement is not parser_pool
+    assert document_parser.get_parser_executor() is replacement
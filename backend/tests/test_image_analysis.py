@@ -0,0 +1,292 @@
+import asyncio
+import io
+import json
+import random
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+from PIL import Image, ImageFilter
+from starlette.responses import JSONResponse
+
+from benchmarks import fake_upstream
+from core import image_pipeline, resilience, result_cache, scheduler
+from core.config import settings
+from core.image_pipeline import perceptual_hash
+from core.resilience import LatencyTracker
+from core.result_cache import AnalysisCache, hamming_distance
+from routers import diagnosis_assistant
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache, "time", clock)
+    return clock
+
+
+def xray(seed: int, size=(256, 256)) -> Image.Image:
+    """A smooth, textured grayscale image standing in for a film"""
+    rng = random.Random(seed)
+    image = Image.new("L", (16, 16))
+    image.putdata([rng.randrange(256) for _ in range(256)])
+    return image.resize(size, Image.BICUBIC)
+
+
+def encode(image: Image.Image, format: str = "PNG", **params) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=format, **params)
+    return output.getvalue()
+
+
+def test_entries_expire_after_the_ttl(clock, tmp_path):
+    cache = AnalysisCache(max_bytes=1024, ttl=60, disk_dir=str(tmp_path))
+    cache.put("k1", "Fracture of the distal radius")
+    clock.now += 59
+    assert cache.get("k1") == "Fracture of the distal radius"
+    clock.now += 2
+    assert cache.get("k1") is None
+    # The expired file is removed when read
+    assert not list(tmp_path.rglob("k1.json"))
+
+
+def test_memory_tier_evicts_least_recently_used_by_size(clock):
+    cache = AnalysisCache(max_bytes=10, ttl=60)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("aaaa", None, "cccc")
+    # Values larger than the whole tier are not kept
+    cache.put("d", "d" * 11)
+    assert cache.get("d") is None and cache.get("a") == "aaaa"
+
+
+def test_disk_tier_round_trips_and_refills_memory(clock, tmp_path):
+    cache = AnalysisCache(max_bytes=1024, ttl=60, disk_dir=str(tmp_path))
+    cache.put("k1", "Joint space narrowing", variant="v1", phash=0xF0F0)
+    data = json.loads(next(tmp_path.rglob("k1.json")).read_text())
+    assert data == {"value": "Joint space narrowing", "expires_at": 1060.0, "variant": "v1", "phash": 0xF0F0}
+
+    restarted = AnalysisCache(max_bytes=1024, ttl=60, disk_dir=str(tmp_path))
+    assert restarted.get("k1") == "Joint space narrowing"
+    # The loaded entry keeps its hash and variant for near-duplicate lookups
+    assert restarted.find_similar(0xF0F0, "v1", 0) == "Joint space narrowing"
+
+
+def test_async_methods_use_both_tiers(clock, tmp_path):
+    cache = AnalysisCache(max_bytes=1024, ttl=60, disk_dir=str(tmp_path))
+    restarted = AnalysisCache(max_bytes=1024, ttl=60, disk_dir=str(tmp_path))
+
+    async def scenario():
+        await cache.put_async("k1", "No fracture")
+        return await cache.get_async("k1"), await restarted.get_async("k1"), await restarted.get_async("k2")
+
+    assert asyncio.run(scenario()) == ("No fracture", "No fracture", None)
+
+
+def test_disk_tier_is_bounded_oldest_first(clock, tmp_path):
+    cache = AnalysisCache(max_bytes=0, ttl=60, disk_dir=str(tmp_path), disk_max_bytes=200)
+    for number in range(5):
+        clock.now += 1
+        cache.put(f"k{number}", "x" * 40)
+    kept = sorted(path.stem for path in tmp_path.rglob("*.json"))
+    assert kept and kept == [f"k{number}" for number in range(5 - len(kept), 5)]
+    assert sum(path.stat().st_size for path in tmp_path.rglob("*.json")) <= 200
+
+
+def test_near_duplicates_match_within_the_distance_and_variant(clock):
+    cache = AnalysisCache(max_bytes=1024, ttl=60)
+    cache.put("k1", "Healing callus", variant="v1", phash=0b1111)
+    assert cache.find_similar(0b1111, "v1", 0) == "Healing callus"
+    assert cache.find_similar(0b0011, "v1", 2) == "Healing callus"
+    assert cache.find_similar(0b0001, "v1", 2) is None
+    assert cache.find_similar(0b1111, "v2", 2) is None
+    clock.now += 61
+    assert cache.find_similar(0b1111, "v1", 2) is None
+
+
+def test_re_encoded_copies_hash_alike_and_other_films_do_not():
+    film = xray(1)
+    phash = perceptual_hash(encode(film))
+    for copy in (encode(film, "JPEG", quality=60), encode(film.resize((240, 240))), encode(film.filter(ImageFilter.GaussianBlur(1)))):
+        assert hamming_distance(phash, perceptual_hash(copy)) <= 2
+    assert hamming_distance(phash, perceptual_hash(encode(xray(2)))) > 16
+
+
+def test_16_bit_films_hash_like_their_8_bit_rendering():
+    film = xray(1)
+    sixteen_bit = film.convert("I").point(lambda value: value * 200).convert("I;16")
+    assert perceptual_hash(encode(sixteen_bit)) == perceptual_hash(encode(film))
+
+
+def test_featureless_images_have_no_hash():
+    # Blank images would otherwise all share hash 0 and match each other
+    assert perceptual_hash(encode(Image.new("L", (64, 64), 128))) is None
+    assert perceptual_hash(encode(Image.new("I;16", (64, 64), 60000))) is None
+
+
+def test_no_cache_bypasses_cached_results(clock, monkeypatch):
+    cache = AnalysisCache(max_bytes=1024, ttl=60)
+    monkeypatch.setattr(diagnosis_assistant, "get_analysis_cache", lambda: cache)
+    calls = []
+
+    async def run_image_analysis(image_data, content_type, original, no_cache, cache_key, variant):
+        calls.append(no_cache)
+        cache.put(cache_key, f"Analysis {len(calls)}", variant=variant)
+        return f"Analysis {len(calls)}", "MISS"
+
+    monkeypatch.setattr(diagnosis_assistant, "run_image_analysis", run_image_analysis)
+
+    def analyze(**options):
+        return asyncio.run(diagnosis_assistant.analyze_image_bytes(b"film", "image/png", **options))
+
+    assert analyze() == ("Analysis 1", "MISS")
+    assert analyze() == ("Analysis 1", "HIT")
+    assert analyze(no_cache=True) == ("Analysis 2", "MISS")
+    # A fresh result replaces the cached one
+    assert analyze() == ("Analysis 2", "HIT")
+    # Original-resolution analyses are cached separately
+    assert analyze(original=True) == ("Analysis 3", "MISS")
+    assert calls == [False, True, False]
+
+
+class VisionUpstream:
+    """The fake upstream app, with per-call delays and rejections for vision requests.
+
+    Calls are numbered from 1 in arrival order.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self.delays = {}
+        self.rejected = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith("/chat/completions"):
+            return await fake_upstream.app(scope, receive, send)
+        self.calls += 1
+        number = self.calls
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(number, 0.05))
+            if number in self.rejected:
+                response = JSONResponse(status_code=400, content={"error": {"message": "Invalid image", "type": "invalid_request_error"}})
+                return await response(scope, receive, send)
+            await fake_upstream.app(scope, receive, send)
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    """Route vision calls to the fake upstream, with a fresh cache, scheduler and image pool"""
+    upstream = VisionUpstream()
+    monkeypatch.setattr(fake_upstream.config, "error_rate", 0.0)
+    monkeypatch.setattr(fake_upstream.config, "slow_rate", 0.0)
+    monkeypatch.setattr(diagnosis_assistant, "get_openai_client", lambda: AsyncOpenAI(
+        base_url="http://fake-upstream/v1",
+        api_key="test",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream)),
+        max_retries=0,
+    ))
+    cache = AnalysisCache(max_bytes=1 << 20, ttl=60)
+    monkeypatch.setattr(diagnosis_assistant, "get_analysis_cache", lambda: cache)
+    monkeypatch.setattr(diagnosis_assistant, "vision_latencies", LatencyTracker())
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(scheduler, "_scheduler", None)
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 2)
+    image_pipeline.shutdown_image_executor()
+    yield upstream
+    image_pipeline.shutdown_image_executor()
+
+
+app = FastAPI()
+app.include_router(diagnosis_assistant.router)
+client = TestClient(app)
+
+
+def parse_events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def upload(name: str, content: bytes, content_type: str = "image/png"):
+    return ("files", (name, content, content_type))
+
+
+def test_a_batch_is_analyzed_concurrently_sharing_calls_for_repeated_images(vision, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_BATCH_CONCURRENCY", 2)
+    films = [encode(xray(seed)) for seed in (1, 2, 3)]
+    response = client.post("/analyze-images/", files=[
+        upload("a.png", films[0]), upload("b.png", films[1]), upload("c.png", films[2]), upload("a-again.png", films[0]),
+    ])
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_events(response.text)
+    assert [name for name, _ in events] == ["result"] * 4 + ["done"]
+    assert events[-1][1] == {"total": 4, "succeeded": 4, "failed": 0}
+    results = {data["index"]: data for _, data in events[:-1]}
+    assert sorted(results) == [0, 1, 2, 3]
+    assert results[3]["filename"] == "a-again.png" and results[3]["analysis"] == results[0]["analysis"]
+    # The repeated image is served from the cache or the first image's call
+    assert vision.calls == 3
+    assert vision.peak == 2
+
+
+def test_a_slow_vision_call_is_hedged_and_the_faster_copy_wins(vision, monkeypatch):
+    monkeypatch.setattr(settings, "VISION_HEDGING", True)
+    monkeypatch.setattr(settings, "HEDGE_MIN_DELAY", 0.05)
+    vision.delays[1] = 5.0
+    started = time.perf_counter()
+    events = parse_events(client.post("/analyze-images/", files=[upload("a.png", encode(xray(1)))]).text)
+    assert time.perf_counter() - started < 5.0
+    assert [name for name, _ in events] == ["result", "done"]
+    assert events[0][1]["cache"] == "MISS"
+    assert vision.calls == 2
+
+
+def test_failed_images_are_reported_without_failing_the_batch(vision, monkeypatch):
+    # One image at a time, so the upstream sees the calls in upload order
+    monkeypatch.setattr(settings, "IMAGE_BATCH_CONCURRENCY", 1)
+    vision.rejected.add(2)
+    response = client.post("/analyze-images/", files=[
+        upload("a.png", encode(xray(1))),
+        upload("notes.txt", b"not an image", "text/plain"),
+        upload("broken.png", b"not a png"),
+        upload("b.png", encode(xray(2))),
+        upload("c.png", encode(xray(3))),
+    ])
+    assert response.status_code == 200
+    events = parse_events(response.text)
+    assert events[-1] == ("done", {"total": 5, "succeeded": 2, "failed": 3})
+    outcomes = {data["index"]: (name, data.get("status_code")) for name, data in events[:-1]}
+    assert outcomes == {0: ("result", None), 1: ("error", 400), 2: ("error", 400), 3: ("error", 500), 4: ("result", None)}
+    errors = {data["index"]: data["detail"] for name, data in events[:-1] if name == "error"}
+    assert errors[2].startswith("Could not read image") and errors[3].startswith("Model error")
+    assert vision.calls == 3
+
+
+def test_batches_over_the_limit_are_rejected(vision, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_BATCH_MAX_FILES", 2)
+    response = client.post("/analyze-images/", files=[upload(f"{n}.png", encode(xray(n))) for n in range(3)])
+    assert response.status_code == 400
+    assert vision.calls == 0
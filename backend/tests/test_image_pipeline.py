@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from core import image_pipeline
+from core.config import settings
+from core.image_pipeline import prepare_image, preprocess_image, to_8bit
+
+
+def encode(image: Image.Image, format: str = "PNG", **params) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format=format, **params)
+    return output.getvalue()
+
+
+def decode(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def gradient(mode: str, size=(64, 16), top: int = 65535) -> Image.Image:
+    """A left-to-right gradient from 0 to top"""
+    image = Image.new(mode, size)
+    width, height = size
+    image.putdata([column * top // (width - 1) for _ in range(height) for column in range(width)])
+    return image
+
+
+def preprocess(data: bytes, max_edge: int = 0, grayscale: bool = False, output_format: str = "PNG"):
+    encoded, content_type = preprocess_image(data, "image/png", max_edge, grayscale, output_format, 85)
+    return decode(encoded), content_type
+
+
+def test_large_images_are_downsampled_keeping_the_aspect_ratio():
+    image, content_type = preprocess(encode(Image.new("RGB", (3000, 1500), "red")), max_edge=1000, output_format="JPEG")
+    assert (image.size, image.format, content_type) == ((1000, 500), "JPEG", "image/jpeg")
+    # Smaller images keep their size
+    small, _ = preprocess(encode(Image.new("RGB", (300, 200))), max_edge=1000)
+    assert small.size == (300, 200)
+
+
+def test_grayscale_output_and_mode_normalisation():
+    assert preprocess(encode(Image.new("RGB", (8, 8), "red")), grayscale=True)[0].mode == "L"
+    # Transparency and palettes are flattened to RGB for JPEG output
+    for mode in ("RGBA", "P", "CMYK"):
+        image, _ = preprocess(encode(Image.new(mode, (8, 8)), "TIFF"), output_format="JPEG")
+        assert image.mode == "RGB"
+    assert preprocess(encode(Image.new("L", (8, 8))))[0].mode == "L"
+
+
+def test_metadata_is_dropped_and_orientation_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees
+    exif[0x010F] = "Scanner Co"
+    image, _ = preprocess(encode(Image.new("RGB", (40, 20)), "JPEG", exif=exif.tobytes()), output_format="JPEG")
+    assert image.size == (20, 40)
+    assert not image.getexif()
+
+
+@pytest.mark.parametrize("mode", ["I;16", "I"])
+@pytest.mark.parametrize("grayscale", [True, False])
+def test_16_bit_scans_are_rescaled_instead_of_clipped(mode, grayscale):
+    image, _ = preprocess(encode(gradient(mode)), grayscale=grayscale)
+    assert image.mode == "L"
+    row = [image.getpixel((column, 0)) for column in range(image.width)]
+    assert row[0] == 0 and row[-1] == 255
+    assert row == sorted(row) and len(set(row)) > 50
+
+
+def test_to_8bit_stretches_the_images_own_range():
+    faint = gradient("I;16", top=1000)
+    # convert("L") clips everything above 255 to white
+    assert faint.convert("L").getpixel((32, 0)) == 255
+    assert to_8bit(faint).getextrema() == (0, 255)
+    assert to_8bit(faint).getpixel((32, 0)) == pytest.approx(128, abs=3)
+
+    flat = Image.new("F", (4, 4), 0.5)
+    assert to_8bit(flat).getextrema() == (0, 0)
+    rgb = Image.new("RGB", (4, 4))
+    assert to_8bit(rgb) is rgb
+
+
+@pytest.fixture
+def image_pool(monkeypatch):
+    image_pipeline.shutdown_image_executor()
+    monkeypatch.setattr(settings, "IMAGE_WORKERS", 2)
+    yield
+    image_pipeline.shutdown_image_executor()
+
+
+def test_prepare_image_preprocesses_in_the_worker_pool(image_pool, monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_MAX_EDGE", 100)
+    monkeypatch.setattr(settings, "IMAGE_GRAYSCALE", True)
+    monkeypatch.setattr(settings, "IMAGE_FORMAT", "JPEG")
+    data = encode(Image.effect_noise((400, 200), 64).convert("RGB"))
+
+    async def scenario():
+        return await asyncio.gather(
+            prepare_image(data, "image/png", with_phash=True),
+            prepare_image(data, "image/png", original=True),
+        )
+
+    (url, size, phash), (original_url, original_size, no_phash) = asyncio.run(scenario())
+    header, body = url.split(",", 1)
+    assert header == "data:image/jpeg;base64"
+    prepared = decode(base64.b64decode(body))
+    assert (prepared.size, prepared.mode, size) == ((100, 50), "L", len(base64.b64decode(body)))
+    assert isinstance(phash, int)
+
+    assert original_url == "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+    assert (original_size, no_phash) == (len(data), None)
+    assert image_pipeline._executor is not None
+
+
+def test_images_are_sent_unchanged_without_pillow(monkeypatch):
+    monkeypatch.setattr(image_pipeline, "load_pillow", lambda: (None, None))
+    assert preprocess_image(b"raw", "image/webp", 100, True, "JPEG", 85) == (b"raw", "image/webp")
@@ -0,0 +1,270 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from core import jobs
+from core.config import settings
+from core.jobs import CANCELLED, COMPLETED, FAILED, QUEUED, RUNNING, JobQueue, JobStore, QueueFullError
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+@pytest.fixture
+def store(db_path):
+    store = JobStore(db_path)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def other_worker(db_path):
+    """A second store on the same database, standing in for another worker process"""
+    store = JobStore(db_path)
+    yield store
+    store.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_queue(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "JOB_QUEUE_MAX_DEPTH", 100)
+    monkeypatch.setattr(jobs, "ERROR_BACKOFF_SECONDS", 0.01)
+
+
+def test_jobs_are_claimed_oldest_first(store):
+    first = store.submit("test", {"n": 1}, max_depth=0)
+    second = store.submit("test", {"n": 2}, max_depth=0)
+    assert (first["status"], store.queue_position(first), store.queue_position(second)) == (QUEUED, 1, 2)
+
+    claimed = store.claim("w1", lease_seconds=30, max_attempts=3)
+    assert (claimed["id"], claimed["status"], claimed["worker"], claimed["attempts"]) == (first["id"], RUNNING, "w1", 1)
+    assert claimed["payload"] == {"n": 1}
+    assert store.queue_position(claimed) is None
+    assert store.queue_position(store.get(second["id"])) == 1
+    assert store.claim("w2", lease_seconds=30, max_attempts=3)["id"] == second["id"]
+    assert store.claim("w3", lease_seconds=30, max_attempts=3) is None
+
+
+def test_submit_refuses_jobs_beyond_the_maximum_depth(store):
+    store.submit("test", {}, max_depth=2)
+    store.submit("test", {}, max_depth=2)
+    with pytest.raises(QueueFullError):
+        store.submit("test", {}, max_depth=2)
+    # Running jobs do not count against the depth
+    store.claim("w1", lease_seconds=30, max_attempts=3)
+    store.submit("test", {}, max_depth=2)
+
+
+def test_a_held_lease_keeps_other_workers_off_the_job(store, other_worker):
+    job = store.submit("test", {}, max_depth=0)
+    store.claim("w1", lease_seconds=0.2, max_attempts=3)
+    time.sleep(0.1)
+    assert store.renew(job["id"], "w1", lease_seconds=0.2)
+    time.sleep(0.15)
+    assert other_worker.claim("w2", lease_seconds=30, max_attempts=3) is None
+
+
+def test_an_expired_lease_is_taken_over_by_another_worker(store, other_worker):
+    job = store.submit("test", {}, max_depth=0)
+    store.claim("w1", lease_seconds=0.05, max_attempts=3)
+    time.sleep(0.06)
+
+    taken = other_worker.claim("w2", lease_seconds=30, max_attempts=3)
+    assert (taken["id"], taken["worker"], taken["attempts"]) == (job["id"], "w2", 2)
+    # The first worker learns it lost the job and cannot overwrite the outcome
+    assert not store.renew(job["id"], "w1", lease_seconds=30)
+    assert not store.finish(job["id"], "w1", COMPLETED, result={"by": "w1"})
+    assert other_worker.finish(job["id"], "w2", COMPLETED, result={"by": "w2"})
+    assert store.get(job["id"])["result"] == {"by": "w2"}
+
+
+def test_a_job_interrupted_too_often_fails(store):
+    job = store.submit("test", {}, max_depth=0)
+    for attempt in range(2):
+        assert store.claim(f"w{attempt}", lease_seconds=0.01, max_attempts=2)["attempts"] == attempt + 1
+        time.sleep(0.02)
+    assert store.claim("w3", lease_seconds=30, max_attempts=2) is None
+    failed = store.get(job["id"])
+    assert failed["status"] == FAILED
+    assert failed["error"]["detail"] == "Job was interrupted too many times"
+
+
+def test_requeued_jobs_do_not_use_up_an_attempt(store):
+    job = store.submit("test", {}, max_depth=0)
+    store.claim("w1", lease_seconds=30, max_attempts=3)
+    store.requeue(job["id"], "w1")
+    requeued = store.get(job["id"])
+    assert (requeued["status"], requeued["worker"], requeued["attempts"]) == (QUEUED, None, 0)
+    assert store.claim("w2", lease_seconds=30, max_attempts=3)["attempts"] == 1
+
+
+def test_cancel_stops_queued_and_running_jobs_only(store):
+    running = store.submit("test", {}, max_depth=0)
+    finished = store.submit("test", {}, max_depth=0)
+    queued = store.submit("test", {}, max_depth=0)
+    store.claim("w1", lease_seconds=30, max_attempts=3)
+    store.claim("w2", lease_seconds=30, max_attempts=3)
+    store.finish(finished["id"], "w2", COMPLETED, result={})
+
+    assert store.cancel(queued["id"])
+    assert store.cancel(running["id"])
+    assert not store.renew(running["id"], "w1", lease_seconds=30)
+    assert not store.cancel(finished["id"])
+    assert [store.get(job["id"])["status"] for job in (queued, running, finished)] == [CANCELLED, CANCELLED, COMPLETED]
+
+
+def test_prune_deletes_only_old_finished_jobs(store):
+    finished = store.submit("test", {}, max_depth=0)
+    queued = store.submit("test", {}, max_depth=0)
+    store.cancel(finished["id"])
+    assert store.prune(time.time() - 60) == 0
+    assert store.prune(time.time() + 1) == 1
+    assert store.get(finished["id"]) is None
+    assert store.get(queued["id"]) is not None
+
+
+async def wait_for(queue: JobQueue, job_id: str, *statuses: str, timeout: float = 5) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await queue.wait_for_change(0.05)
+    raise AssertionError(f"Job {job_id} is still {job['status']}")
+
+
+def run_queue(store, scenario, workers: int = 1):
+    async def main():
+        queue = JobQueue(store)
+        queue.start(workers)
+        try:
+            return await scenario(queue)
+        finally:
+            await queue.stop()
+    return asyncio.run(main())
+
+
+class HandlerError(Exception):
+    status_code = 422
+
+
+def test_queue_runs_jobs_and_records_results_and_errors(store, monkeypatch):
+    async def handler(payload):
+        await asyncio.sleep(0.01)
+        if payload.get("fail"):
+            raise HandlerError("Unreadable document")
+        return {"doubled": payload["n"] * 2}
+
+    monkeypatch.setitem(jobs.job_handlers, "test", handler)
+
+    async def scenario(queue):
+        completed = queue.submit("test", {"n": 21})
+        failed = queue.submit("test", {"fail": True})
+        return await wait_for(queue, completed["id"], COMPLETED), await wait_for(queue, failed["id"], FAILED)
+
+    completed, failed = run_queue(store, scenario)
+    assert completed["result"] == {"doubled": 42}
+    assert failed["error"] == {"detail": "Unreadable document", "status_code": 422}
+
+
+def test_submit_requires_a_registered_handler(store):
+    with pytest.raises(ValueError):
+        JobQueue(store).submit("unknown", {})
+
+
+def test_cancelling_a_running_job_cancels_its_handler(store, monkeypatch):
+    cancelled = []
+
+    async def handler(payload):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(payload)
+            raise
+
+    monkeypatch.setitem(jobs.job_handlers, "test", handler)
+
+    async def scenario(queue):
+        job = queue.submit("test", {"n": 1})
+        await wait_for(queue, job["id"], RUNNING)
+        assert queue.cancel(job["id"])
+        await asyncio.sleep(0.05)
+        return queue.get(job["id"])
+
+    assert run_queue(store, scenario)["status"] == CANCELLED
+    assert cancelled == [{"n": 1}]
+
+
+def test_leases_are_renewed_while_a_long_job_runs(store, other_worker, monkeypatch):
+    monkeypatch.setitem(jobs.job_handlers, "test", lambda payload: asyncio.sleep(0.8, result={}))
+
+    async def scenario(queue):
+        job = queue.submit("test", {})
+        await wait_for(queue, job["id"], RUNNING)
+        # Well past the 0.3s lease, another worker still cannot take the job
+        await asyncio.sleep(0.5)
+        assert other_worker.claim("w2", settings.JOB_LEASE_SECONDS, settings.JOB_MAX_ATTEMPTS) is None
+        return await wait_for(queue, job["id"], COMPLETED)
+
+    assert run_queue(store, scenario)["attempts"] == 1
+
+
+def test_stopping_returns_running_jobs_to_the_queue(store, monkeypatch):
+    monkeypatch.setitem(jobs.job_handlers, "test", lambda payload: asyncio.sleep(5))
+
+    async def scenario(queue):
+        job = queue.submit("test", {})
+        await wait_for(queue, job["id"], RUNNING)
+        return job["id"]
+
+    job = store.get(run_queue(store, scenario))
+    assert (job["status"], job["attempts"]) == (QUEUED, 0)
+
+
+def test_workers_survive_store_errors(store, monkeypatch):
+    monkeypatch.setitem(jobs.job_handlers, "test", lambda payload: asyncio.sleep(0, result={"ok": True}))
+    claim, failures = store.claim, []
+
+    def flaky_claim(*args):
+        if len(failures) < 3:
+            failures.append(args)
+            raise sqlite3.OperationalError("database is locked")
+        return claim(*args)
+
+    monkeypatch.setattr(store, "claim", flaky_claim)
+
+    async def scenario(queue):
+        job = queue.submit("test", {})
+        return await wait_for(queue, job["id"], COMPLETED)
+
+    assert run_queue(store, scenario)["result"] == {"ok": True}
+    assert len(failures) == 3
+
+
+def test_a_worker_that_exits_is_restarted(store, monkeypatch):
+    monkeypatch.setitem(jobs.job_handlers, "test", lambda payload: asyncio.sleep(0, result={"ok": True}))
+    work, exits = JobQueue._work, []
+
+    async def exiting_work(self, worker):
+        if not exits:
+            exits.append(worker)
+            raise RuntimeError("worker crashed")
+        await work(self, worker)
+
+    monkeypatch.setattr(JobQueue, "_work", exiting_work)
+
+    async def scenario(queue):
+        job = queue.submit("test", {})
+        completed = await wait_for(queue, job["id"], COMPLETED)
+        return completed, len(queue._workers)
+
+    completed, workers = run_queue(store, scenario)
+    assert completed["result"] == {"ok": True}
+    assert len(exits) == 1 and workers == 1
@@ -0,0 +1,115 @@
+import random
+
+import pytest
+
+from core.patient_search import PatientSearchIndex, normalize, tokenize
+
+
+def build_index(*records):
+    index = PatientSearchIndex()
+    for record in records:
+        index.add(record)
+    return index
+
+
+def patient(patient_id, name, mrn="", email=None, phone=None):
+    return {"id": patient_id, "name": name, "medicalRecordNumber": mrn or f"MRN-{patient_id}", "email": email, "phone": phone}
+
+
+def test_normalize_strips_accents_and_case():
+    assert normalize("  José Müller ") == "jose muller"
+    assert normalize("ÅSA") == "asa"
+
+
+def test_tokenize_keeps_accented_and_non_latin_names_whole():
+    assert tokenize(normalize("Zoë O'Brien-Núñez")) == ["zoe", "o", "brien", "nunez"]
+    assert tokenize(normalize("Иван Петров")) == ["иван", "петров"]
+
+
+def test_accented_names_match_plain_queries_and_the_reverse():
+    index = build_index(patient("1", "José Álvarez"), patient("2", "Jose Smith"))
+    ids, total = index.search("alvarez")
+    assert ids == ["1"] and total == 1
+    ids, total = index.search("José")
+    assert sorted(ids) == ["1", "2"] and total == 2
+
+
+def test_short_queries_match_anywhere_in_a_field():
+    index = build_index(patient("1", "Anna Lee"), patient("2", "Bob Stone"), patient("3", "Lena Ng"))
+    # "ee" only occurs inside "Lee"; "on" only inside "Stone"
+    assert index.search("ee")[0] == ["1"]
+    assert index.search("on")[0] == ["2"]
+    ids, total = index.search("n")
+    assert total == 3 and set(ids) == {"1", "2", "3"}
+
+
+def test_short_query_ranks_prefix_matches_before_substrings():
+    index = build_index(patient("1", "Maria Olsen"), patient("2", "Olga Maris"))
+    assert index.search("ol")[0] == ["2", "1"]
+
+
+def test_without_limit_every_match_is_returned():
+    index = build_index(*(patient(str(i), f"Patient {i}") for i in range(120)))
+    ids, total = index.search("patient")
+    assert total == 120 and len(ids) == 120
+    page, total = index.search("patient", limit=50, offset=100)
+    assert total == 120 and len(page) == 20
+
+
+def test_empty_query_lists_everyone_in_insertion_order():
+    index = build_index(patient("b", "Bea"), patient("a", "Al"))
+    assert index.search("") == (["b", "a"], 2)
+
+
+def test_removed_and_updated_records_leave_no_stale_postings():
+    index = build_index(patient("1", "Anna Lee"))
+    index.add(patient("1", "Zed Park"))
+    assert index.search("ee") == ([], 0)
+    assert index.search("ar")[0] == ["1"]
+    index.remove("1")
+    assert index.search("ar") == ([], 0)
+    assert len(index) == 0
+
+
+def test_fuzzy_tolerates_one_typo_in_a_name():
+    index = build_index(patient("1", "Jonathan Doe"))
+    assert index.search("jonathna") == ([], 0)
+    assert index.search("jonathna", fuzzy=True)[0] == ["1"]
+
+
+@pytest.fixture
+def registry():
+    rng = random.Random(7)
+    names = ["Anna", "Bob", "Lena", "Maria", "Olga", "Zoë", "Ed", "Al", "Lee", "Stone", "Ng", "O'Brien"]
+    return build_index(*(
+        patient(
+            str(i),
+            f"{rng.choice(names)} {rng.choice(names)}",
+            rng.choice(["", "AL-", "MRN-", "E-"]) + str(i),
+            email=rng.choice([None, f"{rng.choice(names)}{i}@example.com"]),
+            phone=rng.choice([None, f"555-{i:04d}"]),
+        )
+        for i in range(400)
+    ))
+
+
+@pytest.mark.parametrize("query", ["a", "e", "al", "ed", "5", "n", "o'", "é", "zz"])
+def test_short_query_pages_match_the_full_ranking(registry, query):
+    ranked, total = registry.search(query)
+    for offset in (0, 7, 30):
+        assert registry.search(query, limit=10, offset=offset) == (ranked[offset:offset + 10], total)
+
+
+def test_short_query_pages_do_not_score_matches_one_by_one(registry, monkeypatch):
+    def score_candidates(query, candidates):
+        raise AssertionError("short query scored every match")
+
+    monkeypatch.setattr(registry, "_score_candidates", score_candidates)
+    ids, total = registry.search("a", limit=5)
+    assert len(ids) == 5 and total > 100
+
+
+def test_search_request_has_no_default_limit():
+    from routers.patient import PatientSearchRequest
+
+    assert PatientSearchRequest(query="a").limit is None
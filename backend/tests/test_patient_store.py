@@ -0,0 +1,183 @@
+import json
+import multiprocessing
+
+import pytest
+
+from core import patient_store
+from core.patient_store import DuplicateMrnError, PatientRepository
+
+
+def patient(patient_id, name, mrn="", email=None, phone=None):
+    return {"id": patient_id, "name": name, "medicalRecordNumber": mrn or f"MRN-{patient_id}", "email": email, "phone": phone}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "patients.db")
+
+
+@pytest.fixture
+def repository(db_path):
+    repository = PatientRepository(db_path)
+    yield repository
+    repository.close()
+
+
+def test_insert_and_look_up_by_id_and_mrn(repository):
+    repository.insert(patient("1", "Anna Lee", "ab-100"))
+    repository.insert(patient("2", "Bob Stone"))
+    assert len(repository) == 2
+    assert repository.get("1")["name"] == "Anna Lee"
+    assert repository.get("3") is None
+    assert repository.get_by_mrn("AB-100")["id"] == "1"
+    assert repository.get_by_mrn("AB-101") is None
+    assert [record["id"] for record in repository.all()] == ["1", "2"]
+
+
+def test_mrns_are_unique_regardless_of_case(repository):
+    repository.insert(patient("1", "Anna Lee", "AB-100"))
+    with pytest.raises(DuplicateMrnError):
+        repository.insert(patient("2", "Bob Stone", "ab-100"))
+    repository.insert(patient("2", "Bob Stone", "AB-200"))
+    with pytest.raises(DuplicateMrnError):
+        repository.update("2", {"medicalRecordNumber": "Ab-100"})
+    # A failed write leaves the indexes as they were
+    assert repository.get_by_mrn("AB-200")["id"] == "2"
+    assert repository.mrn_in_use("ab-100")
+    assert not repository.mrn_in_use("ab-100", exclude_id="1")
+
+
+def test_update_reindexes_the_mrn_and_keeps_the_listing_order(repository):
+    repository.insert(patient("1", "Anna Lee", "AB-100"))
+    repository.insert(patient("2", "Bob Stone"))
+    updated = repository.update("1", {"medicalRecordNumber": "AB-101", "name": "Anna Leigh"})
+    assert updated["name"] == "Anna Leigh"
+    assert repository.get_by_mrn("AB-100") is None
+    assert repository.get_by_mrn("AB-101")["id"] == "1"
+    assert [record["id"] for record in repository.all()] == ["1", "2"]
+    assert repository.search("leigh")[0] == [updated]
+    assert repository.update("3", {"name": "Nobody"}) is None
+
+
+def test_delete_removes_the_patient_from_every_index(repository):
+    repository.insert(patient("1", "Anna Lee", "AB-100"))
+    assert repository.delete("1")["name"] == "Anna Lee"
+    assert repository.delete("1") is None
+    assert repository.get("1") is None
+    assert repository.get_by_mrn("AB-100") is None
+    assert repository.search("anna") == ([], 0)
+
+
+def test_allocated_ids_are_never_reused(db_path, repository):
+    first = repository.allocate_id()
+    repository.insert(patient(first, "Anna Lee"))
+    second = repository.allocate_id()
+    repository.insert(patient(second, "Bob Stone"))
+    repository.delete(second)
+    assert repository.allocate_id() == str(int(second) + 1)
+
+    reopened = PatientRepository(db_path)
+    try:
+        assert reopened.allocate_id() == str(int(second) + 2)
+    finally:
+        reopened.close()
+
+
+def test_records_survive_a_restart(db_path, repository):
+    repository.insert(patient("1", "Anna Lee", "AB-100"))
+    reopened = PatientRepository(db_path)
+    try:
+        assert reopened.get_by_mrn("ab-100")["name"] == "Anna Lee"
+        assert reopened.search("anna")[1] == 1
+    finally:
+        reopened.close()
+
+
+def test_replace_all(repository):
+    repository.insert(patient("1", "Anna Lee"))
+    repository.replace_all([patient("5", "Bob Stone"), patient("6", "Lena Ng")])
+    assert [record["id"] for record in repository.all()] == ["5", "6"]
+    assert repository.get("1") is None
+    assert repository.search("lena")[1] == 1
+
+
+def test_legacy_json_file_is_imported_once(repository, tmp_path):
+    legacy_file = tmp_path / "patients.json"
+    legacy_file.write_text(json.dumps([patient("1", "Anna Lee"), patient("4", "Bob Stone")]))
+    assert repository.import_json_file(str(legacy_file)) == 2
+    repository.delete("4")
+    assert repository.import_json_file(str(legacy_file)) == 0
+    assert repository.get("4") is None
+    # New ids continue after the imported ones
+    assert repository.allocate_id() == "5"
+
+
+@pytest.fixture
+def other_worker(db_path, repository):
+    """A second repository on the same database, standing in for another worker process"""
+    other = PatientRepository(db_path)
+    yield other
+    other.close()
+
+
+def test_writes_by_another_worker_are_picked_up(repository, other_worker):
+    generation = other_worker.generation()
+    repository.insert(patient("1", "Anna Lee", "AB-100"))
+    assert other_worker.generation() > generation
+    assert other_worker.get_by_mrn("ab-100")["id"] == "1"
+    assert other_worker.search("anna")[1] == 1
+
+    repository.update("1", {"medicalRecordNumber": "AB-101"})
+    assert other_worker.get_by_mrn("AB-100") is None
+    # The old MRN is free again in the other worker too
+    other_worker.insert(patient("2", "Bob Stone", "AB-100"))
+    assert repository.get_by_mrn("ab-100")["id"] == "2"
+
+    repository.delete("2")
+    assert other_worker.get("2") is None
+    assert other_worker.search("bob") == ([], 0)
+
+
+def test_writes_check_uniqueness_against_other_workers(repository, other_worker):
+    repository.insert(patient("1", "Anna Lee", "AB-100"))
+    with pytest.raises(DuplicateMrnError):
+        other_worker.insert(patient("2", "Bob Stone", "ab-100"))
+    ids = {repository.allocate_id(), other_worker.allocate_id(), repository.allocate_id()}
+    assert len(ids) == 3
+
+
+def test_replace_all_reloads_other_workers(repository, other_worker):
+    repository.insert(patient("1", "Anna Lee"))
+    assert other_worker.get("1") is not None
+    repository.replace_all([patient("5", "Bob Stone")])
+    assert [record["id"] for record in other_worker.all()] == ["5"]
+
+
+def test_worker_behind_a_pruned_change_log_reloads(monkeypatch, repository, other_worker):
+    monkeypatch.setattr(patient_store, "CHANGE_LOG_RETENTION", 1)
+    assert len(other_worker) == 0
+    for patient_id in "123":
+        repository.insert(patient(patient_id, f"Patient {patient_id}"))
+    assert [record["id"] for record in other_worker.all()] == ["1", "2", "3"]
+
+
+def insert_patients(db_path, worker, count):
+    repository = PatientRepository(db_path)
+    try:
+        for _ in range(count):
+            patient_id = repository.allocate_id()
+            repository.insert(patient(patient_id, f"Worker {worker}", f"W{worker}-{patient_id}"))
+    finally:
+        repository.close()
+
+
+def test_concurrent_worker_processes_do_not_lose_writes(db_path, repository):
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=insert_patients, args=(db_path, worker, 20)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+    assert len(repository) == 80
+    assert sorted(int(record["id"]) for record in repository.all()) == list(range(1, 81))
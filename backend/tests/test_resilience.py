@@ -0,0 +1,297 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+from benchmarks import fake_upstream
+from core import resilience
+from core.config import settings
+from core.metrics import UPSTREAM_HEDGES
+from core.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    UpstreamUnavailableError,
+    call_upstream,
+    hedged,
+)
+from core.scheduler import UpstreamBusyError
+
+
+class CountingApp:
+    """Wraps the fake upstream and counts the HTTP requests that reach it"""
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.requests += 1
+        await self.app(scope, receive, send)
+
+
+@pytest.fixture(autouse=True)
+def fault_settings(monkeypatch):
+    for name, value in {
+        "chat_latency": 0.0,
+        "request_latency": 0.0,
+        "reply_words": 3,
+        "error_rate": 0.0,
+        "error_statuses": [503],
+        "slow_rate": 0.0,
+        "slow_latency": 1.0,
+    }.items():
+        monkeypatch.setattr(fake_upstream.config, name, value)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_MAX_DELAY", 0.02)
+    monkeypatch.setattr(settings, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(settings, "CIRCUIT_RESET_SECONDS", 0.2)
+    monkeypatch.setattr(settings, "HEDGE_PERCENTILE", 0.95)
+    monkeypatch.setattr(settings, "HEDGE_MIN_DELAY", 0.05)
+
+
+def run_with_client(scenario):
+    """Run scenario(client, upstream) against the fake upstream's OpenAI routes"""
+    upstream = CountingApp(fake_upstream.app)
+
+    async def main():
+        client = AsyncOpenAI(
+            api_key="test",
+            base_url="http://fake-upstream/v1",
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=upstream)),
+            max_retries=0,
+        )
+        try:
+            return await scenario(client, upstream)
+        finally:
+            await client.close()
+
+    return asyncio.run(main())
+
+
+def completion(client):
+    return lambda: client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "Hi"}])
+
+
+def test_transient_failures_are_retried_until_success():
+    async def scenario(client, upstream):
+        fake_upstream.config.error_rate = 1.0
+        create = completion(client)
+
+        async def flaky_then_healthy():
+            if upstream.requests == 2:
+                fake_upstream.config.error_rate = 0.0
+            return await create()
+
+        response = await call_upstream("openai", "test_retry", flaky_then_healthy)
+        return response, upstream.requests
+
+    response, requests = run_with_client(scenario)
+    assert response.choices[0].message.content == fake_upstream.reply_text()
+    assert requests == 3
+
+
+def test_exhausted_retries_raise_upstream_unavailable():
+    async def scenario(client, upstream):
+        fake_upstream.config.error_rate = 1.0
+        with pytest.raises(UpstreamUnavailableError) as raised:
+            await call_upstream("openai", "test_exhausted", completion(client))
+        return raised.value, upstream.requests
+
+    error, requests = run_with_client(scenario)
+    assert requests == settings.UPSTREAM_RETRY_ATTEMPTS
+    assert error.status_code == 503
+    assert isinstance(error.__cause__, openai.InternalServerError)
+
+
+def test_non_idempotent_calls_are_not_retried_after_a_500():
+    async def scenario(client, upstream):
+        fake_upstream.config.error_rate = 1.0
+        fake_upstream.config.error_statuses = [500]
+        with pytest.raises(openai.InternalServerError):
+            await call_upstream("openai", "test_non_idempotent", completion(client), idempotent=False)
+        return upstream.requests
+
+    assert run_with_client(scenario) == 1
+
+
+def test_client_errors_are_not_retried():
+    async def scenario(client, upstream):
+        fake_upstream.config.error_rate = 1.0
+        fake_upstream.config.error_statuses = [400]
+        with pytest.raises(openai.BadRequestError):
+            await call_upstream("openai", "test_client_error", completion(client))
+        return upstream.requests
+
+    assert run_with_client(scenario) == 1
+    # The upstream answered, so the failure does not count against the circuit
+    assert resilience.get_circuit_breaker("openai").failures == 0
+
+
+def test_deadline_cuts_off_a_slow_attempt():
+    async def scenario(client, upstream):
+        fake_upstream.config.slow_rate = 1.0
+        started = time.monotonic()
+        with pytest.raises(asyncio.TimeoutError):
+            await call_upstream("openai", "test_deadline", completion(client), deadline=time.monotonic() + 0.2)
+        return time.monotonic() - started
+
+    assert run_with_client(scenario) < 0.9
+
+
+def test_circuit_opens_fails_fast_and_closes_after_a_successful_probe(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_ATTEMPTS", 1)
+
+    async def scenario(client, upstream):
+        fake_upstream.config.error_rate = 1.0
+        for _ in range(settings.CIRCUIT_FAILURE_THRESHOLD):
+            with pytest.raises(UpstreamUnavailableError):
+                await call_upstream("openai", "test_circuit", completion(client))
+        breaker = resilience.get_circuit_breaker("openai")
+        assert breaker.state == CircuitBreaker.OPEN
+
+        requests = upstream.requests
+        with pytest.raises(CircuitOpenError) as raised:
+            await call_upstream("openai", "test_circuit", completion(client))
+        assert upstream.requests == requests
+        assert raised.value.retry_after >= 1
+
+        await asyncio.sleep(settings.CIRCUIT_RESET_SECONDS)
+        fake_upstream.config.error_rate = 0.0
+        await call_upstream("openai", "test_circuit", completion(client))
+        return breaker.state
+
+    assert run_with_client(scenario) == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker("probe-test", failure_threshold=1, reset_seconds=0.05)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()
+    # Only one probe at a time while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def hedge_count(stage: str, winner: str) -> float:
+    return UPSTREAM_HEDGES._values.get((stage, winner), 0)
+
+
+def test_slow_primary_is_hedged_and_the_duplicate_wins():
+    calls = []
+
+    async def call():
+        calls.append(len(calls))
+        await asyncio.sleep(1.0 if len(calls) == 1 else 0.01)
+        return f"copy {len(calls)}"
+
+    started = time.monotonic()
+    assert asyncio.run(hedged("test_hedge_wins", call, LatencyTracker())) == "copy 2"
+    assert time.monotonic() - started < 0.5
+    assert hedge_count("test_hedge_wins", "hedge") == 1
+
+
+def test_fast_call_is_not_hedged():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        return "done"
+
+    assert asyncio.run(hedged("test_no_hedge", call, LatencyTracker())) == "done"
+    assert calls == 1
+
+
+def test_hedge_survives_a_failed_primary():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(0.1)
+            raise RuntimeError("primary failed")
+        await asyncio.sleep(0.1)
+        return "hedge"
+
+    assert asyncio.run(hedged("test_primary_fails", call, LatencyTracker())) == "hedge"
+
+
+def test_hedge_survives_a_cancelled_copy():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(0.1)
+            # e.g. the transport cancelled the request underneath us
+            raise asyncio.CancelledError()
+        await asyncio.sleep(0.15)
+        return "hedge"
+
+    assert asyncio.run(hedged("test_copy_cancelled", call, LatencyTracker())) == "hedge"
+
+
+def test_both_copies_failing_raises_the_last_error():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        number = calls
+        await asyncio.sleep(0.1)
+        raise RuntimeError(f"copy {number} failed")
+
+    with pytest.raises(RuntimeError, match="failed"):
+        asyncio.run(hedged("test_both_fail", call, LatencyTracker()))
+    assert hedge_count("test_both_fail", "none") == 1
+
+
+def test_rejected_hedge_admission_leaves_the_primary_running():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.15)
+        return "primary"
+
+    class Busy:
+        async def __aenter__(self):
+            raise UpstreamBusyError("no slot", 1)
+
+        async def __aexit__(self, *exc):
+            return False
+
+    assert asyncio.run(hedged("test_hedge_rejected", call, LatencyTracker(), admit=Busy)) == "primary"
+    assert calls == 1
+
+
+def test_hedging_delay_follows_recent_latency():
+    latencies = LatencyTracker()
+    for _ in range(50):
+        latencies.observe(0.3)
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.2)
+        return "primary"
+
+    # 0.2s is under the 0.3s p95, so no duplicate is started
+    assert asyncio.run(hedged("test_hedge_p95", call, latencies)) == "primary"
+    assert calls == 1
@@ -0,0 +1,182 @@
+import gzip
+import json
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core import response_cache
+from core.response_cache import ResponseCache, choose_encoding, etag_matches
+from routers.patient import router as patient_router
+
+
+class Builder:
+    """Counts builds and serves whatever payload it currently holds"""
+
+    def __init__(self, payload, headers=None):
+        self.payload = payload
+        self.headers = headers or {}
+        self.builds = 0
+
+    def __call__(self):
+        self.builds += 1
+        return self.payload, self.headers
+
+
+def respond(cache, build, generation=1, key=("patients",), **request_headers):
+    headers = {name.replace("_", "-"): value for name, value in request_headers.items()}
+    return cache.respond(key, generation, build, headers)
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(max_bytes=1024 * 1024, min_compress_bytes=100)
+
+
+def test_responses_are_reused_until_the_generation_changes(cache):
+    build = Builder([{"id": "1", "name": "Anna Lee"}])
+    first = respond(cache, build)
+    assert (first.status_code, first.media_type) == (200, "application/json")
+    assert json.loads(first.body) == [{"id": "1", "name": "Anna Lee"}]
+    assert respond(cache, build).body == first.body
+    assert build.builds == 1
+
+    build.payload = [{"id": "1", "name": "Anna Leigh"}]
+    changed = respond(cache, build, generation=2)
+    assert build.builds == 2
+    assert json.loads(changed.body)[0]["name"] == "Anna Leigh"
+    assert changed.headers["ETag"] != first.headers["ETag"]
+
+
+def test_matching_if_none_match_answers_304(cache):
+    build = Builder({"id": "1"}, headers={"X-Next-Cursor": "abc"})
+    etag = respond(cache, build).headers["ETag"]
+    assert etag.startswith('W/"')
+
+    for if_none_match in (etag, etag.removeprefix("W/"), f'"other", {etag}', "*"):
+        not_modified = respond(cache, build, if_none_match=if_none_match)
+        assert (not_modified.status_code, not_modified.body) == (304, b"")
+        assert not_modified.headers["ETag"] == etag
+        assert not_modified.headers["X-Next-Cursor"] == "abc"
+    assert respond(cache, build, if_none_match='"other"').status_code == 200
+    # A changed store invalidates the client's copy
+    assert respond(cache, build, generation=2, if_none_match='"stale"').status_code == 200
+
+
+def test_etags_depend_only_on_the_body():
+    # Every worker process computes the same tag for the same data
+    build = Builder({"id": "1"})
+    one = respond(ResponseCache(1024, 0), build, generation=1)
+    other = respond(ResponseCache(1024, 0), build, generation=7)
+    assert one.headers["ETag"] == other.headers["ETag"]
+
+
+def test_large_bodies_are_gzipped_once_for_clients_that_accept_it(cache):
+    build = Builder([{"id": str(n), "name": "Anna Lee"} for n in range(20)])
+    plain = respond(cache, build)
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Vary"] == "Accept-Encoding"
+
+    compressed = respond(cache, build, accept_encoding="gzip, deflate")
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.body) == plain.body
+    assert respond(cache, build, accept_encoding="gzip").body is compressed.body
+    assert respond(cache, build, accept_encoding="gzip;q=0").body == plain.body
+
+
+def test_small_bodies_are_not_compressed(cache):
+    small = respond(cache, Builder({"id": "1"}), accept_encoding="gzip")
+    assert "Content-Encoding" not in small.headers
+
+
+def test_brotli_is_preferred_when_installed(monkeypatch):
+    assert choose_encoding("br, gzip") == ("br" if response_cache.brotli is not None else "gzip")
+
+    class Brotli:
+        @staticmethod
+        def compress(body, quality):
+            return b"br:" + body
+
+    monkeypatch.setattr(response_cache, "brotli", Brotli)
+    assert choose_encoding("gzip, br") == "br"
+    assert choose_encoding("gzip, br;q=0") == "gzip"
+    assert choose_encoding("*") == "br"
+    assert choose_encoding("identity") is None
+    assert choose_encoding("") is None
+
+    cache = ResponseCache(max_bytes=1024 * 1024, min_compress_bytes=1)
+    body = respond(cache, Builder({"id": "1"}), accept_encoding="br")
+    assert (body.headers["Content-Encoding"], body.body) == ("br", b'br:{"id":"1"}')
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_bytes=30, min_compress_bytes=0)
+    builds = {name: Builder({"name": name}) for name in ("a", "b", "c")}
+    for name in ("a", "b"):
+        respond(cache, builds[name], key=("patient", name))
+    respond(cache, builds["a"], key=("patient", "a"))
+    respond(cache, builds["c"], key=("patient", "c"))
+    # b was least recently used when c was added
+    for name in ("a", "c", "b"):
+        respond(cache, builds[name], key=("patient", name))
+    assert {name: build.builds for name, build in builds.items()} == {"a": 1, "b": 2, "c": 1}
+
+
+def test_bodies_larger_than_the_cache_are_served_but_not_kept():
+    cache = ResponseCache(max_bytes=10, min_compress_bytes=0)
+    build = Builder({"name": "Anna Lee"})
+    assert respond(cache, build).status_code == 200
+    respond(cache, build)
+    assert build.builds == 2
+
+
+def test_failed_builds_are_not_cached(cache):
+    calls = []
+
+    def build():
+        calls.append(1)
+        if len(calls) == 1:
+            raise LookupError("Patient not found")
+        return {"id": "1"}, {}
+
+    with pytest.raises(LookupError):
+        respond(cache, build)
+    assert respond(cache, build).status_code == 200
+    assert len(calls) == 2
+
+
+def test_etag_matches_compares_weakly():
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"abc"', 'W/"abc"')
+    assert not etag_matches('"abcd"', 'W/"abc"')
+
+
+def test_patient_reads_answer_304_until_a_patient_changes():
+    app = FastAPI()
+    app.include_router(patient_router, prefix="/patients")
+    client = TestClient(app)
+
+    def create_patient():
+        mrn = f"MRN-{uuid.uuid4().hex[:8]}"
+        response = client.post("/patients/", json={
+            "name": "Anna Lee", "dateOfBirth": "1990-01-01", "medicalRecordNumber": mrn, "lastVisit": "2024-01-01",
+        })
+        assert response.status_code == 200
+        return response.json()["id"]
+
+    patient_id = create_patient()
+    listing = client.get("/patients/")
+    etag = listing.headers["etag"]
+    assert client.get("/patients/", headers={"If-None-Match": etag}).status_code == 304
+
+    single = client.get(f"/patients/{patient_id}")
+    assert single.json()["id"] == patient_id
+    assert client.get(f"/patients/{patient_id}", headers={"If-None-Match": single.headers["etag"]}).status_code == 304
+    assert client.get("/patients/missing").status_code == 404
+
+    create_patient()
+    changed = client.get("/patients/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert len(changed.json()) == len(listing.json()) + 1
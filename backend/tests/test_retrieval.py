@@ -0,0 +1,143 @@
+import re
+
+import pytest
+
+from core.config import settings
+from core.document_store import DocumentStore
+from core.retrieval import BM25Index, chunk_text, estimate_tokens, tokenize
+from routers import thinker
+from routers.thinker import load_document_index, select_document_content
+
+
+def numbered_lines(count: int, width: int = 60) -> str:
+    return "\n".join(f"Line {number:03d} ".ljust(width, "x") for number in range(count))
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is the MRI result, for the LEFT knee?") == ["mri", "result", "left", "knee"]
+
+
+def test_chunks_stay_within_the_limit_and_cover_every_line():
+    text = numbered_lines(100)
+    chunks = chunk_text(text, max_tokens=100, overlap_tokens=20)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 * 4 for chunk in chunks)
+    lines = [line for chunk in chunks for line in chunk.split("\n")]
+    assert sorted(set(lines)) == text.split("\n")
+
+
+def test_consecutive_chunks_overlap_by_whole_trailing_lines():
+    chunks = chunk_text(numbered_lines(100), max_tokens=100, overlap_tokens=20)
+    for previous, current in zip(chunks, chunks[1:]):
+        previous_lines, current_lines = previous.split("\n"), current.split("\n")
+        # 80 characters of overlap carry one 60-character line
+        assert current_lines[0] == previous_lines[-1]
+        assert current_lines[1] not in previous_lines
+
+
+def test_without_overlap_chunks_partition_the_text():
+    text = numbered_lines(50)
+    chunks = chunk_text(text, max_tokens=100, overlap_tokens=0)
+    assert "\n".join(chunks) == text
+
+
+def test_lines_longer_than_a_chunk_are_split_on_whitespace():
+    words = [f"word{number}" for number in range(200)]
+    chunks = chunk_text(" ".join(words), max_tokens=25, overlap_tokens=0)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert " ".join(chunks).split() == words
+
+
+def test_blank_text_has_no_chunks():
+    assert chunk_text("  \n\n \n") == []
+
+
+PASSAGES = [
+    "The patient reports knee pain after running.",
+    "Blood pressure 120/80. Heart rate 72. No chest pain.",
+    "MRI of the left knee shows a meniscus tear. Knee effusion present.",
+    "Follow up in two weeks for blood work.",
+]
+
+
+def test_bm25_ranks_passages_by_term_weight():
+    index = BM25Index(PASSAGES)
+    ranked = [position for position, _ in index.search("meniscus knee")]
+    # The passage with the rare term and both mentions of "knee" first
+    assert ranked == [2, 0]
+    scores = dict(index.search("blood"))
+    assert set(scores) == {1, 3}
+
+
+def test_bm25_prefers_shorter_passages_for_the_same_matches():
+    index = BM25Index(["knee " + "filler " * 40, "knee swelling", "unrelated words here"])
+    assert [position for position, _ in index.search("knee")] == [1, 0]
+
+
+def test_bm25_ignores_unknown_and_stop_words():
+    index = BM25Index(PASSAGES)
+    assert index.search("the of and") == []
+    assert index.search("fracture") == []
+    assert BM25Index([]).search("knee") == []
+    assert len(index.search("knee blood pain heart", top_k=2)) == 2
+
+
+def test_select_keeps_the_best_passages_that_fit_in_document_order():
+    passages = ["knee " * 20, "knee knee", "knee pain", "ankle"]
+    index = BM25Index(passages)
+    budget = estimate_tokens(passages[1]) + estimate_tokens(passages[2])
+    # The long passage does not fit, the two short ones do
+    assert index.select("knee", budget) == [1, 2]
+    assert index.select("knee", 0) == []
+
+
+@pytest.fixture
+def stored_document(tmp_path, monkeypatch):
+    """A stored document of 40 visit notes, only note 25 mentioning a meniscus"""
+    store = DocumentStore(str(tmp_path / "documents"))
+    monkeypatch.setattr(thinker, "get_document_store", lambda: store)
+    monkeypatch.setattr(settings, "RETRIEVAL_CHUNK_TOKENS", 50)
+    monkeypatch.setattr(settings, "RETRIEVAL_TOP_K", 3)
+    load_document_index.cache_clear()
+    lines = [f"Visit note {number}: vitals stable, routine review, nothing new to report." for number in range(40)]
+    lines[25] = "Visit note 25: MRI shows a meniscus tear in the left knee."
+    text = "\n".join(lines)
+    digest = store.put_inline_text(text)
+    yield {"sha256": digest}, text
+    load_document_index.cache_clear()
+
+
+def passage_numbers(content: str) -> list:
+    return [int(number) for number in re.findall(r"\[Passage (\d+) of \d+\]", content)]
+
+
+def test_documents_within_the_budget_are_sent_whole(stored_document):
+    document_ref, text = stored_document
+    assert select_document_content(document_ref, text, "meniscus", estimate_tokens(text)) == text
+    # Without a stored reference there is nothing to rank
+    assert select_document_content(None, text, "meniscus", 10) == text
+
+
+def test_large_documents_send_the_matches_then_opening_passages_within_the_budget(stored_document):
+    document_ref, text = stored_document
+    passages = load_document_index(document_ref["sha256"]).passages
+    content = select_document_content(document_ref, text, "meniscus tear", 300)
+    numbers = passage_numbers(content)
+    matches = [number for number in numbers if "meniscus" in passages[number - 1]]
+    assert matches and numbers == sorted(numbers)
+    # Budget left after the matches is filled from the start of the document
+    assert numbers[0] == 1 and numbers[-1] > 20
+    assert set(numbers) - set(matches) == set(range(1, len(numbers) - len(matches) + 1))
+    assert sum(estimate_tokens(passages[number - 1]) for number in numbers) <= 300
+
+
+def test_when_nothing_matches_the_opening_passages_fill_the_budget(stored_document):
+    document_ref, text = stored_document
+    content = select_document_content(document_ref, text, "fracture", 120)
+    numbers = passage_numbers(content)
+    assert numbers == list(range(1, len(numbers) + 1))
+    assert "meniscus" not in content
+    passages = load_document_index(document_ref["sha256"]).passages
+    assert sum(estimate_tokens(passages[number - 1]) for number in numbers) <= 120
+    # The next passage would not have fit
+    assert sum(estimate_tokens(passages[number]) for number in range(len(numbers) + 1)) > 120
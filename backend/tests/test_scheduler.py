@@ -0,0 +1,180 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+from core import scheduler
+from core.scheduler import BACKGROUND_PRIORITY, TokenBucket, UpstreamBusyError, UpstreamScheduler
+
+
+def make_scheduler(**options) -> UpstreamScheduler:
+    values = {
+        "concurrency": {"chat": 4, "document": 4, "imaging": 4},
+        "max_wait": {"chat": 5.0, "document": 5.0, "imaging": 5.0},
+        "tokens_per_minute": {},
+        "max_queue": 0,
+    }
+    values.update(options)
+    return UpstreamScheduler(**values)
+
+
+async def hold(upstreams: UpstreamScheduler, lane: str, release: asyncio.Event, **options):
+    async with upstreams.admit(lane, "azure", 10, **options):
+        await release.wait()
+
+
+async def call(upstreams: UpstreamScheduler, lane: str, seconds: float, **options):
+    async with upstreams.admit(lane, "azure", 10, **options):
+        await asyncio.sleep(seconds)
+
+
+def test_freed_slots_go_to_chat_then_other_lanes_then_background():
+    async def scenario():
+        upstreams = make_scheduler(total_concurrency=1)
+        order, release = [], asyncio.Event()
+
+        async def request(name, lane, **options):
+            async with upstreams.admit(lane, "azure", 10, **options):
+                order.append(name)
+
+        holder = asyncio.create_task(hold(upstreams, "document", release))
+        await asyncio.sleep(0.01)
+        requests = [
+            asyncio.create_task(request("background", "document", priority=BACKGROUND_PRIORITY, max_wait=math.inf)),
+            asyncio.create_task(request("imaging", "imaging")),
+            asyncio.create_task(request("document", "document")),
+            asyncio.create_task(request("chat", "chat")),
+        ]
+        await asyncio.sleep(0.01)
+        assert order == []
+        release.set()
+        await asyncio.gather(holder, *requests)
+        return order
+
+    # Same-priority lanes keep their arrival order
+    assert asyncio.run(scenario()) == ["chat", "imaging", "document", "background"]
+
+
+def test_the_chat_reserve_is_kept_free_of_other_lanes():
+    async def scenario():
+        upstreams = make_scheduler(total_concurrency=2, interactive_reserve=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(upstreams, "document", release))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamBusyError):
+            await call(upstreams, "imaging", 0, max_wait=0.05)
+        await call(upstreams, "chat", 0, max_wait=0.05)
+        release.set()
+        await holder
+
+    asyncio.run(scenario())
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_token_bucket_refills_continuously_up_to_a_minute_of_tokens(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    bucket = TokenBucket(600)
+    bucket.take(600)
+    assert bucket.wait_time(100) == pytest.approx(10.0)
+    clock.now += 5
+    assert bucket.wait_time(100) == pytest.approx(5.0)
+    clock.now += 600
+    assert bucket.wait_time(600) == 0.0 and bucket.tokens == 600
+    # Requests larger than the bucket wait for a full bucket rather than forever
+    bucket.take(10000)
+    assert bucket.tokens == 0 and bucket.wait_time(10000) == pytest.approx(60.0)
+
+
+def test_requests_over_the_quota_wait_for_the_refill():
+    async def scenario():
+        # 10 tokens a second; the second request waits for 5
+        upstreams = make_scheduler(tokens_per_minute={"azure": 600})
+        async with upstreams.admit("chat", "azure", 600):
+            pass
+        started = time.monotonic()
+        async with upstreams.admit("chat", "azure", 5, max_wait=2.0):
+            waited = time.monotonic() - started
+        with pytest.raises(UpstreamBusyError) as raised:
+            async with upstreams.admit("chat", "azure", 300, max_wait=2.0):
+                pass
+        return waited, raised.value.retry_after
+
+    waited, retry_after = asyncio.run(scenario())
+    assert 0.4 <= waited < 1.5
+    assert retry_after == pytest.approx(30, abs=1)
+
+
+def test_full_lanes_reject_up_front_once_their_calls_take_too_long():
+    async def scenario():
+        upstreams = make_scheduler(concurrency={"chat": 1, "document": 1, "imaging": 1})
+        # One call teaches the scheduler that a chat slot is held for about 0.2s
+        await call(upstreams, "chat", 0.2)
+
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(upstreams, "chat", release))
+        await asyncio.sleep(0.01)
+        # Next in line: the slot frees in about 0.2s
+        queued = asyncio.create_task(call(upstreams, "chat", 0, max_wait=0.3))
+        await asyncio.sleep(0.01)
+        # Second in line: about 0.4s, over the limit, so rejected without waiting
+        started = time.monotonic()
+        with pytest.raises(UpstreamBusyError) as raised:
+            await call(upstreams, "chat", 0, max_wait=0.3)
+        rejected_after = time.monotonic() - started
+        release.set()
+        await asyncio.gather(holder, queued)
+        return rejected_after, raised.value
+
+    rejected_after, error = asyncio.run(scenario())
+    assert rejected_after < 0.05
+    assert error.retry_after == pytest.approx(0.4, abs=0.05) and error.retry_after_header == "1"
+
+
+def test_lanes_without_history_wait_and_time_out():
+    async def scenario():
+        upstreams = make_scheduler(concurrency={"chat": 1, "document": 1, "imaging": 1}, max_queue=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(upstreams, "chat", release))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        waiting = asyncio.create_task(call(upstreams, "chat", 0, max_wait=0.1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(UpstreamBusyError, match="Too many chat requests"):
+            await call(upstreams, "chat", 0, max_wait=0.1)
+        with pytest.raises(UpstreamBusyError, match="busy"):
+            await waiting
+        timed_out_after = time.monotonic() - started
+        release.set()
+        await holder
+        return timed_out_after, upstreams._waiters, upstreams._queued["chat"], upstreams._active["chat"]
+
+    timed_out_after, waiters, queued, active = asyncio.run(scenario())
+    assert 0.1 <= timed_out_after < 0.3
+    assert (waiters, queued, active) == ([], 0, 0)
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        upstreams = make_scheduler(concurrency={"chat": 1, "document": 1, "imaging": 1})
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(upstreams, "chat", release))
+        await asyncio.sleep(0.01)
+        waiting = asyncio.create_task(call(upstreams, "chat", 0))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        await holder
+        await call(upstreams, "chat", 0, max_wait=0.05)
+        return waiting.cancelled(), upstreams._waiters, upstreams._active["chat"]
+
+    assert asyncio.run(scenario()) == (True, [], 0)
@@ -0,0 +1,237 @@
+import asyncio
+import io
+import threading
+import wave
+
+import pytest
+
+from core import resilience
+from core.config import settings
+from core.result_cache import AudioCache
+from core.speech import (
+    LocalSpeechProvider,
+    SentenceSplitter,
+    SpeechPipeline,
+    SpeechSynthesizer,
+    check_voice,
+    speakable,
+    split_sentences,
+)
+
+
+@pytest.fixture(autouse=True)
+def closed_circuits(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+
+
+class CountingProvider(LocalSpeechProvider):
+    """The local provider, counting calls, with an optional per-text delay or failure"""
+
+    def __init__(self, delays=None):
+        super().__init__("test-voice", "test-model")
+        self.calls = []
+        self.delays = delays or {}
+
+    async def synthesize(self, text: str, voice: str) -> bytes:
+        self.calls.append((text, voice))
+        await asyncio.sleep(self.delays.get(text, 0))
+        if "fail" in text:
+            raise ValueError("Provider rejected the text")
+        return await super().synthesize(text, voice)
+
+
+def test_sentences_split_on_terminal_punctuation():
+    text = "Rest the knee for two days. Ice it every few hours! Does it swell? Call us."
+    assert split_sentences(text, 1, 300) == [
+        "Rest the knee for two days.",
+        "Ice it every few hours!",
+        "Does it swell?",
+        "Call us.",
+    ]
+
+
+def test_abbreviations_and_list_numbers_do_not_end_sentences():
+    text = "Dr. Smith saw the patient today. Take 5 mg. twice daily, e.g. with meals.\n1. Rest the knee.\n2. Ice it."
+    assert split_sentences(text, 1, 300) == [
+        "Dr. Smith saw the patient today.",
+        "Take 5 mg. twice daily, e.g. with meals.",
+        "1. Rest the knee.",
+        "2. Ice it.",
+    ]
+
+
+def test_short_sentences_are_merged_with_the_next():
+    assert split_sentences("Hi. Ok. Rest the knee for two days. Then walk.", 20, 300) == [
+        "Hi. Ok. Rest the knee for two days.",
+        "Then walk.",
+    ]
+
+
+def test_long_text_without_boundaries_is_cut_at_spaces():
+    text = " ".join(f"word{i}" for i in range(40))
+    sentences = split_sentences(text, 1, 50)
+    assert len(sentences) > 1
+    assert all(len(sentence) <= 50 for sentence in sentences)
+    assert " ".join(sentences) == text
+
+
+def test_streamed_text_splits_like_the_whole_text():
+    text = "Dr. Smith saw the patient. The knee is swollen! Rest it for two days and call us if it gets worse."
+    splitter = SentenceSplitter(1, 300)
+    sentences = []
+    for i in range(0, len(text), 3):
+        sentences.extend(splitter.feed(text[i:i + 3]))
+    rest = splitter.flush()
+    assert sentences + [rest] == split_sentences(text, 1, 300)
+
+
+def test_sentences_are_emitted_as_soon_as_they_end():
+    splitter = SentenceSplitter(1, 300)
+    assert splitter.feed("Rest the knee") == []
+    assert splitter.feed(". Ice") == ["Rest the knee."]
+    assert splitter.flush() == "Ice"
+    assert splitter.flush() is None
+
+
+def test_speakable_strips_markdown():
+    assert speakable("## Advice\n- **Rest** the [knee](https://example.com).\n- Ice it `daily`") == (
+        "Advice Rest the knee. Ice it daily"
+    )
+
+
+def test_check_voice():
+    assert check_voice(None) is None
+    assert check_voice("21m00Tcm4TlvDq8ikWAM") == "21m00Tcm4TlvDq8ikWAM"
+    for voice in ("../admin", "voice id", "a" * 65, ""):
+        with pytest.raises(ValueError):
+            check_voice(voice)
+
+
+def test_audio_cache_memory_tier_evicts_least_recently_used():
+    cache = AudioCache(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+
+
+def test_audio_cache_skips_clips_larger_than_the_memory_tier():
+    cache = AudioCache(max_bytes=3)
+    cache.put("a", b"aaaa")
+    assert cache.get("a") is None
+
+
+def test_audio_cache_disk_tier_is_bounded_and_survives_restarts(tmp_path):
+    cache = AudioCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10)
+    cache.put("aa1", b"aaaa")
+    cache.put("bb1", b"bbbb")
+    assert cache.get("aa1") == b"aaaa"
+    cache.put("cc1", b"cccc")
+    assert cache.get("bb1") is None
+
+    restarted = AudioCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10)
+    assert restarted.get("aa1") == b"aaaa"
+    assert restarted.get("cc1") == b"cccc"
+    assert sorted(path.name for path in tmp_path.rglob("*.audio")) == ["aa1.audio", "cc1.audio"]
+
+
+def test_audio_cache_async_methods_do_disk_io_off_the_event_loop(tmp_path, monkeypatch):
+    cache = AudioCache(max_bytes=0, disk_dir=str(tmp_path))
+    threads = []
+    for name in ("_read_disk", "_write_disk"):
+        method = getattr(cache, name)
+
+        def recorded(*args, method=method):
+            threads.append(threading.get_ident())
+            return method(*args)
+
+        monkeypatch.setattr(cache, name, recorded)
+
+    async def scenario():
+        await cache.put_async("aa1", b"aaaa")
+        return await cache.get_async("aa1"), await cache.get_async("bb1")
+
+    assert asyncio.run(scenario()) == (b"aaaa", None)
+    assert len(threads) == 3 and threading.get_ident() not in threads
+
+
+def test_local_provider_returns_a_wav_as_long_as_the_text_takes_to_read():
+    text = "Rest the knee for two days."
+    audio = asyncio.run(LocalSpeechProvider("voice", "model").synthesize(text, "voice"))
+    with wave.open(io.BytesIO(audio)) as clip:
+        seconds = clip.getnframes() / clip.getframerate()
+        assert clip.getnchannels() == 1
+    assert seconds == pytest.approx(len(text) * LocalSpeechProvider.SECONDS_PER_CHAR, abs=0.01)
+
+
+def test_synthesizer_caches_clips_per_text_and_voice():
+    provider = CountingProvider()
+    synthesizer = SpeechSynthesizer(provider, AudioCache(max_bytes=1024 * 1024))
+
+    async def scenario():
+        first = await synthesizer.synthesize("Rest the knee.")
+        again = await synthesizer.synthesize("Rest the knee.")
+        other_voice = await synthesizer.synthesize("Rest the knee.", "other-voice")
+        return first, again, other_voice
+
+    (audio, cached), (audio_again, cached_again), (other_audio, other_cached) = asyncio.run(scenario())
+    assert (cached, cached_again, other_cached) == (False, True, False)
+    assert audio_again == audio
+    assert other_audio != audio
+    assert provider.calls == [("Rest the knee.", "test-voice"), ("Rest the knee.", "other-voice")]
+
+
+def test_concurrent_requests_for_one_clip_share_a_provider_call():
+    provider = CountingProvider(delays={"Rest the knee.": 0.05})
+    synthesizer = SpeechSynthesizer(provider, AudioCache(max_bytes=1024 * 1024))
+
+    async def scenario():
+        return await asyncio.gather(*(synthesizer.synthesize("Rest the knee.") for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(provider.calls) == 1
+    assert len({audio for audio, _ in results}) == 1
+
+
+def test_pipeline_returns_clips_in_reply_order(monkeypatch):
+    monkeypatch.setattr(settings, "SPEECH_MIN_SENTENCE_CHARS", 1)
+    # The first sentence is the slowest to synthesize
+    provider = CountingProvider(delays={"Rest the knee.": 0.1, "Ice it.": 0.05})
+    synthesizer = SpeechSynthesizer(provider, AudioCache(max_bytes=1024 * 1024))
+
+    async def scenario():
+        pipeline = SpeechPipeline(synthesizer, concurrency=3)
+        for delta in ("**Rest** the kn", "ee. Ice it. Call ", "us if it swells"):
+            pipeline.feed(delta)
+        pipeline.finish()
+        await asyncio.sleep(0.07)
+        # Later clips are done, but nothing is ready until the first one is
+        ready = pipeline.ready()
+        return ready, [clip async for clip in pipeline.drain()]
+
+    ready, clips = asyncio.run(scenario())
+    assert ready == []
+    assert [(clip.index, clip.text) for clip in clips] == [
+        (0, "Rest the knee."),
+        (1, "Ice it."),
+        (2, "Call us if it swells"),
+    ]
+    assert all(clip.audio and clip.error is None for clip in clips)
+
+
+def test_pipeline_keeps_speaking_after_a_failed_clip(monkeypatch):
+    monkeypatch.setattr(settings, "SPEECH_MIN_SENTENCE_CHARS", 1)
+    synthesizer = SpeechSynthesizer(CountingProvider(), AudioCache(max_bytes=1024 * 1024))
+
+    async def scenario():
+        pipeline = SpeechPipeline(synthesizer)
+        pipeline.feed("Rest the knee. This one will fail. Ice it.")
+        pipeline.finish()
+        return [clip async for clip in pipeline.drain()]
+
+    clips = asyncio.run(scenario())
+    assert [clip.event()[0] for clip in clips] == ["audio", "audio_error", "audio"]
+    assert isinstance(clips[1].error, ValueError)
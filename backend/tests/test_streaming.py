@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from openai import AsyncAzureOpenAI
+from starlette.requests import Request
+
+from benchmarks import fake_upstream
+from core import resilience
+from core.clients import AZURE_API_VERSION
+from core.config import settings
+from core.conversation_store import get_conversation_store
+from routers import thinker
+from routers.thinker import MEDICAL_INSTRUCTIONS, build_medical_turn, stream_turn
+
+
+class RecordingUpstream:
+    """The fake upstream app, recording the path of every request it serves"""
+
+    def __init__(self):
+        self.paths = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.paths.append(scope["path"])
+        await fake_upstream.app(scope, receive, send)
+
+
+@pytest.fixture(autouse=True)
+def fast_fake_upstream(monkeypatch):
+    """A quick, fault-free fake upstream with fresh state and closed circuits"""
+    monkeypatch.setattr(fake_upstream, "threads", {})
+    monkeypatch.setattr(fake_upstream, "runs", {})
+    for name, value in {
+        "run_latency": 0.05,
+        "chat_latency": 0.05,
+        "request_latency": 0.0,
+        "token_interval": 0.0,
+        "reply_words": 5,
+        "error_rate": 0.0,
+        "slow_rate": 0.0,
+        "run_failure_rate": 0.0,
+        "requires_action_rate": 0.0,
+    }.items():
+        monkeypatch.setattr(fake_upstream.config, name, value)
+    monkeypatch.setattr(resilience, "_breakers", {})
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Route the backend's Azure client to the in-process fake upstream"""
+    recording = RecordingUpstream()
+
+    def fake_client():
+        return AsyncAzureOpenAI(
+            azure_endpoint="http://fake-upstream",
+            api_key="test",
+            api_version=AZURE_API_VERSION,
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=recording)),
+            max_retries=0,
+        )
+
+    monkeypatch.setattr(thinker, "get_azure_client", fake_client)
+    return recording
+
+
+@pytest.fixture(params=["assistants", "completions"])
+def chat_backend(request, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_BACKEND", request.param)
+    return request.param
+
+
+app = FastAPI()
+app.include_router(thinker.router)
+client = TestClient(app)
+
+
+def parse_events(body: str) -> list:
+    """(event name, data) for each server-sent event; unnamed events are "message" """
+    events = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        assert set(fields) <= {"event", "data"}
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def stored_messages(conversation_id: str, conversation_type: str) -> list:
+    return [(m["sender"], m["content"]) for m in get_conversation_store(conversation_type).get(conversation_id)["messages"]]
+
+
+def test_chat_response_stream_frames_deltas_between_conversation_and_done(upstream, chat_backend):
+    response = client.post("/chat-response/stream", data={"request": "My knee hurts"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.text.endswith("\n\n")
+
+    events = parse_events(response.text)
+    names = [name for name, _ in events]
+    assert names[0] == "conversation" and names[-1] == "done"
+    assert set(names[1:-1]) == {"message"} and len(names) > 2
+
+    conversation_id = events[0][1]["conversation_id"]
+    reply = "".join(data["delta"] for _, data in events[1:-1])
+    assert events[-1][1] == {"response": reply, "conversation_id": conversation_id}
+    assert stored_messages(conversation_id, "medical") == [("user", "My knee hurts"), ("assistant", reply)]
+
+
+def test_thinker_stream_continues_the_given_conversation(upstream, chat_backend):
+    first = parse_events(client.post("/thinker/stream", data={"query": "Summarize the report"}).text)
+    conversation_id = first[-1][1]["conversation_id"]
+
+    second = parse_events(client.post(
+        "/thinker/stream", data={"query": "Any red flags?", "conversation_id": conversation_id}
+    ).text)
+    assert second[0] == ("conversation", {"conversation_id": conversation_id})
+    assert second[-1][0] == "done" and second[-1][1]["conversation_id"] == conversation_id
+    assert [sender for sender, _ in stored_messages(conversation_id, "document")] == ["user", "assistant"] * 2
+
+
+def test_upstream_failures_end_the_stream_with_an_error_event(upstream, monkeypatch):
+    monkeypatch.setattr(fake_upstream.config, "run_failure_rate", 1.0)
+    events = parse_events(client.post("/chat-response/stream", data={"request": "My knee hurts"}).text)
+    assert [name for name, _ in events] == ["conversation", "error"]
+    assert "detail" in events[-1][1]
+
+
+def disconnecting_request(after_checks: int) -> Request:
+    """A request whose client goes away once is_disconnected() has been asked after_checks times"""
+    checks = []
+
+    async def receive():
+        checks.append(1)
+        if len(checks) > after_checks:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    return Request({"type": "http", "method": "POST", "path": "/chat-response/stream", "headers": []}, receive)
+
+
+def test_client_disconnect_cancels_the_run_and_saves_nothing(upstream):
+    async def scenario():
+        async def build():
+            conversation_id, session, content = await build_medical_turn("My knee hurts", None)
+            built.append(conversation_id)
+            return conversation_id, session, content
+
+        built = []
+        events = [event async for event in stream_turn(
+            disconnecting_request(after_checks=1), None, "My knee hurts", build, MEDICAL_INSTRUCTIONS, "medical"
+        )]
+        return built[0], parse_events("".join(events))
+
+    conversation_id, events = asyncio.run(scenario())
+    assert [name for name, _ in events][0] == "conversation"
+    assert "done" not in [name for name, _ in events]
+    assert any(path.endswith("/cancel") for path in upstream.paths)
+    assert stored_messages(conversation_id, "medical") == []
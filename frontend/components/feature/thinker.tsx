@@ -109,14 +109,15 @@ const Thinker: React.FC<ThinkerProps> = ({ conversationId }) => {
       try {
         const patientRes = await axios.get(`http://localhost:8000/conversation/${conversationId}/patient-data?conversation_type=document`);
         const patientData = patientRes.data.patient_data;
+        const patientContext = patientRes.data.patient_context;
         
         if (patientData) {
           setCurrentPatient(patientData);
           setWorkflowStep("document_analysis");
-        } else if (conversationData.patient_context) {
+        } else if (patientContext) {
           // Fallback to parsing patient context if patient_data is not available
           try {
-            const patientMatch = conversationData.patient_context.match(/Patient: (.+?) \(MRN: (.+?), DOB: (.+?)\)/);
+            const patientMatch = patientContext.match(/Patient: (.+?) \(MRN: (.+?), DOB: (.+?)\)/);
             if (patientMatch) {
               const parsedPatientData: Patient = {
                 id: patientMatch[2], // MRN as ID
@@ -130,17 +131,17 @@ const Thinker: React.FC<ThinkerProps> = ({ conversationId }) => {
               };
               
               // Extract additional patient information
-              const allergiesMatch = conversationData.patient_context.match(/Allergies: (.+?)(?:\r?\n|$)/);
+              const allergiesMatch = patientContext.match(/Allergies: (.+?)(?:\r?\n|$)/);
               if (allergiesMatch && allergiesMatch[1] !== "None") {
                 parsedPatientData.allergies = allergiesMatch[1].split(',').map((a: string) => a.trim());
               }
               
-              const medicationsMatch = conversationData.patient_context.match(/Current Medications: (.+?)(?:\r?\n|$)/);
+              const medicationsMatch = patientContext.match(/Current Medications: (.+?)(?:\r?\n|$)/);
               if (medicationsMatch && medicationsMatch[1] !== "None") {
                 parsedPatientData.medications = medicationsMatch[1].split(',').map((m: string) => m.trim());
               }
               
-              const conditionsMatch = conversationData.patient_context.match(/Medical Conditions: (.+?)(?:\r?\n|$)/);
+              const conditionsMatch = patientContext.match(/Medical Conditions: (.+?)(?:\r?\n|$)/);
               if (conditionsMatch && conditionsMatch[1] !== "None") {
                 parsedPatientData.conditions = conditionsMatch[1].split(',').map((c: string) => c.trim());
               }